@@ -0,0 +1,259 @@
+import logging
+import threading
+
+_logger = logging.getLogger(__name__)
+
+_BS_ABSENT = 0
+_BS_PRESENT = 1
+_BS_PENDING = 2
+
+
+class BlockMap(object):
+    """Tracks which fixed-size blocks of a sparse, local copy of a remote file
+    have actually been downloaded. Only the first (size) bytes are tracked;
+    anything past that never existed remotely and is always considered to be
+    present.
+
+    Whoever is going to download a block claims it first, which marks it as
+    pending. Anyone else who needs that block waits for it rather than
+    downloading it again.
+    """
+
+    def __init__(self, size, block_size, present=None):
+        self.__size = size
+        self.__block_size = block_size
+
+        if present is None:
+            self.__states = bytearray(self.__get_block_count(size))
+        else:
+            assert len(present) == self.__get_block_count(size), \
+                   "Block-presence data does not match the size."
+
+            self.__states = bytearray(present)
+
+        self.__present_count = self.__count_present()
+        self.__cv = threading.Condition(threading.Lock())
+
+    def __repr__(self):
+        return ("<BMAP SIZE=(%d) BLKSIZE=(%d) PRESENT=(%d)/(%d)>" %
+                (self.__size, self.__block_size, self.__present_count,
+                 len(self.__states)))
+
+    def __count_present(self):
+        return sum(1 for state in self.__states if state == _BS_PRESENT)
+
+    def __get_block_count(self, size):
+        return (size + self.__block_size - 1) // self.__block_size
+
+    def __get_block_span(self, offset, length):
+        """Return the first and last+1 indices of the blocks that overlap the
+        given range, or None if it's entirely outside what we track.
+        """
+
+        end = min(offset + length, self.__size)
+        if offset >= end:
+            return None
+
+        return (offset // self.__block_size,
+                (end - 1) // self.__block_size + 1)
+
+    def __build_range(self, start_block, stop_block):
+        start = start_block * self.__block_size
+        stop = min(stop_block * self.__block_size, self.__size)
+
+        return (start, stop - start)
+
+    def __find_runs(self, offset, length, state):
+        """Return the (offset, length) ranges of the runs of blocks within the
+        given range that have the given state.
+        """
+
+        span = self.__get_block_span(offset, length)
+        if span is None:
+            return []
+
+        (first_block, stop_block) = span
+
+        ranges = []
+        run_start = None
+        for i in range(first_block, stop_block):
+            if self.__states[i] != state:
+                if run_start is not None:
+                    ranges.append(self.__build_range(run_start, i))
+                    run_start = None
+            elif run_start is None:
+                run_start = i
+
+        if run_start is not None:
+            ranges.append(self.__build_range(run_start, stop_block))
+
+        return ranges
+
+    def __has_state(self, offset, length, state):
+        span = self.__get_block_span(offset, length)
+        if span is None:
+            return False
+
+        return state in self.__states[span[0]:span[1]]
+
+    def __set_states(self, offset, length, from_state, to_state,
+                     whole_only=False):
+        """Change the state of the blocks in the range that currently have
+        the given state. If whole_only is True, only blocks that are
+        completely covered by the range (or that are completed by the end of
+        the tracked size) are affected.
+        """
+
+        end = min(offset + length, self.__size)
+        if offset >= end:
+            return
+
+        if whole_only is True:
+            first_block = \
+                (offset + self.__block_size - 1) // self.__block_size
+
+            if end == self.__size:
+                stop_block = len(self.__states)
+            else:
+                stop_block = end // self.__block_size
+        else:
+            (first_block, stop_block) = self.__get_block_span(offset, length)
+
+        for i in range(first_block, stop_block):
+            if self.__states[i] == from_state:
+                self.__states[i] = to_state
+
+                if from_state == _BS_PRESENT:
+                    self.__present_count -= 1
+                elif to_state == _BS_PRESENT:
+                    self.__present_count += 1
+
+    def get_missing_ranges(self, offset, length):
+        """Return a list of (offset, length) tuples describing the runs of
+        absent blocks that overlap the given range. The ranges are aligned to
+        block boundaries, but clipped to the tracked size.
+        """
+
+        with self.__cv:
+            return self.__find_runs(offset, length, _BS_ABSENT)
+
+    def is_present(self, offset, length):
+        """Return True if all of the blocks in the range have been
+        downloaded.
+        """
+
+        with self.__cv:
+            return self.__has_state(offset, length, _BS_ABSENT) is False and \
+                   self.__has_state(offset, length, _BS_PENDING) is False
+
+    def claim_missing_ranges(self, offset, length):
+        """Like get_missing_ranges(), but the returned blocks are also marked
+        as pending. The caller must either mark them as present or abandon
+        them.
+        """
+
+        with self.__cv:
+            ranges = self.__find_runs(offset, length, _BS_ABSENT)
+
+            for (range_offset, range_length) in ranges:
+                self.__set_states(
+                    range_offset,
+                    range_length,
+                    _BS_ABSENT,
+                    _BS_PENDING)
+
+            return ranges
+
+    def abandon(self, offset, length):
+        """A claimed range could not be retrieved. Let someone else try."""
+
+        with self.__cv:
+            self.__set_states(offset, length, _BS_PENDING, _BS_ABSENT)
+            self.__cv.notify_all()
+
+    def wait_for_range(self, offset, length):
+        """Wait until none of the blocks in the range are pending. Returns
+        True if they're all present.
+        """
+
+        with self.__cv:
+            while self.__has_state(offset, length, _BS_PENDING) is True:
+                self.__cv.wait()
+
+            return self.__has_state(offset, length, _BS_ABSENT) is False
+
+    def mark_present(self, offset, length):
+        """Record that the given range has been downloaded. Only blocks that
+        are completely covered (or that are completed by the end of the
+        tracked size) are marked.
+        """
+
+        with self.__cv:
+            self.__set_states(offset, length, _BS_PENDING, _BS_PRESENT,
+                              whole_only=True)
+
+            self.__set_states(offset, length, _BS_ABSENT, _BS_PRESENT,
+                              whole_only=True)
+
+            self.__cv.notify_all()
+
+    def mark_written(self, offset, length):
+        """The given range is about to be written locally. Wait for anything
+        in-flight within it to land (so that it doesn't clobber the new data),
+        and then mark the blocks that the write completely covers as present.
+        """
+
+        with self.__cv:
+            while self.__has_state(offset, length, _BS_PENDING) is True:
+                self.__cv.wait()
+
+            self.__set_states(offset, length, _BS_ABSENT, _BS_PRESENT,
+                              whole_only=True)
+
+    def truncate(self, size):
+        """The local copy is being cut to the given size. Whatever was beyond
+        it, remotely, is no longer interesting, and anything that is later
+        written past it is local-only.
+        """
+
+        with self.__cv:
+            if size >= self.__size:
+                return
+
+            # Don't let anything in-flight land after we've cut the file.
+            cut_length = self.__size - size
+            while self.__has_state(size, cut_length, _BS_PENDING) is True:
+                self.__cv.wait()
+
+            block_count = self.__get_block_count(size)
+            del self.__states[block_count:]
+
+            self.__size = size
+            self.__present_count = self.__count_present()
+
+            self.__cv.notify_all()
+
+    @property
+    def size(self):
+        return self.__size
+
+    @property
+    def block_size(self):
+        return self.__block_size
+
+    @property
+    def present(self):
+        """A copy of the per-block presence flags (for persistence). Pending
+        blocks aren't present.
+        """
+
+        with self.__cv:
+            return bytes(bytearray(
+                    _BS_PRESENT if state == _BS_PRESENT else _BS_ABSENT
+                    for state
+                    in self.__states))
+
+    @property
+    def is_complete(self):
+        with self.__cv:
+            return self.__present_count == len(self.__states)
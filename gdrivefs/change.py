@@ -8,6 +8,8 @@ from gdrivefs.conf import Conf
 from gdrivefs.account_info import AccountInfo
 from gdrivefs.drive import get_gdrive
 from gdrivefs.volume import PathRelations, EntryCache
+from gdrivefs.content_cache import get_content_cache
+from gdrivefs.normal_entry import get_entry_version
 
 _logger = logging.getLogger(__name__)
 _logger.setLevel(logging.WARNING)
@@ -134,12 +136,13 @@ class _ChangeManager(object):
                       "and is-visible of [%s]",
                       change_id, entry_id, is_visible)
 
-        # First, remove any current knowledge from the system.
+        # First, remove any current knowledge from the system. This reflects
+        # the remote state, so any parent's listing stays complete.
 
         _logger.debug("Removing all trace of entry with ID [%s] "
                       "(apply_change).", entry_id)
 
-        PathRelations.get_instance().remove_entry_all(entry_id)
+        PathRelations.get_instance().remove_entry_all(entry_id, is_update=True)
 
         # If it wasn't deleted, add it back.
 
@@ -149,6 +152,14 @@ class _ChangeManager(object):
             path_relations = PathRelations.get_instance()
             path_relations.register_entry(entry)
 
+        # Cached content (including exports) for any other version is stale.
+        if was_deleted is False and entry is not None:
+            current_version = get_entry_version(entry)
+        else:
+            current_version = None
+
+        get_content_cache().invalidate(entry_id, current_version)
+
 _instance = None
 def get_change_manager():
     global _instance
@@ -23,7 +23,8 @@ class ChunkedDownload(object):
     """
 
     @util.positional(4)
-    def __init__(self, fd, http, uri, chunksize=DEFAULT_CHUNK_SIZE, start_at=0):
+    def __init__(self, fd, http, uri, chunksize=DEFAULT_CHUNK_SIZE, start_at=0,
+                 end_at=None):
         """Constructor.
 
         Args:
@@ -32,6 +33,9 @@ class ChunkedDownload(object):
           http: The httplib2 resource.
           uri: The URL to be downloaded.
           chunksize: int, File will be downloaded in chunks of this many bytes.
+          start_at: int, The offset to start downloading from.
+          end_at: int, If given, the offset to stop downloading at
+            (exclusive). Only the [start_at, end_at) range is requested.
         """
 
         self._fd = fd
@@ -39,6 +43,7 @@ class ChunkedDownload(object):
         self._uri = uri
         self._chunksize = chunksize
         self._progress = start_at
+        self._end_at = end_at
         self._total_size = None
         self._done = False
 
@@ -73,11 +78,18 @@ class ChunkedDownload(object):
             else:
                 this_chunk_size = min(self._chunksize, self._total_size - self._progress)
 
+            if self._end_at is None:
+                last_byte = self._progress + this_chunk_size
+            else:
+                # Range boundaries are inclusive.
+                last_byte = min(self._progress + this_chunk_size,
+                                self._end_at) - 1
+
             headers = {
                 'range':
                     'bytes=%d-%d' % (
                         self._progress,
-                        self._progress + this_chunk_size)
+                        last_byte)
             }
 
             _logger.debug("Attempting to read chunk. ATTEMPT=(%d)/(%d)",
@@ -186,7 +198,8 @@ class ChunkedDownload(object):
             _logger.debug("Checking if done. PROGRESS=(%d) TOTAL-SIZE=(%d)",
                           self._progress, self._total_size)
 
-            if self._progress == self._total_size:
+            if self._progress == self._total_size or \
+               (self._end_at is not None and self._progress >= self._end_at):
                 self._done = True
 
             return (apiclient.http.MediaDownloadProgress(
@@ -27,6 +27,27 @@ class Conf(object):
     file_jobthread_max_idle_time        = 60
     file_chunk_size_kb                  = 1024
     file_download_temp_max_age_s        = 86400
+    file_download_parallelism           = 4
+    file_download_range_size_kb         = 8192
+    file_sparse_reads                   = True
+    file_sparse_block_size_kb           = 1024
+    file_background_fill                = True
+    file_readahead_min_kb               = 1024
+    file_readahead_max_kb               = 16384
+    file_readahead_workers              = 4
+    file_write_back                     = False
+    file_write_back_max_staleness_s     = 30
+    file_write_back_journal_path        = None
+    file_deferred_create                = True
+    content_cache_path                  = None
+    content_cache_max_size_mb           = 1024
+    negative_lookup_cache_size          = 4096
+    negative_lookup_ttl_s               = 30
+    metadata_snapshot                   = True
+    metadata_snapshot_filepath          = None
+    metadata_snapshot_interval_s        = 300
+    metadata_bootstrap                  = False
+    metadata_bootstrap_page_size        = 1000
     change_check_frequency_s            = 3
     hidden_flags_list_local             = ['trashed', 'restricted']
     hidden_flags_list_remote            = ['trashed']
@@ -44,10 +65,6 @@ class Conf(object):
     default_perm_file_editable          = '666'
     default_perm_file_noneditable       = '444'
 
-    # How many extra entries to retrieve when an entry is accessed that is not
-    # currently cached.
-    max_readahead_entries = 10
-
     @staticmethod
     def get(key):
         return Conf.__dict__[key]
@@ -3,3 +3,6 @@ import os
 IS_DEBUG = bool(int(os.environ.get('GD_DEBUG', '0')))
 DO_LOG_FUSE_MESSAGES = bool(int(os.environ.get('GD_DO_LOG_FUSE_MESSAGES', '0')))
 DEFAULT_CREDENTIALS_FILEPATH = os.path.expandvars('$HOME/.gdfs/creds')
+DEFAULT_CONTENT_CACHE_PATH = os.path.expandvars('$HOME/.gdfs/cache')
+DEFAULT_WRITE_BACK_JOURNAL_PATH = os.path.expandvars('$HOME/.gdfs/journal')
+DEFAULT_METADATA_SNAPSHOT_FILEPATH = os.path.expandvars('$HOME/.gdfs/metadata.json.gz')
@@ -0,0 +1,462 @@
+"""A persistent, on-disk cache of file content. Content is keyed by the entry,
+the format that it was downloaded in, and the version of the entry, so a copy
+can be reused by any later open (even after a remount) for as long as the
+entry doesn't change.
+"""
+
+import logging
+import threading
+import collections
+import hashlib
+import base64
+import json
+import os
+import os.path
+
+import gdrivefs.config
+import gdrivefs.conf
+import gdrivefs.block_map
+import gdrivefs.drive
+
+from gdrivefs.normal_entry import get_entry_version
+
+_logger = logging.getLogger(__name__)
+
+_META_SUFFIX = '.meta'
+
+
+class CachedContent(object):
+    """A single, cached copy of an entry's content in a single format. The
+    content may be complete, or a sparse file that is being filled-in as it's
+    read (in which case `block_map` describes what's there).
+    """
+
+    def __init__(self, filepath, entry_id, mime_type, version):
+        self.filepath = filepath
+        self.entry_id = entry_id
+        self.mime_type = mime_type
+        self.version = version
+
+        self.is_complete = False
+        self.size = None
+        self.block_map = None
+
+        # The number of consumers currently using this content. Content that
+        # is in use is never evicted.
+        self.refcount = 0
+
+        # This content is being modified, and no longer reflects the version
+        # that it was cached under.
+        self.is_detached = False
+
+    def __repr__(self):
+        return ("<CC ENTRY=[%s] MIME=[%s] VER=[%s] COMPLETE=[%s] SIZE=(%s) "
+                "REFS=(%d)>" %
+                (self.entry_id, self.mime_type, self.version,
+                 self.is_complete, self.size, self.refcount))
+
+    @property
+    def meta_filepath(self):
+        return self.filepath + _META_SUFFIX
+
+    def set_sparse(self, size, block_size):
+        """Establish an empty, sparse file of the given size."""
+
+        with open(self.filepath, 'r+b') as f:
+            f.truncate(size)
+
+        self.size = size
+        self.block_map = gdrivefs.block_map.BlockMap(size, block_size)
+
+    def set_complete(self, size):
+        """The whole content is now present."""
+
+        self.size = size
+        self.block_map = None
+        self.is_complete = True
+
+    def check_complete(self):
+        """Fold a completely-filled block-map into a plain, complete copy."""
+
+        if self.is_complete is False and \
+           self.block_map is not None and \
+           self.block_map.is_complete is True:
+            self.set_complete(self.size)
+
+        return self.is_complete
+
+    def get_state(self):
+        state = {
+            'entry_id': self.entry_id,
+            'mime_type': self.mime_type,
+            'version': self.version,
+            'is_complete': self.is_complete,
+            'size': self.size,
+        }
+
+        if self.block_map is not None:
+            state['block_size'] = self.block_map.block_size
+            state['present'] = \
+                base64.b64encode(self.block_map.present).decode('ascii')
+
+        return state
+
+    def set_state(self, state):
+        self.is_complete = state['is_complete']
+        self.size = state['size']
+
+        if 'present' in state:
+            present = base64.b64decode(state['present'].encode('ascii'))
+
+            self.block_map = \
+                gdrivefs.block_map.BlockMap(
+                    self.size,
+                    state['block_size'],
+                    present=present)
+
+
+class _ContentCache(object):
+    """Manages the content-cache directory. Unused content is evicted, least-
+    recently-used first, once the cache exceeds its byte budget.
+    """
+
+    def __init__(self, path, max_size_b):
+        self.__path = path
+        self.__max_size_b = max_size_b
+        self.__locker = threading.RLock()
+        self.__detached_count = 0
+
+        # Keyed by filename, in order of use (oldest first). Values are
+        # CachedContent objects.
+        self.__index = collections.OrderedDict()
+
+        # The sizes that we last measured on disk, by filename.
+        self.__sizes = {}
+
+        if os.path.exists(self.__path) is False:
+            os.makedirs(self.__path, 0o700)
+
+        self.__load()
+
+        _logger.debug("Content cache established at [%s] with (%d) entries "
+                      "and a budget of (%d) bytes.",
+                      self.__path, len(self.__index), self.__max_size_b)
+
+    def __get_filename(self, entry_id, mime_type, version):
+        phrase = '\0'.join([entry_id, mime_type, version]).encode('utf-8')
+        return entry_id + '.' + hashlib.sha1(phrase).hexdigest()
+
+    def __measure(self, filepath):
+        try:
+            st = os.stat(filepath)
+        except OSError:
+            return 0
+
+        # Our files are often sparse, so count what's actually allocated.
+        return st.st_blocks * 512
+
+    def __get_sidecar_filepaths(self, filepath):
+        """Return the files that transfers of the given content keep next to
+        it.
+        """
+
+        return [
+            gdrivefs.drive.get_upload_session_filepath(filepath),
+            gdrivefs.drive.get_download_progress_filepath(filepath),
+        ]
+
+    def __remove_files(self, filepath):
+        for current_filepath in \
+                [filepath, filepath + _META_SUFFIX] + \
+                self.__get_sidecar_filepaths(filepath):
+            try:
+                os.unlink(current_filepath)
+            except OSError:
+                pass
+
+    def __load(self):
+        """Recover the index from what's on disk. Data without metadata is
+        what's left of content that was being modified when we went down, and
+        is discarded.
+        """
+
+        filenames = set(os.listdir(self.__path))
+
+        sidecar_filenames = set()
+        for filename in filenames:
+            filepath = os.path.join(self.__path, filename)
+            for sidecar_filepath in self.__get_sidecar_filepaths(filepath):
+                sidecar_filenames.add(os.path.basename(sidecar_filepath))
+
+        loaded = []
+        for filename in filenames:
+            if filename.endswith(_META_SUFFIX) is True:
+                if filename[:-len(_META_SUFFIX)] not in filenames:
+                    os.unlink(os.path.join(self.__path, filename))
+
+                continue
+
+            # These go with the data that they're next to.
+            if filename in sidecar_filenames:
+                continue
+
+            filepath = os.path.join(self.__path, filename)
+            meta_filepath = filepath + _META_SUFFIX
+
+            try:
+                with open(meta_filepath) as f:
+                    state = json.load(f)
+
+                content = CachedContent(
+                            filepath,
+                            state['entry_id'],
+                            state['mime_type'],
+                            state['version'])
+
+                content.set_state(state)
+                mtime = os.stat(meta_filepath).st_mtime
+            except (IOError, OSError, ValueError, KeyError, AssertionError):
+                _logger.warning("Discarding unusable cached content: [%s]",
+                                filepath)
+
+                self.__remove_files(filepath)
+                continue
+
+            loaded.append((mtime, filename, content))
+
+        # The metadata is rewritten whenever content is released, so its mtime
+        # reflects when the content was last used.
+        for (mtime, filename, content) in sorted(loaded, key=lambda x: x[0]):
+            self.__index[filename] = content
+            self.__sizes[filename] = self.__measure(content.filepath)
+
+    def __write_state(self, content):
+        temp_filepath = content.meta_filepath + '.new'
+
+        with open(temp_filepath, 'w') as f:
+            json.dump(content.get_state(), f)
+
+        os.rename(temp_filepath, content.meta_filepath)
+
+    def acquire(self, normalized_entry, mime_type):
+        """Return the cached content for the current version of the entry in
+        the given format. If there's nothing cached, yet, an empty record is
+        returned. The content has to be released, later.
+        """
+
+        version = get_entry_version(normalized_entry)
+        filename = self.__get_filename(normalized_entry.id, mime_type, version)
+
+        with self.__locker:
+            try:
+                content = self.__index.pop(filename)
+            except KeyError:
+                filepath = os.path.join(self.__path, filename)
+
+                # Remove anything left-over from an uncached prior attempt.
+                with open(filepath, 'wb'):
+                    pass
+
+                content = CachedContent(
+                            filepath,
+                            normalized_entry.id,
+                            mime_type,
+                            version)
+
+                self.__write_state(content)
+                self.__sizes[filename] = 0
+
+                _logger.debug("Content for [%s] in [%s] (%s) is not cached.",
+                              normalized_entry.id, mime_type, version)
+            else:
+                _logger.debug("Content for [%s] in [%s] (%s) is cached: %s",
+                              normalized_entry.id, mime_type, version, content)
+
+            # Move it to the most-recently-used end.
+            self.__index[filename] = content
+            content.refcount += 1
+
+        return content
+
+    def release(self, content):
+        """A consumer is done with the content. Detached content that is no
+        longer used is discarded.
+        """
+
+        with self.__locker:
+            content.refcount -= 1
+            assert content.refcount >= 0, \
+                   "Content was released more times than it was acquired."
+
+            if content.refcount > 0:
+                return
+
+            filename = os.path.basename(content.filepath)
+
+            if content.is_detached is True:
+                _logger.debug("Discarding detached content: %s", content)
+
+                self.__remove_files(content.filepath)
+                return
+
+            content.check_complete()
+            self.__write_state(content)
+
+            self.__sizes[filename] = self.__measure(content.filepath)
+
+            self.__trim()
+
+    def detach(self, content):
+        """The content is about to be modified locally, so it no longer
+        represents the version that it was cached under. Nobody else should
+        find it.
+        """
+
+        with self.__locker:
+            if content.is_detached is True:
+                return
+
+            self.__detach(content)
+
+    def __detach(self, content):
+        """Take the content out of the index. The lock must be held."""
+
+        filename = os.path.basename(content.filepath)
+
+        del self.__index[filename]
+        del self.__sizes[filename]
+
+        os.unlink(content.meta_filepath)
+
+        # Move the data out of the way of anyone that acquires the original
+        # version after us. Without metadata, it'll be discarded at the next
+        # startup if we never get to clean it up.
+        self.__detached_count += 1
+
+        detached_filepath = \
+            '%s.detached.%d' % (content.filepath, self.__detached_count)
+
+        os.rename(content.filepath, detached_filepath)
+
+        content.filepath = detached_filepath
+        content.is_detached = True
+
+    def invalidate(self, entry_id, current_version=None):
+        """The entry has changed (or is gone, if there's no current version).
+        Drop whatever we have for any other version of it. Content that's
+        still in use is discarded once it's released.
+        """
+
+        with self.__locker:
+            stale = [content
+                     for content
+                     in self.__index.values()
+                     if content.entry_id == entry_id and
+                        content.version != current_version]
+
+            for content in stale:
+                _logger.debug("Dropping stale content: %s", content)
+
+                if content.refcount > 0:
+                    self.__detach(content)
+                else:
+                    filename = os.path.basename(content.filepath)
+
+                    del self.__index[filename]
+                    del self.__sizes[filename]
+
+                    self.__remove_files(content.filepath)
+
+    def attach(self, content, normalized_entry):
+        """The (complete) local content now represents the given version of
+        the entry (usually right after we've uploaded it). Cache it under that
+        version.
+        """
+
+        version = get_entry_version(normalized_entry)
+        filename = self.__get_filename(normalized_entry.id, content.mime_type,
+                                       version)
+
+        filepath = os.path.join(self.__path, filename)
+
+        with self.__locker:
+            if content.is_detached is False:
+                old_filename = os.path.basename(content.filepath)
+
+                del self.__index[old_filename]
+                del self.__sizes[old_filename]
+
+                os.unlink(content.meta_filepath)
+
+            # If some other copy was already cached under this version, ours
+            # replaces it. If it's still in use, its data has to move out of
+            # the way of ours.
+            replaced = self.__index.get(filename)
+            if replaced is not None:
+                _logger.debug("Replacing cached content: %s", replaced)
+
+                if replaced.refcount > 0:
+                    self.__detach(replaced)
+                else:
+                    del self.__index[filename]
+                    del self.__sizes[filename]
+
+                    self.__remove_files(replaced.filepath)
+
+            os.rename(content.filepath, filepath)
+
+            content.filepath = filepath
+            content.version = version
+            content.is_detached = False
+            content.set_complete(os.path.getsize(filepath))
+
+            self.__write_state(content)
+
+            self.__index[filename] = content
+            self.__sizes[filename] = self.__measure(filepath)
+
+        _logger.debug("Content attached as new version: %s", content)
+
+    def __trim(self):
+        """Evict unused content, oldest first, until we're within budget."""
+
+        total_size_b = sum(self.__sizes.values())
+        if total_size_b <= self.__max_size_b:
+            return
+
+        for filename, content in list(self.__index.items()):
+            if total_size_b <= self.__max_size_b:
+                break
+
+            if content.refcount > 0:
+                continue
+
+            _logger.debug("Evicting cached content: %s", content)
+
+            total_size_b -= self.__sizes.pop(filename)
+            del self.__index[filename]
+
+            self.__remove_files(content.filepath)
+
+    @property
+    def path(self):
+        return self.__path
+
+_instance = None
+_instance_lock = threading.Lock()
+def get_content_cache():
+    global _instance
+
+    with _instance_lock:
+        if _instance is None:
+            path = gdrivefs.conf.Conf.get('content_cache_path')
+            if path is None:
+                path = gdrivefs.config.DEFAULT_CONTENT_CACHE_PATH
+
+            max_size_b = \
+                int(gdrivefs.conf.Conf.get('content_cache_max_size_mb')) * \
+                1024 * 1024
+
+            _instance = _ContentCache(path, max_size_b)
+
+    return _instance
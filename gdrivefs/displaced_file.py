@@ -1,7 +1,6 @@
 import logging
+import threading
 import json
-import tempfile
-import os
 
 from os import makedirs
 from os.path import isdir
@@ -9,9 +8,25 @@ from os.path import isdir
 from gdrivefs.drive import get_gdrive
 from gdrivefs.normal_entry import NormalEntry
 from gdrivefs.conf import Conf
+from gdrivefs.content_cache import get_content_cache
+from gdrivefs.worker_pool import WorkerPool
 
 _logger = logging.getLogger(__name__)
 
+# Exports are retrieved in the background by this many workers.
+_EXPORT_WORKERS = 2
+
+_EXPORT_POOL_LOCK = threading.Lock()
+_EXPORT_POOL = None
+def _get_export_pool():
+    global _EXPORT_POOL
+
+    with _EXPORT_POOL_LOCK:
+        if _EXPORT_POOL is None:
+            _EXPORT_POOL = WorkerPool('export', _EXPORT_WORKERS)
+
+    return _EXPORT_POOL
+
 
 class DisplacedFile(object):
     normalized_entry = None
@@ -22,36 +37,74 @@ class DisplacedFile(object):
                "DisplacedFile can not wrap a non-NormalEntry object."
 
         self.__normalized_entry = normalized_entry
-        self.__filepath = tempfile.NamedTemporaryFile(delete=False).name
-
-    def __del__(self):
-        os.unlink(self.__filepath)
 
     def deposit_file(self, mime_type):
-        """Write the file to a temporary path, and present a stub (JSON) to the 
-        user. This is the only way of getting files that don't have a 
-        well-defined filesize without providing a type, ahead of time.
+        """Write the file to the content-cache (if the current version isn't
+        already there), and present a stub (JSON) to the user. This is the only
+        way of getting files that don't have a well-defined filesize without
+        providing a type, ahead of time.
         """
 
-        gd = get_gdrive()
+        cc = get_content_cache()
+        content = cc.acquire(self.__normalized_entry, mime_type)
+
+        try:
+            if content.is_complete is False:
+                gd = get_gdrive()
 
-        result = gd.download_to_local(
-                    self.__filepath, 
-                    self.__normalized_entry,
-                    mime_type)
+                result = gd.download_to_local(
+                            content.filepath,
+                            self.__normalized_entry,
+                            mime_type,
+                            allow_cache=False)
 
-        (length, cache_fault) = result
+                (length, cache_fault) = result
+                content.set_complete(length)
+        finally:
+            cc.release(content)
 
         _logger.debug("Displaced entry [%s] deposited to [%s] with length "
-                      "(%d).", self.__normalized_entry, self.__filepath, length)
+                      "(%d).", self.__normalized_entry, content.filepath,
+                      content.size)
+
+        return self.get_stub(mime_type, content.size, content.filepath)
+
+    def deposit_stub(self, mime_type):
+        """Present a stub without waiting for the export. If the current
+        version isn't already in the content-cache, only its size is
+        retrieved, and the export is written to the file-path in the
+        background.
+        """
+
+        cc = get_content_cache()
+        content = cc.acquire(self.__normalized_entry, mime_type)
+
+        try:
+            if content.is_complete is True:
+                return self.get_stub(mime_type, content.size,
+                                     content.filepath)
+
+            file_path = content.filepath
+        finally:
+            cc.release(content)
+
+        gd = get_gdrive()
+        file_size = gd.get_export_size(self.__normalized_entry, mime_type)
+
+        _logger.debug("Exporting entry [%s] as [%s] in the background.",
+                      self.__normalized_entry, mime_type)
+
+        _get_export_pool().submit(self.deposit_file, mime_type)
 
-        return self.get_stub(mime_type, length, self.__filepath)
+        return self.get_stub(mime_type, file_size, file_path,
+                             is_complete=False)
 
-    def get_stub(self, mime_type, file_size=0, file_path=None):
+    def get_stub(self, mime_type, file_size=0, file_path=None,
+                 is_complete=True):
         """Return the content for an info ("stub") file."""
 
         if file_size == 0 and \
-           self.__normalized_entry.requires_displaceable is False:
+           self.__normalized_entry.requires_mimetype is False:
             file_size = self.__normalized_entry.file_size
 
         stub_data = {
@@ -63,7 +116,8 @@ class DisplacedFile(object):
                 'FinalMimeType':        mime_type,
                 'Length':               file_size,
                 'RequiresMimeType':     self.__normalized_entry.requires_mimetype,
-                'ImageMediaMetadata':   self.__normalized_entry.image_media_metadata
+                'ImageMediaMetadata':   self.__normalized_entry.image_media_metadata,
+                'IsComplete':           is_complete,
             }
 
         if file_path:
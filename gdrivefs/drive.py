@@ -9,7 +9,10 @@ import tempfile
 import pprint
 import functools
 import threading
+import socket
+import shutil
 import os
+import collections
 
 import httplib2
 
@@ -26,6 +29,7 @@ import gdrivefs.oauth_authorize
 import gdrivefs.normal_entry
 import gdrivefs.time_support
 import gdrivefs.fsutility
+import gdrivefs.worker_pool
 
 try:
     # Python 3
@@ -37,12 +41,72 @@ except ImportError:
 else:
     _BAD_STATUS_LINE_EXCEPTION = http.client.BadStatusLine
 
+# Failures of a single upload chunk that are worth another try (the server
+# tells us how much it got, and we continue from there).
+_TRANSIENT_UPLOAD_EXCEPTIONS = (
+    ssl.SSLError,
+    socket.error,
+    httplib2.HttpLib2Error,
+    _BAD_STATUS_LINE_EXCEPTION,
+)
+
+_TRANSIENT_UPLOAD_STATUSES = (500, 502, 503, 504)
+
 _CONF_SERVICE_NAME = 'drive'
 _CONF_SERVICE_VERSION = 'v2'
 
 _MAX_EMPTY_CHUNKS = 3
 _DEFAULT_UPLOAD_CHUNK_SIZE_B = 1024 * 1024
 
+# Upload chunks have to be multiples of 256K, which halving and doubling the
+# default preserves.
+_MIN_UPLOAD_CHUNK_SIZE_B = 256 * 1024
+_MAX_UPLOAD_CHUNK_SIZE_B = 64 * 1024 * 1024
+
+# The upload chunk-size is adjusted so that a chunk takes about this long.
+_UPLOAD_CHUNK_TARGET_S = 4
+
+_MAX_UPLOAD_CHUNK_ATTEMPTS = 5
+
+_UPLOAD_SESSION_SUFFIX = '.upload'
+
+_DOWNLOAD_PROGRESS_SUFFIX = '.partial'
+
+# How much of a serial download lands between progress records.
+_DOWNLOAD_PROGRESS_INTERVAL_B = 8 * 1024 * 1024
+_MAX_RANGE_CHUNK_SIZE_B = 4 * 1024 * 1024
+
+# How many times a range of a parallel download is attempted before the whole
+# download fails.
+_MAX_RANGE_ATTEMPTS = 3
+
+# The most requests that we'll put into one batch request.
+_MAX_BATCH_SIZE = 100
+
+# The fields of a file resource that NormalEntry uses.
+_LISTED_ENTRY_FIELDS = (
+    'id',
+    'title',
+    'mimeType',
+    'labels',
+    'parents(id)',
+    'lastModifyingUserName',
+    'writersCanShare',
+    'ownerNames',
+    'editable',
+    'userPermission',
+    'embedLink',
+    'fileSize',
+    'fileExtension',
+    'md5Checksum',
+    'imageMediaMetadata',
+    'exportLinks',
+    'downloadUrl',
+    'modifiedDate',
+    'modifiedByMeDate',
+    'lastViewedByMeDate',
+)
+
 logging.getLogger('apiclient.discovery').setLevel(logging.WARNING)
 
 _logger = logging.getLogger(__name__)
@@ -118,6 +182,423 @@ def _marshall(f):
     return wrapper
 
 
+class _PositionalWriter(object):
+    """A file-like object that writes at successive positions of a file
+    without moving the file-position (so that any number of these can write to
+    different parts of the same file at the same time).
+    """
+
+    def __init__(self, fd, offset):
+        self.__fd = fd
+        self.__offset = offset
+
+    def write(self, data):
+        try:
+            os_pwrite = os.pwrite
+        except AttributeError:
+            # Python 2, which has no positional writes.
+            os.lseek(self.__fd, self.__offset, os.SEEK_SET)
+            written = os.write(self.__fd, data)
+        else:
+            written = os_pwrite(self.__fd, data, self.__offset)
+
+        assert written == len(data), \
+               "Short write of downloaded data."
+
+        self.__offset += written
+
+    def tell(self):
+        return self.__offset
+
+_DOWNLOAD_POOL_LOCK = threading.Lock()
+_DOWNLOAD_POOL = None
+def _get_download_pool():
+    global _DOWNLOAD_POOL
+
+    with _DOWNLOAD_POOL_LOCK:
+        if _DOWNLOAD_POOL is None:
+            num_workers = \
+                int(gdrivefs.conf.Conf.get('file_download_parallelism'))
+
+            _DOWNLOAD_POOL = \
+                gdrivefs.worker_pool.WorkerPool('download', num_workers)
+
+    return _DOWNLOAD_POOL
+
+def _split_ranges(ranges, max_length):
+    """Break the (offset, length) ranges into pieces no larger than the given
+    length.
+    """
+
+    pieces = []
+    for (offset, length) in ranges:
+        end = offset + length
+        while offset < end:
+            piece_length = min(max_length, end - offset)
+            pieces.append((offset, piece_length))
+            offset += piece_length
+
+    return pieces
+
+
+class _UploadChunkSizer(object):
+    """Decides the chunk-size for uploads. It grows while chunks go quickly
+    (so that fast links aren't dominated by round-trips), and shrinks when
+    they're slow or fail (so that less has to be resent).
+    """
+
+    def __init__(self):
+        self.__locker = threading.Lock()
+        self.__chunk_size_b = _DEFAULT_UPLOAD_CHUNK_SIZE_B
+
+    def __set(self, chunk_size_b):
+        if chunk_size_b != self.__chunk_size_b:
+            _logger.debug("Upload chunk-size is now (%d) bytes.",
+                          chunk_size_b)
+
+            self.__chunk_size_b = chunk_size_b
+
+    def record_chunk(self, length, elapsed_s):
+        with self.__locker:
+            # A short, final chunk doesn't tell us anything.
+            if length < self.__chunk_size_b:
+                return
+
+            if elapsed_s < _UPLOAD_CHUNK_TARGET_S / 2.0:
+                self.__set(min(self.__chunk_size_b * 2,
+                               _MAX_UPLOAD_CHUNK_SIZE_B))
+            elif elapsed_s > _UPLOAD_CHUNK_TARGET_S * 2:
+                self.__set(max(self.__chunk_size_b // 2,
+                               _MIN_UPLOAD_CHUNK_SIZE_B))
+
+    def record_failure(self):
+        with self.__locker:
+            self.__set(max(self.__chunk_size_b // 2,
+                           _MIN_UPLOAD_CHUNK_SIZE_B))
+
+    @property
+    def chunk_size_b(self):
+        return self.__chunk_size_b
+
+_UPLOAD_CHUNK_SIZER = _UploadChunkSizer()
+
+
+class _AdaptiveFileUpload(apiclient.http.MediaFileUpload):
+    """A resumable file-upload whose chunk-size is decided as it goes."""
+
+    def __init__(self, filepath, mime_type):
+        super(_AdaptiveFileUpload, self).__init__(
+            filepath,
+            mimetype=mime_type,
+            resumable=True,
+            chunksize=_UPLOAD_CHUNK_SIZER.chunk_size_b)
+
+    def chunksize(self):
+        return _UPLOAD_CHUNK_SIZER.chunk_size_b
+
+
+def get_upload_session_filepath(data_filepath):
+    """Return where the upload session for the given data is recorded."""
+
+    return data_filepath + _UPLOAD_SESSION_SUFFIX
+
+
+class _UploadSession(object):
+    """The record of a resumable upload, kept next to the data being
+    uploaded. If the upload is interrupted (even by a restart), the next
+    upload of the same, unchanged data continues from whatever the server has
+    acknowledged.
+    """
+
+    def __init__(self, data_filepath, target):
+        self.__filepath = get_upload_session_filepath(data_filepath)
+
+        st = os.stat(data_filepath)
+
+        # The session is only good for the same request with the same data.
+        self.__state = {
+            'target': target,
+            'size': st.st_size,
+            'mtime': st.st_mtime,
+        }
+
+        self.__uri = None
+
+    def __get_recorded_uri(self):
+        try:
+            with open(self.__filepath) as f:
+                recorded = json.load(f)
+        except (IOError, OSError, ValueError):
+            return None
+
+        for key, value in self.__state.items():
+            if recorded.get(key) != value:
+                return None
+
+        return recorded.get('uri')
+
+    def resume(self, request):
+        """Point the request at the recorded session, if there is one. If
+        that upload had actually finished, return its result.
+        """
+
+        uri = self.__get_recorded_uri()
+        if uri is None:
+            return None
+
+        headers = {
+            'Content-Range': 'bytes */%d' % (self.__state['size'],),
+            'Content-Length': '0',
+        }
+
+        try:
+            resp, content = request.http.request(uri, 'PUT', headers=headers)
+        except _TRANSIENT_UPLOAD_EXCEPTIONS:
+            _logger.exception("Could not check upload session. Starting a "
+                              "new one.")
+            return None
+
+        if resp.status in (200, 201):
+            _logger.info("Recorded upload already finished.")
+            return request.postproc(resp, content)
+        elif resp.status != 308:
+            # It has probably expired.
+            _logger.info("Recorded upload session is no longer usable (%d).",
+                         resp.status)
+
+            self.remove()
+            return None
+
+        if 'range' in resp:
+            progress = int(resp['range'].split('-')[1]) + 1
+        else:
+            progress = 0
+
+        _logger.info("Resuming upload at (%d) of (%d) bytes.",
+                     progress, self.__state['size'])
+
+        request.resumable_uri = uri
+        request.resumable_progress = progress
+        self.__uri = uri
+
+        return None
+
+    def record(self, request):
+        """Record the session once the request has one."""
+
+        if request.resumable_uri is None or \
+           request.resumable_uri == self.__uri:
+            return
+
+        state = dict(self.__state)
+        state['uri'] = request.resumable_uri
+
+        temp_filepath = self.__filepath + '.new'
+        with open(temp_filepath, 'w') as f:
+            json.dump(state, f)
+
+        os.rename(temp_filepath, self.__filepath)
+        self.__uri = request.resumable_uri
+
+    def remove(self):
+        try:
+            os.unlink(self.__filepath)
+        except OSError:
+            pass
+
+
+def get_download_progress_filepath(output_file_path):
+    """Return where the progress of a download to the given file is
+    recorded.
+    """
+
+    return output_file_path + _DOWNLOAD_PROGRESS_SUFFIX
+
+
+class _DownloadProgress(object):
+    """The record of which parts of a download have landed in the output
+    file, kept next to it. Data is only counted once it has been synced, so a
+    later attempt (even after a restart) can skip it as long as the entry
+    hasn't changed.
+    """
+
+    def __init__(self, output_file_path, normalized_entry, mime_type):
+        self.__output_file_path = output_file_path
+        self.__filepath = get_download_progress_filepath(output_file_path)
+        self.__locker = threading.Lock()
+
+        # The data is only good for the same version in the same format.
+        self.__state = {
+            'version': gdrivefs.normal_entry.get_entry_version(
+                            normalized_entry),
+            'mime_type': mime_type,
+        }
+
+        self.__ranges = []
+
+    def load(self):
+        """Return the (offset, length) ranges that were already retrieved.
+        """
+
+        try:
+            with open(self.__filepath) as f:
+                recorded = json.load(f)
+
+            size = os.path.getsize(self.__output_file_path)
+        except (IOError, OSError, ValueError):
+            return []
+
+        for key, value in self.__state.items():
+            if recorded.get(key) != value:
+                return []
+
+        ranges = [(offset, length)
+                  for (offset, length)
+                  in recorded.get('ranges', [])
+                  if offset + length <= size]
+
+        with self.__locker:
+            self.__ranges = ranges
+
+        return list(ranges)
+
+    def record(self, offset, length):
+        """The given range has landed. Sync it, and then count it."""
+
+        fd = os.open(self.__output_file_path, os.O_RDONLY)
+
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+        with self.__locker:
+            # A serial download just keeps extending the same range.
+            if self.__ranges and self.__ranges[-1][0] == offset:
+                self.__ranges[-1] = (offset, length)
+            else:
+                self.__ranges.append((offset, length))
+
+            state = dict(self.__state)
+            state['ranges'] = self.__ranges
+
+            temp_filepath = self.__filepath + '.new'
+            with open(temp_filepath, 'w') as f:
+                json.dump(state, f)
+
+            os.rename(temp_filepath, self.__filepath)
+
+    def remove(self):
+        try:
+            os.unlink(self.__filepath)
+        except OSError:
+            pass
+
+
+def _get_missing_ranges(total_size, ranges):
+    """Return the parts of [0, total_size) not covered by the given ranges.
+    """
+
+    missing = []
+    position = 0
+    for (offset, length) in sorted(ranges):
+        if offset > position:
+            missing.append((position, offset - position))
+
+        position = max(position, offset + length)
+
+    if position < total_size:
+        missing.append((position, total_size - position))
+
+    return missing
+
+
+class _Flight(object):
+    """A single attempt, and how many callers besides the first are still
+    using its result.
+    """
+
+    def __init__(self, job):
+        self.job = job
+        self.follower_count = 0
+
+
+class _SingleFlight(object):
+    """Lets concurrent callers that want the same thing share a single
+    attempt at getting it. The first caller does the work. The others wait
+    for it, and get its result (or its exception). Whatever the others do
+    with the result is done before the first caller returns, in case the
+    result is only good for as long as the first caller is using it.
+    """
+
+    def __init__(self, name):
+        self.__name = name
+        self.__cv = threading.Condition()
+        self.__in_flight = {}
+
+    def do(self, key, f, args, follow=None):
+        """Return the result of the given callable, or of the one that's
+        already running for the same key. If it was already running, the
+        result is passed through `follow` (if given), first.
+        """
+
+        with self.__cv:
+            flight = self.__in_flight.get(key)
+            is_leader = flight is None
+
+            if is_leader is True:
+                job = gdrivefs.worker_pool.Job(f, args, {})
+                flight = _Flight(job)
+                self.__in_flight[key] = flight
+            else:
+                flight.follower_count += 1
+
+        if is_leader is True:
+            try:
+                flight.job.run()
+            finally:
+                with self.__cv:
+                    # Nobody else can join, now. Anyone who already has has to
+                    # be done with the result before we can return it.
+                    del self.__in_flight[key]
+
+                    while flight.follower_count > 0:
+                        self.__cv.wait()
+
+            return flight.job.wait()
+
+        _logger.debug("Waiting on in-flight [%s]: %s", self.__name, key)
+
+        try:
+            result = flight.job.wait()
+
+            if follow is not None:
+                result = follow(result)
+
+            return result
+        finally:
+            with self.__cv:
+                flight.follower_count -= 1
+                self.__cv.notify_all()
+
+_DOWNLOADS_IN_FLIGHT = _SingleFlight('download')
+
+def _copy_shared_download(normalized_entry, output_file_path, shared):
+    """We shared someone else's download of the entry. Copy it to where we
+    wanted it.
+    """
+
+    (shared_file_path, result) = shared
+
+    if shared_file_path != output_file_path:
+        _logger.debug("Copying shared download of entry [%s] from [%s].",
+                      normalized_entry.id, shared_file_path)
+
+        shutil.copy2(shared_file_path, output_file_path)
+
+    return (output_file_path, result)
+
+
 class GdriveAuth(object):
     def __init__(self):
         self.__client = None
@@ -259,20 +740,6 @@ class _GdriveManager(object):
 
         return (largest_change_id, next_page_token, changes)
 
-    @_marshall
-    def get_parents_containing_id(self, child_id, max_results=None):
-
-        _logger.info("Getting client for parent-listing.")
-
-        client = self.__auth.get_client()
-
-        _logger.info("Listing entries over child with ID [%s].", child_id)
-
-        response = client.parents().list(fileId=child_id).execute()
-        self.__assert_response_kind(response, 'drive#parentList')
-
-        return [ entry['id'] for entry in response['items'] ]
-
     @_marshall
     def get_children_under_parent_id(self,
                                      parent_id,
@@ -313,46 +780,146 @@ class _GdriveManager(object):
 
     @_marshall
     def get_entries(self, entry_ids):
+        """Read several entries, using as few (batch) requests as possible.
+        """
+
+        client = self.__auth.get_client()
+
         retrieved = { }
-        for entry_id in entry_ids:
-            retrieved[entry_id] = self.get_entry(entry_id)
+        errors = [ ]
+        def store(entry_id, response, exception):
+            if exception is not None:
+                errors.append(exception)
+                return
+
+            self.__assert_response_kind(response, 'drive#file')
+
+            retrieved[entry_id] = \
+                gdrivefs.normal_entry.NormalEntry('direct_read', response)
+
+        # Each ID has to be unique within a batch.
+        entry_ids = list(collections.OrderedDict.fromkeys(entry_ids))
+
+        for i in range(0, len(entry_ids), _MAX_BATCH_SIZE):
+            batch = client.new_batch_http_request(callback=store)
+
+            for entry_id in entry_ids[i:i + _MAX_BATCH_SIZE]:
+                batch.add(
+                    client.files().get(fileId=entry_id),
+                    request_id=entry_id)
+
+            batch.execute()
+
+            # Let the same handling as for any other request (retries,
+            # reauthorization) happen.
+            if errors:
+                raise errors[0]
 
         _logger.debug("(%d) entries were retrieved.", len(retrieved))
 
         return retrieved
 
     @_marshall
-    def get_entry(self, entry_id):
+    def get_entry_resource(self, entry_id):
+        """Return the file resource exactly as Drive describes it."""
+
         client = self.__auth.get_client()
 
         response = client.files().get(fileId=entry_id).execute()
         self.__assert_response_kind(response, 'drive#file')
 
+        return response
+
+    def get_entry(self, entry_id):
+        response = self.get_entry_resource(entry_id)
+
         return \
             gdrivefs.normal_entry.NormalEntry('direct_read', response)
 
+    @_marshall
+    def __get_files_page(self, query, page_token, page_size, fields):
+        client = self.__auth.get_client()
+
+        result = client.files().list(
+                    q=query,
+                    pageToken=page_token,
+                    maxResults=page_size,
+                    fields=fields).execute()
+
+        self.__assert_response_kind(result, 'drive#fileList')
+
+        entries = []
+        for entry_raw in result['items']:
+            # Empty fields might be left out, with a field mask.
+            entry_raw.setdefault('parents', [])
+
+            entry = gdrivefs.normal_entry.NormalEntry('list_all', entry_raw)
+            entries.append(entry)
+
+        return (entries, result.get('nextPageToken'))
+
+    def iterate_all_files(self, page_size):
+        """Yield every file in the account that we wouldn't ignore, a page
+        (list) at a time. Only the fields that we actually use are requested.
+        """
+
+        hidden_flags = gdrivefs.conf.Conf.get('hidden_flags_list_remote')
+        query_components = [("%s = false" % (hidden_flag))
+                            for hidden_flag
+                            in (hidden_flags or [])]
+
+        query = ' and '.join(query_components) if query_components else None
+        fields = 'kind,nextPageToken,items(%s)' % \
+                 (','.join(_LISTED_ENTRY_FIELDS),)
+
+        page_token = None
+        page_num = 0
+        while 1:
+            (entries, page_token) = \
+                self.__get_files_page(query, page_token, page_size, fields)
+
+            _logger.debug("(%d) entries were presented for page-number (%d) "
+                          "of all files.", len(entries), page_num)
+
+            yield entries
+
+            if page_token is None:
+                break
+
+            page_num += 1
+
     @_marshall
     def list_files(self, query_contains_string=None, query_is_string=None,
-                   parent_id=None):
+                   parent_id=None, parent_ids=None):
+        """List files. If several parents are given, the children of all of
+        them are listed together.
+        """
+
+        if parent_id:
+            parent_ids = [parent_id]
 
         _logger.info("Listing all files. CONTAINS=[%s] IS=[%s] "
-                     "PARENT_ID=[%s]",
+                     "PARENT_IDS=[%s]",
                      query_contains_string
                         if query_contains_string is not None
                         else '<none>',
                      query_is_string
                         if query_is_string is not None
                         else '<none>',
-                     parent_id
-                        if parent_id is not None
+                     ', '.join(parent_ids)
+                        if parent_ids
                         else '<none>')
 
         client = self.__auth.get_client()
 
         query_components = []
 
-        if parent_id:
-            query_components.append("'%s' in parents" % (parent_id))
+        if parent_ids:
+            parent_phrases = [("'%s' in parents" % (parent_id))
+                              for parent_id
+                              in parent_ids]
+
+            query_components.append('(%s)' % (' or '.join(parent_phrases)))
 
         if query_is_string:
             query_components.append("title='%s'" %
@@ -443,6 +1010,34 @@ class _GdriveManager(object):
             _logger.warning(message)
             raise gdrivefs.errors.ExportFormatError(message)
 
+        # If the same version is already being downloaded in the same format,
+        # share that download.
+        key = (normalized_entry.id,
+               mime_type,
+               gdrivefs.normal_entry.get_entry_version(normalized_entry))
+
+        # The other file is only guaranteed to be there until the download
+        # that we're sharing returns, so we copy it before then.
+        follow = functools.partial(
+                    _copy_shared_download,
+                    normalized_entry,
+                    output_file_path)
+
+        (_, result) = \
+            _DOWNLOADS_IN_FLIGHT.do(
+                key,
+                self.__download_to_local,
+                (output_file_path, normalized_entry, mime_type, allow_cache),
+                follow=follow)
+
+        return result
+
+    def __download_to_local(self, output_file_path, normalized_entry,
+                            mime_type, allow_cache):
+        """Do the download for download_to_local(). The output path is
+        returned with the result, for whoever shares it.
+        """
+
         gd_mtime_epoch = time.mktime(
                             normalized_entry.modified_date.timetuple())
 
@@ -462,20 +1057,81 @@ class _GdriveManager(object):
             _logger.info("File retrieved from the previously downloaded, "
                          "still-current file.")
 
-            return (stat_info.st_size, False)
+            return (output_file_path, (stat_info.st_size, False))
+
+        # Go and get the file. If we know how big it is, and it's big enough,
+        # retrieve its parts over several connections at once.
+
+        range_size_b = \
+            int(gdrivefs.conf.Conf.get('file_download_range_size_kb')) * 1024
+
+        # If a previous attempt was interrupted, only what's left is
+        # retrieved.
+        progress = _DownloadProgress(
+                    output_file_path,
+                    normalized_entry,
+                    mime_type)
+
+        done_ranges = progress.load()
+
+        if normalized_entry.requires_mimetype is False and \
+           normalized_entry.file_size > range_size_b and \
+           int(gdrivefs.conf.Conf.get('file_download_parallelism')) > 1:
+            total_size = normalized_entry.file_size
+
+            missing_ranges = _get_missing_ranges(total_size, done_ranges)
+
+            if done_ranges:
+                _logger.info("Resuming download of entry [%s] with (%d) of "
+                             "(%d) bytes missing.", normalized_entry.id,
+                             sum(length for (_, length) in missing_ranges),
+                             total_size)
 
-        # Go and get the file.
+            with open(output_file_path, 'r+b' if done_ranges else 'wb') as f:
+                f.truncate(total_size)
+
+                self.download_ranges(
+                    f.fileno(),
+                    normalized_entry,
+                    mime_type,
+                    missing_ranges,
+                    range_done_cb=progress.record)
+
+            progress.remove()
+
+            os.utime(output_file_path, (time.time(), gd_mtime_epoch))
+
+            return (output_file_path, (total_size, True))
 
         authed_http = self.__auth.get_authed_http()
 
         url = normalized_entry.download_links[mime_type]
 
-        with open(output_file_path, 'wb') as f:
+        # We can continue a serial download from the end of whatever prefix we
+        # already have.
+        start_at = 0
+        for (offset, length) in done_ranges:
+            if offset == 0:
+                start_at = length
+
+        if start_at > 0:
+            _logger.info("Resuming download of entry [%s] at (%d).",
+                         normalized_entry.id, start_at)
+
+            f = open(output_file_path, 'r+b')
+            f.truncate(start_at)
+            f.seek(start_at)
+        else:
+            f = open(output_file_path, 'wb')
+
+        with f:
             downloader = gdrivefs.chunked_download.ChunkedDownload(
                             f,
                             authed_http,
-                            url)
+                            url,
+                            start_at=start_at)
 
+            recorded_at = start_at
             progresses = []
 
             while 1:
@@ -511,11 +1167,169 @@ class _GdriveManager(object):
                 if done is True:
                     break
 
+                if status.resumable_progress - recorded_at >= \
+                        _DOWNLOAD_PROGRESS_INTERVAL_B:
+                    f.flush()
+
+                    recorded_at = status.resumable_progress
+                    progress.record(0, recorded_at)
+
             _logger.debug("Download complete. Offset is: (%d)", f.tell())
 
+        progress.remove()
+
         os.utime(output_file_path, (time.time(), gd_mtime_epoch))
 
-        return (total_size, True)
+        return (output_file_path, (total_size, True))
+
+    @_marshall
+    def get_export_size(self, normalized_entry, mime_type):
+        """Return the size of the entry in the given format without
+        retrieving it (the first byte is requested, and the server tells us
+        the whole size along with it).
+        """
+
+        authed_http = self.__auth.get_authed_http()
+
+        url = normalized_entry.download_links[mime_type]
+        headers = { 'range': 'bytes=0-0' }
+
+        resp, content = authed_http.request(url, headers=headers)
+
+        if 'content-range' in resp:
+            size = int(resp['content-range'].rsplit('/', 1)[1])
+        elif resp.status == 200:
+            # The range was ignored, and we were sent the whole thing.
+            _logger.warning("Server ignored the range for the size of entry "
+                            "[%s] as [%s].", normalized_entry.id, mime_type)
+
+            size = len(content)
+        elif resp.status == 416:
+            # It's empty.
+            size = 0
+        else:
+            raise apiclient.errors.HttpError(resp, content, uri=url)
+
+        _logger.debug("Entry [%s] as [%s] is (%d) bytes.",
+                      normalized_entry.id, mime_type, size)
+
+        return size
+
+    @_marshall
+    def download_range(self, output_fd, normalized_entry, mime_type, offset,
+                       length):
+        """Download only the given byte-range of the entry, and write it at
+        the same position within an existing (probably sparse) local file,
+        given as an open descriptor. The file may be renamed while we're
+        writing to it. Returns the number of bytes written.
+        """
+
+        _logger.debug("Downloading range (%d):(%d) of entry with ID [%s] and "
+                      "mime-type [%s] to descriptor (%d).", offset, length,
+                      normalized_entry.id, mime_type, output_fd)
+
+        authed_http = self.__auth.get_authed_http()
+
+        url = normalized_entry.download_links[mime_type]
+
+        f = _PositionalWriter(output_fd, offset)
+
+        downloader = gdrivefs.chunked_download.ChunkedDownload(
+                        f,
+                        authed_http,
+                        url,
+                        chunksize=min(length, _MAX_RANGE_CHUNK_SIZE_B),
+                        start_at=offset,
+                        end_at=offset + length)
+
+        last_progress = offset
+        while 1:
+            status, done, total_size = downloader.next_chunk()
+
+            if done is True:
+                break
+
+            # We'll never get done if the server stops short of the range.
+            assert status.resumable_progress > last_progress, \
+                   "An empty chunk was received for a ranged download."
+
+            last_progress = status.resumable_progress
+
+        written = f.tell() - offset
+
+        _logger.debug("Range download complete: (%d) bytes", written)
+
+        return written
+
+    def download_ranges(self, output_fd, normalized_entry, mime_type, ranges,
+                        range_done_cb=None):
+        """Download the given (offset, length) ranges of the entry into
+        their places in an existing local file, given as an open descriptor
+        (which has to stay open until we return). Large ranges are broken up
+        and the pieces are retrieved concurrently, each over its own
+        connection. Only the pieces that fail are retried. If given, the
+        callback is invoked with the offset and length of each piece as it
+        lands (possibly from another thread).
+        """
+
+        range_size_b = \
+            int(gdrivefs.conf.Conf.get('file_download_range_size_kb')) * 1024
+
+        pieces = _split_ranges(ranges, range_size_b)
+
+        _logger.debug("Downloading (%d) ranges of entry with ID [%s] as (%d) "
+                      "pieces.", len(ranges), normalized_entry.id,
+                      len(pieces))
+
+        def download_piece(offset, length):
+            get_gdrive().download_range(
+                output_fd,
+                normalized_entry,
+                mime_type,
+                offset,
+                length)
+
+            if range_done_cb is not None:
+                range_done_cb(offset, length)
+
+        # There's no point in waiting on another thread for a single piece.
+        if len(pieces) == 1:
+            download_piece(*pieces[0])
+            return
+
+        pool = _get_download_pool()
+
+        attempt = 1
+        while 1:
+            jobs = [(piece, pool.submit(download_piece, *piece))
+                    for piece
+                    in pieces]
+
+            failed = []
+            last_exception = None
+            for (piece, job) in jobs:
+                try:
+                    job.wait()
+                except Exception as e:
+                    failed.append(piece)
+                    last_exception = e
+
+            if not failed:
+                break
+
+            if attempt >= _MAX_RANGE_ATTEMPTS:
+                _logger.error("(%d) pieces of entry with ID [%s] could not be "
+                              "downloaded after (%d) attempts.",
+                              len(failed), normalized_entry.id, attempt)
+
+                raise last_exception
+
+            _logger.warning("(%d) pieces of entry with ID [%s] failed to "
+                            "download. Retrying them.",
+                            len(failed), normalized_entry.id)
+
+            pieces = failed
+            attempt += 1
 
     @_marshall
     def create_directory(self, filename, parents, **kwargs):
@@ -595,12 +1409,7 @@ class _GdriveManager(object):
 
         if data_filepath:
             args.update({
-                'media_body':
-                    apiclient.http.MediaFileUpload(
-                        data_filepath,
-                        mimetype=mime_type,
-                        resumable=True,
-                        chunksize=_DEFAULT_UPLOAD_CHUNK_SIZE_B),
+                'media_body': _AdaptiveFileUpload(data_filepath, mime_type),
 # TODO(dustin): Documented, but does not exist.
 #                'uploadType': 'resumable',
             })
@@ -611,10 +1420,13 @@ class _GdriveManager(object):
 
         request = client.files().insert(**args)
 
+        target = 'insert:%s:%s' % (','.join(parents), filename)
+
         response = self.__finish_upload(
                     filename,
                     request,
-                    data_filepath is not None)
+                    data_filepath=data_filepath,
+                    target=target)
 
         self.__assert_response_kind(response, 'drive#file')
 
@@ -712,12 +1524,7 @@ class _GdriveManager(object):
 
             # We can only upload large files using resumable-uploads.
             args.update({
-                'media_body':
-                    apiclient.http.MediaFileUpload(
-                        data_filepath,
-                        mimetype=mime_type,
-                        resumable=True,
-                        chunksize=_DEFAULT_UPLOAD_CHUNK_SIZE_B),
+                'media_body': _AdaptiveFileUpload(data_filepath, mime_type),
 # TODO(dustin): Documented, but does not exist.
 #                'uploadType': 'resumable',
             })
@@ -729,7 +1536,8 @@ class _GdriveManager(object):
         result = self.__finish_upload(
                     normalized_entry.title,
                     request,
-                    data_filepath is not None)
+                    data_filepath=data_filepath,
+                    target=('update:%s' % (normalized_entry.id,)))
 
         normalized_entry = \
             gdrivefs.normal_entry.NormalEntry('update_entry', result)
@@ -738,28 +1546,70 @@ class _GdriveManager(object):
 
         return normalized_entry
 
-    def __finish_upload(self, filename, request, has_file):
+    def __finish_upload(self, filename, request, data_filepath=None,
+                        target=None):
         """Finish a resumable-upload is a file was given, or just execute the
-        request if not.
+        request if not. The target identifies the request, so that an
+        interrupted upload is only resumed by the same request.
         """
 
-        if has_file is False:
+        if data_filepath is None:
             return request.execute()
 
         _logger.debug("We need to finish updating the entry's data: [%s]",
                       filename)
 
-        result = None
+        session = _UploadSession(data_filepath, target)
+        result = session.resume(request)
+
+        attempts = 0
         while result is None:
-            status, result = request.next_chunk()
+            progress = request.resumable_progress
+            start_at = time.time()
+
+            try:
+                status, result = request.next_chunk()
+            except apiclient.errors.HttpError as e:
+                if e.resp.status not in _TRANSIENT_UPLOAD_STATUSES:
+                    raise
+
+                error = e
+            except _TRANSIENT_UPLOAD_EXCEPTIONS as e:
+                error = e
+            else:
+                error = None
+
+            session.record(request)
+
+            # The next chunk starts from whatever the server says it got.
+            if error is not None:
+                _UPLOAD_CHUNK_SIZER.record_failure()
+
+                attempts += 1
+                if attempts >= _MAX_UPLOAD_CHUNK_ATTEMPTS:
+                    raise error
+
+                _logger.warning("Upload chunk for [%s] failed (%d). Trying "
+                                "again: %s", filename, attempts, error)
+
+                time.sleep((2 ** attempts) + random.random())
+                continue
+
+            attempts = 0
 
             if status:
+                _UPLOAD_CHUNK_SIZER.record_chunk(
+                    status.resumable_progress - progress,
+                    time.time() - start_at)
+
                 if status.total_size == 0:
                     _logger.debug("Uploaded (zero-length): [%s]", filename)
                 else:
                     _logger.debug("Uploaded [%s]: %.2f%%",
                                   filename, status.progress() * 100)
 
+        session.remove()
+
         return result
 
     @_marshall
@@ -29,13 +29,16 @@ import gdrivefs.config.fs
 
 from gdrivefs.utility import utility
 from gdrivefs.change import get_change_manager
-from gdrivefs.volume import PathRelations, EntryCache, \
+from gdrivefs.volume import PathRelations, \
                                   CLAUSE_ENTRY, CLAUSE_PARENT, \
                                   CLAUSE_CHILDREN, CLAUSE_ID, \
                                   CLAUSE_CHILDREN_LOADED
 from gdrivefs.conf import Conf
 from gdrivefs.drive import get_gdrive
 from gdrivefs.account_info import AccountInfo
+from gdrivefs.write_back import get_write_back
+from gdrivefs.metadata_snapshot import get_metadata_snapshot
+from gdrivefs.normal_entry import build_provisional_entry
 
 from gdrivefs.fsutility import strip_export_type, split_path,\
                                     build_filepath, dec_hint
@@ -157,8 +160,13 @@ class _GdfsMixin(object):
             stat_result["st_mode"] = (stat.S_IFDIR | effective_permission)
             stat_result["st_nlink"] = 2
         else:
+            local_size = gdrivefs.opened_file.get_local_size(entry.id)
+
             if entry.requires_mimetype:
                 stat_result["st_size"] = DisplacedFile.file_size
+            elif local_size is not None:
+                # There are changes that haven't been uploaded, yet.
+                stat_result["st_size"] = local_size
             else:
                 stat_result["st_size"] = entry.file_size
 
@@ -342,11 +350,20 @@ class _GdfsMixin(object):
         gd = get_gdrive()
 
         try:
-            entry = gd.create_file(
-                        filename, 
-                        [parent_clause[3]], 
-                        mime_type,
-                        is_hidden=is_hidden)
+            if Conf.get('file_deferred_create') is True:
+                # It'll be created remotely, with its content, when it's
+                # flushed.
+                entry = build_provisional_entry(
+                            filename,
+                            [parent_clause[3]],
+                            mime_type,
+                            is_hidden=is_hidden)
+            else:
+                entry = gd.create_file(
+                            filename, 
+                            [parent_clause[3]], 
+                            mime_type,
+                            is_hidden=is_hidden)
         except:
             _logger.exception("Could not create empty file [%s] under "
                               "parent with ID [%s].",
@@ -419,7 +436,8 @@ class _GdfsMixin(object):
         try:
             opened_file = \
                 gdrivefs.opened_file.create_for_existing_filepath(
-                    filepath)
+                    filepath,
+                    flags)
         except GdNotFoundError:
             _logger.exception("Could not create handle for requested [%s] "
                               "(open).", filepath)
@@ -494,6 +512,26 @@ class _GdfsMixin(object):
             _logger.exception("Could not flush local updates.")
             raise FuseOSError(EIO)
 
+    @dec_hint(['filepath', 'datasync', 'fh'])
+    def fsync(self, filepath, datasync, fh):
+        """Make sure that any changes have been uploaded (even if they'd
+        otherwise be written-back later).
+        """
+
+        om = gdrivefs.opened_file.get_om()
+
+        try:
+            opened_file = om.get_by_fh(fh=fh)
+        except:
+            _logger.exception("Could not get OpenedFile (fsync).")
+            raise FuseOSError(EIO)
+
+        try:
+            opened_file.fsync()
+        except:
+            _logger.exception("Could not sync local updates.")
+            raise FuseOSError(EIO)
+
     @dec_hint(['filepath'])
     def rmdir(self, filepath):
         """Remove a directory."""
@@ -645,7 +683,15 @@ class _GdfsMixin(object):
         gd = get_gdrive()
 
         try:
-            entry = gd.rename(entry, filename_new_raw)
+            if entry.is_provisional is True:
+                # It doesn't exist remotely yet. It'll be created with the new
+                # name.
+                result = gdrivefs.fsutility.split_path_nolookups(
+                            filename_new_raw)
+
+                entry.temp_rename(result[1])
+            else:
+                entry = gd.rename(entry, filename_new_raw)
         except:
             _logger.exception("Could not update entry [%s] for rename.", entry)
             raise FuseOSError(EIO)
@@ -673,31 +719,26 @@ class _GdfsMixin(object):
 
                 raise FuseOSError(EIO)
 
-            _logger.debug("Truncating and clearing FH: %s", opened_file)
+            _logger.debug("Truncating FH: %s", opened_file)
 
-            opened_file.reset_state()
-
-            entry_id = opened_file.entry_id
-            cache = EntryCache.get_instance().cache
-            entry = cache.get(entry_id)
-
-            opened_file.truncate(length)
+            try:
+                opened_file.truncate(length)
+            except:
+                _logger.exception("Could not truncate [%s].", opened_file)
+                raise FuseOSError(EIO)
         else:
-            (entry, path, filename) = get_entry_or_raise(filepath)
+            # Make sure that it exists.
+            get_entry_or_raise(filepath)
 
-        gd = get_gdrive()
-
-        try:
-            entry = gd.truncate(entry)
-        except:
-            _logger.exception("Could not truncate entry [%s].", entry)
-            raise FuseOSError(EIO)
-
-# TODO(dustin): It would be a lot quicker if we truncate our temporary file 
-#               here, and make sure its mtime matches.
+            try:
+                gdrivefs.opened_file.truncate_by_filepath(filepath, length)
+            except FuseOSError:
+                raise
+            except:
+                _logger.exception("Could not truncate [%s].", filepath)
+                raise FuseOSError(EIO)
 
-        # We don't need to update our internal representation of the file (just 
-        # our file-handle and its related buffering).
+        # Only the local copy is changed. It's sent with the next flush.
 
     @dec_hint(['file_path'])
     def unlink(self, file_path):
@@ -739,15 +780,17 @@ class _GdfsMixin(object):
 
         gd = get_gdrive()
 
-        try:
-            gd.remove_entry(normalized_entry)
-        except NameError:
-            raise FuseOSError(ENOENT)
-        except:
-            _logger.exception("Could not remove file [%s] with ID [%s].",
-                              file_path, entry_id)
+        # A provisional entry was never created remotely.
+        if normalized_entry.is_provisional is False:
+            try:
+                gd.remove_entry(normalized_entry)
+            except NameError:
+                raise FuseOSError(ENOENT)
+            except:
+                _logger.exception("Could not remove file [%s] with ID [%s].",
+                                  file_path, entry_id)
 
-            raise FuseOSError(EIO)
+                raise FuseOSError(EIO)
 
         # Remove from cache. Will no longer be able to be found, locally.
         PathRelations.get_instance().remove_entry_all(entry_id)
@@ -776,6 +819,10 @@ class _GdfsMixin(object):
 
         (entry, path, filename) = get_entry_or_raise(raw_path)
 
+        # The times are set when it's actually created.
+        if entry.is_provisional is True:
+            return 0
+
         mtime_phrase = get_flat_normal_fs_time_from_epoch(mtime)
         atime_phrase = get_flat_normal_fs_time_from_epoch(atime)
 
@@ -800,12 +847,30 @@ class _GdfsMixin(object):
 
         _logger.info("Creating filesystem resource.")
 
+        # Anything left in the journal from before is sent in the background.
+        _logger.info("Activating write-back uploader.")
+        get_write_back().mount_init()
+
+        is_snapshot_loaded = False
         if gdrivefs.config.changes.MONITOR_CHANGES is True:
+            # We can only trust a snapshot that we can catch-up.
+            if Conf.get('metadata_snapshot') is True:
+                _logger.info("Loading metadata snapshot.")
+                get_metadata_snapshot().mount_init()
+                is_snapshot_loaded = get_metadata_snapshot().is_loaded
+
             _logger.info("Activating change-monitor.")
             get_change_manager().mount_init()
         else:
             _logger.warning("We were told not to monitor changes.")
 
+        # This starts after the change-monitor so that nothing that changes
+        # while we're listing is missed.
+        if Conf.get('metadata_bootstrap') is True and \
+           is_snapshot_loaded is False:
+            _logger.info("Loading all entries in the background.")
+            PathRelations.get_instance().start_load_all()
+
         _logger.info("Created filesystem resource.")
 
     @dec_hint(['path'])
@@ -818,6 +883,18 @@ class _GdfsMixin(object):
             _logger.info("Stopping change-monitor.")
             get_change_manager().mount_destroy()
 
+            if Conf.get('metadata_snapshot') is True:
+                _logger.info("Saving metadata snapshot.")
+                get_metadata_snapshot().mount_destroy()
+
+        _logger.info("Sending truncated files.")
+        gdrivefs.opened_file.flush_truncated_all()
+
+        _logger.info("Stopping write-back uploader.")
+        get_write_back().mount_destroy()
+
+        gdrivefs.opened_file.get_om().log_readahead_stats()
+
         _logger.info("Destroyed filesystem resource.")
 
     @dec_hint(['path'])
@@ -830,6 +907,12 @@ class _GdfsMixin(object):
     def getxattr(self, raw_path, name, position=0):
         (entry, path, filename) = get_entry_or_raise(raw_path)
 
+        # Ours are all in the user namespace. Others (like "security.selinux")
+        # are asked for constantly, and building ours means rereading the
+        # entry.
+        if name.startswith('user.') is False:
+            return b''
+
         try:
             value = entry.xattr_data[name]
         except KeyError:
@@ -0,0 +1,238 @@
+"""Persistence of what we know about the files and folders in the account. A
+snapshot of the entries (and of which folders we have completely listed) is
+saved periodically and at unmount, along with the change-ID that it's current
+as of. At the next mount, it's loaded and then caught-up by replaying the
+changes since, rather than relearning everything one directory at a time.
+"""
+
+import logging
+import threading
+import gzip
+import json
+import os
+import os.path
+
+import gdrivefs.config
+import gdrivefs.conf
+import gdrivefs.state
+
+from gdrivefs.account_info import AccountInfo
+from gdrivefs.change import get_change_manager
+from gdrivefs.normal_entry import NormalEntry
+from gdrivefs.volume import PathRelations
+
+_logger = logging.getLogger(__name__)
+
+_FORMAT_VERSION = 1
+
+
+def _fsync_path(path):
+    fd = os.open(path, os.O_RDONLY)
+
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class _MetadataSnapshot(object):
+    """Manages the snapshot and the thread that periodically saves it."""
+
+    def __init__(self, filepath):
+        self.__filepath = filepath
+        self.__save_lock = threading.Lock()
+
+        # The (generation, change-ID) that was last saved.
+        self.__saved_as_of = None
+
+        self.__is_loaded = False
+
+        self.__t = None
+        self.__t_quit_ev = threading.Event()
+
+        path = os.path.dirname(self.__filepath)
+        if os.path.exists(path) is False:
+            os.makedirs(path, 0o700)
+
+    def __read(self):
+        # Python 2's gzip doesn't have a text mode.
+        with gzip.open(self.__filepath, 'rb') as f:
+            state = json.loads(f.read().decode('utf-8'))
+
+        if state['version'] != _FORMAT_VERSION:
+            _logger.warning("Metadata snapshot [%s] has an unsupported "
+                            "version (%d). Ignoring.",
+                            self.__filepath, state['version'])
+
+            return None
+
+        root_id = AccountInfo.get_instance().root_id
+        if state['root_id'] != root_id:
+            _logger.warning("Metadata snapshot [%s] is for a different "
+                            "account. Ignoring.", self.__filepath)
+
+            return None
+
+        return state
+
+    def __catch_up(self, state, entries):
+        """Replay whatever has changed since the snapshot was taken. If we
+        can't, forget everything that we loaded.
+        """
+
+        cm = get_change_manager()
+        cm.at_change_id = state['at_change_id']
+
+        try:
+            while cm.process_updates() is False:
+                # If we're not progressing, the change-processing thread
+                # will carry on, in the background.
+                if cm.at_change_id == state['at_change_id']:
+                    break
+
+                state['at_change_id'] = cm.at_change_id
+        except:
+            _logger.exception("Could not catch-up the metadata snapshot with "
+                              "the changes since. Discarding it.")
+
+            path_relations = PathRelations.get_instance()
+            for entry in entries:
+                path_relations.remove_entry_all(entry.id)
+
+            cm.at_change_id = AccountInfo.get_instance().largest_change_id
+            return False
+
+        return True
+
+    def __load(self):
+        if os.path.exists(self.__filepath) is False:
+            return
+
+        try:
+            state = self.__read()
+        except:
+            _logger.exception("Could not read metadata snapshot [%s]. "
+                              "Ignoring.", self.__filepath)
+
+            return
+
+        if state is None:
+            return
+
+        entries = [NormalEntry('snapshot', raw_data)
+                   for raw_data
+                   in state['entries']]
+
+        path_relations = PathRelations.get_instance()
+        path_relations.restore_state(entries, state['children_loaded_ids'])
+
+        _logger.info("Loaded (%d) entries from the metadata snapshot as of "
+                     "change-ID (%d). Catching-up.",
+                     len(entries), state['at_change_id'])
+
+        if self.__catch_up(state, entries) is True:
+            _logger.info("Metadata snapshot is current as of change-ID "
+                         "(%d).", get_change_manager().at_change_id)
+
+            self.__is_loaded = True
+
+    def save(self):
+        """Write the snapshot if anything has changed since it was last
+        written.
+        """
+
+        with self.__save_lock:
+            # Anything that we collect below is at least as new as this, so
+            # nothing will be missed when changes are replayed from here.
+            at_change_id = get_change_manager().at_change_id
+
+            path_relations = PathRelations.get_instance()
+            (generation, entries, children_loaded_ids) = \
+                path_relations.get_state()
+
+            as_of = (generation, at_change_id)
+            if as_of == self.__saved_as_of:
+                return
+
+            state = {
+                'version': _FORMAT_VERSION,
+                'root_id': AccountInfo.get_instance().root_id,
+                'at_change_id': at_change_id,
+                'entries': [entry.get_resource() for entry in entries],
+                'children_loaded_ids': children_loaded_ids,
+            }
+
+            temp_filepath = self.__filepath + '.temp'
+            with gzip.open(temp_filepath, 'wb') as f:
+                f.write(json.dumps(state).encode('utf-8'))
+
+            _fsync_path(temp_filepath)
+            os.rename(temp_filepath, self.__filepath)
+            _fsync_path(os.path.dirname(self.__filepath))
+
+            self.__saved_as_of = as_of
+
+        _logger.debug("Saved (%d) entries to the metadata snapshot as of "
+                      "change-ID (%d).", len(entries), at_change_id)
+
+    def __save_periodically(self):
+        _logger.debug("Metadata-snapshot thread running.")
+
+        interval_s = \
+            int(gdrivefs.conf.Conf.get('metadata_snapshot_interval_s'))
+
+        while self.__t_quit_ev.wait(interval_s) is False and \
+                gdrivefs.state.GLOBAL_EXIT_EVENT.is_set() is False:
+            try:
+                self.save()
+            except:
+                _logger.exception("Squelching an exception that occurred "
+                                  "while saving the metadata snapshot.")
+
+        _logger.debug("Metadata-snapshot thread terminating.")
+
+    def mount_init(self):
+        """Called when the filesystem is first mounted (before changes are
+        monitored).
+        """
+
+        self.__load()
+
+        _logger.debug("Starting metadata-snapshot thread.")
+
+        self.__t = threading.Thread(target=self.__save_periodically)
+        self.__t.daemon = True
+        self.__t.start()
+
+    def mount_destroy(self):
+        """Called when the filesystem is unmounted (after changes are no
+        longer monitored).
+        """
+
+        _logger.debug("Stopping metadata-snapshot thread.")
+
+        self.__t_quit_ev.set()
+        self.__t.join()
+
+        self.save()
+
+    @property
+    def is_loaded(self):
+        """Whether a snapshot was loaded at mount."""
+
+        return self.__is_loaded
+
+_instance = None
+_instance_lock = threading.Lock()
+def get_metadata_snapshot():
+    global _instance
+
+    with _instance_lock:
+        if _instance is None:
+            filepath = gdrivefs.conf.Conf.get('metadata_snapshot_filepath')
+            if filepath is None:
+                filepath = gdrivefs.config.DEFAULT_METADATA_SNAPSHOT_FILEPATH
+
+            _instance = _MetadataSnapshot(filepath)
+
+    return _instance
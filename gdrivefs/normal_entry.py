@@ -4,21 +4,65 @@ import dateutil.parser
 import json
 import time
 import pprint
+import uuid
 
 from time import mktime
 from mimetypes import guess_type
 from numbers import Number
 from datetime import datetime
 
+try:
+    # Python 3
+    from sys import intern as _intern_native
+except ImportError:
+    # Python 2.
+    from __builtin__ import intern as _intern_native
+
+import gdrivefs.drive
+
 from gdrivefs.conf import Conf
 from gdrivefs.utility import utility
 from gdrivefs.errors import ExportFormatError
-from gdrivefs.time_support import get_flat_normal_fs_time_from_dt
+from gdrivefs.time_support import get_flat_normal_fs_time_from_dt, \
+                                  get_flat_normal_fs_time_from_epoch, \
+                                  get_normal_dt_from_epoch
 
 _logger = logging.getLogger(__name__)
 
+# Entries that we've created locally but that don't exist remotely, yet, have
+# IDs with this prefix.
+PROVISIONAL_ID_PREFIX = 'gdfs-provisional-'
+
+# Values that a lot of entries have in common (labels, owners) are only kept
+# once. These must never be modified.
+_SHARED_VALUES = {}
+
+
+def _share(key, value):
+    return _SHARED_VALUES.setdefault(key, value)
+
+def _intern(value):
+    # Python 2 can only intern native strings. What we intern (IDs and
+    # mime-types) is always ASCII.
+    return _intern_native(str(value))
+
+def _get_epoch(dt):
+    # mktime() only works in terms of the local timezone, so compensate
+    # (this works with DST, too).
+    return mktime(dt.timetuple()) - time.timezone
+
+def _parse_epoch(phrase):
+    if phrase is None:
+        return None
+
+    return _get_epoch(dateutil.parser.parse(phrase))
+
 
 class NormalEntry(object):
+    """A file or folder. Thousands of these might be kept, so only what we
+    use is kept, and what can be computed up-front is.
+    """
+
     __directory_mimetype = Conf.get('directory_mimetype')
 
     __properties_extra = [
@@ -34,83 +78,101 @@ class NormalEntry(object):
         'atime_byme_date_epoch',
     ]
 
+    __slots__ = (
+        'id',
+        'title',
+        'title_fs',
+        'mime_type',
+        'labels',
+        'parents',
+        'requires_mimetype',
+        'last_modifying_user_name',
+        'writers_can_share',
+        'owner_names',
+        'editable',
+        'user_permission',
+        'link',
+        'file_size',
+        'file_extension',
+        'md5_checksum',
+        'image_media_metadata',
+        'download_links',
+        'is_visible',
+        'modified_date',
+        'modified_date_epoch',
+        'mtime_byme_date_epoch',
+        'atime_byme_date_epoch',
+        '__raw_data',
+        '__cache_data',
+        '__cache_mimetypes',
+    )
+
     def __init__(self, gd_resource_type, raw_data):
-        self.__info = {}
-        self.__parents = []
-        self.__raw_data = raw_data
         self.__cache_data = None
         self.__cache_mimetypes = None
-        self.__cache_dict = {}
+
+        self.id = raw_data['id']
+
+        # The resource isn't kept (it's large, and mostly things that we
+        # don't use). It's reread if it's needed, unless it only exists
+        # locally.
+        self.__raw_data = raw_data if self.is_provisional is True else None
+
+        self.mime_type = _intern(raw_data['mimeType'])
 
         # Return True if reading from this file should return info and deposit
         # the data elsewhere. This is predominantly determined by whether we
         # can get a file-size up-front, or we have to decide on a specific
         # mime-type in order to do so.
 
-        requires_mimetype = 'fileSize' not in self.__raw_data and \
-                            raw_data['mimeType'] != self.__directory_mimetype
-
-        self.__info['requires_mimetype'] = \
-            requires_mimetype
-
-        self.__info['title'] = \
-            raw_data['title']
-
-        self.__info['mime_type'] = \
-            raw_data['mimeType']
-
-        self.__info['labels'] = \
-            raw_data['labels']
-
-        self.__info['id'] = \
-            raw_data['id']
-
-        self.__info['last_modifying_user_name'] = \
-            raw_data.get('lastModifyingUserName')
-
-        self.__info['writers_can_share'] = \
-            raw_data['writersCanShare']
-
-        self.__info['owner_names'] = \
-            raw_data['ownerNames']
-
-        self.__info['editable'] = \
-            raw_data['editable']
-
-        self.__info['user_permission'] = \
-            raw_data['userPermission']
-
-        self.__info['link'] = \
-            raw_data.get('embedLink')
+        self.requires_mimetype = 'fileSize' not in raw_data and \
+                                 self.mime_type != self.__directory_mimetype
 
-        self.__info['file_size'] = \
-            int(raw_data.get('fileSize', 0))
+        self.title = raw_data['title']
 
-        self.__info['file_extension'] = \
-            raw_data.get('fileExtension')
+        labels = raw_data['labels']
+        self.labels = _share(tuple(sorted(labels.items())), labels)
 
-        self.__info['md5_checksum'] = \
-            raw_data.get('md5Checksum')
+        owner_names = tuple(raw_data['ownerNames'])
+        self.owner_names = _share(owner_names, owner_names)
 
-        self.__info['image_media_metadata'] = \
-            raw_data.get('imageMediaMetadata')
+        self.last_modifying_user_name = raw_data.get('lastModifyingUserName')
+        self.writers_can_share = raw_data['writersCanShare']
+        self.editable = raw_data['editable']
+        self.user_permission = raw_data['userPermission']
+        self.link = raw_data.get('embedLink')
+        self.file_size = int(raw_data.get('fileSize', 0))
+        self.file_extension = raw_data.get('fileExtension')
+        self.md5_checksum = raw_data.get('md5Checksum')
+        self.image_media_metadata = raw_data.get('imageMediaMetadata')
 
-        self.__info['download_links'] = \
-            raw_data.get('exportLinks', {})
+        self.download_links = raw_data.get('exportLinks', {})
 
         try:
-            self.__info['download_links'][self.__info['mime_type']] = \
-                raw_data['downloadUrl']
+            self.download_links[self.mime_type] = raw_data['downloadUrl']
         except KeyError:
             pass
 
         self.__update_display_name()
 
-        for parent in raw_data['parents']:
-            self.__parents.append(parent['id'])
+        self.parents = tuple(_intern(parent['id'])
+                             for parent
+                             in raw_data['parents'])
 
-    def __getattr__(self, key):
-        return self.__info[key]
+        hidden_flags = Conf.get('hidden_flags_list_local')
+        self.is_visible = not [ flag
+                                for flag, value
+                                in list(self.labels.items())
+                                if flag in hidden_flags and value ]
+
+        self.modified_date = dateutil.parser.parse(raw_data['modifiedDate'])
+        self.modified_date_epoch = _get_epoch(self.modified_date)
+
+        self.mtime_byme_date_epoch = \
+            _parse_epoch(raw_data.get('modifiedByMeDate'))
+
+        self.atime_byme_date_epoch = \
+            _parse_epoch(raw_data.get('lastViewedByMeDate'))
 
     def __str__(self):
         return ("<NORMAL ID= [%s] MIME= [%s] NAME= [%s] URIS= (%d)>" %
@@ -122,14 +184,14 @@ class NormalEntry(object):
 
     def __update_display_name(self):
         # This is encoded for displaying locally.
-        self.__info['title_fs'] = utility.translate_filename_charset(self.__info['title'])
+        self.title_fs = utility.translate_filename_charset(self.title)
 
     def temp_rename(self, new_filename):
         """Set the name to something else, here, while we, most likely, wait
         for the change at the server to propogate.
         """
 
-        self.__info['title'] = new_filename
+        self.title = new_filename
         self.__update_display_name()
 
     def normalize_download_mimetype(self, specific_mimetype=None):
@@ -193,7 +255,7 @@ class NormalEntry(object):
 
             final = '; '.join(list_)
             return final
-        elif isinstance(data, list):
+        elif isinstance(data, (list, tuple)):
             final = ', '.join([('LI(%s)' % (self.__convert(element))) \
                                for element \
                                in data])
@@ -207,15 +269,56 @@ class NormalEntry(object):
         else:
             return data
 
-    def get_data(self):
-        original = {
-            key.encode('utf8'): value
-            for key, value
-            in list(self.__raw_data.items())
+    def get_resource(self):
+        """Return a resource, in the format that Drive describes files with,
+        that has just the fields that we use. An equivalent entry can be built
+        from it.
+        """
+
+        export_links = dict(self.download_links)
+        download_url = export_links.pop(self.mime_type, None)
+
+        resource = {
+            'id': self.id,
+            'title': self.title,
+            'mimeType': self.mime_type,
+            'labels': dict(self.labels),
+            'parents': [dict(id=parent) for parent in self.parents],
+            'writersCanShare': self.writers_can_share,
+            'ownerNames': list(self.owner_names),
+            'editable': self.editable,
+            'userPermission': self.user_permission,
+            'exportLinks': export_links,
+            'modifiedDate': get_flat_normal_fs_time_from_dt(self.modified_date),
         }
 
-        distilled = self.__info
+        optional = [
+            ('lastModifyingUserName', self.last_modifying_user_name),
+            ('embedLink', self.link),
+            ('fileExtension', self.file_extension),
+            ('md5Checksum', self.md5_checksum),
+            ('imageMediaMetadata', self.image_media_metadata),
+            ('downloadUrl', download_url),
+        ]
+
+        for key, value in optional:
+            if value is not None:
+                resource[key] = value
+
+        if self.requires_mimetype is False:
+            resource['fileSize'] = str(self.file_size)
 
+        if self.mtime_byme_date_epoch is not None:
+            resource['modifiedByMeDate'] = \
+                get_flat_normal_fs_time_from_epoch(self.mtime_byme_date_epoch)
+
+        if self.atime_byme_date_epoch is not None:
+            resource['lastViewedByMeDate'] = \
+                get_flat_normal_fs_time_from_epoch(self.atime_byme_date_epoch)
+
+        return resource
+
+    def __build_data(self, original):
         extra = {
             key: getattr(self, key)
             for key
@@ -229,10 +332,25 @@ class NormalEntry(object):
 
         return data_dict
 
+    def get_data(self):
+        """Return everything that Drive knows about the entry (which will be
+        reread), as well as what we derive from it.
+        """
+
+        return self.__build_data(self.raw_data)
+
     @property
     def xattr_data(self):
         if self.__cache_data is None:
-            data_dict = self.get_data()
+            try:
+                original = self.raw_data
+            except:
+                _logger.exception("Could not reread entry [%s]. Only "
+                                  "presenting what we keep.", self.id)
+
+                original = self.get_resource()
+
+            data_dict = self.__build_data(original)
 
             attrs = {}
             for a_type, a_dict in list(data_dict.items()):
@@ -247,64 +365,82 @@ class NormalEntry(object):
     @property
     def is_directory(self):
         """Return True if we represent a directory."""
-        return (self.__info['mime_type'] == self.__directory_mimetype)
+        return (self.mime_type == self.__directory_mimetype)
 
     @property
-    def is_visible(self):
-        if [ flag
-             for flag, value
-             in list(self.labels.items())
-             if flag in Conf.get('hidden_flags_list_local') and value ]:
-            return False
-        else:
-            return True
+    def raw_data(self):
+        """The resource as Drive describes it. We don't keep it, so it's
+        reread.
+        """
 
-    @property
-    def parents(self):
-        return self.__parents
+        if self.__raw_data is not None:
+            return self.__raw_data
 
-    @property
-    def download_types(self):
-        return list(self.download_links.keys())
+        gd = gdrivefs.drive.get_gdrive()
+        return gd.get_entry_resource(self.id)
 
     @property
-    def modified_date(self):
-        if 'modified_date' not in self.__cache_dict:
-            self.__cache_dict['modified_date'] = \
-                dateutil.parser.parse(self.__raw_data['modifiedDate'])
+    def is_provisional(self):
+        """Return True if we represent a file that has only been created
+        locally, so far.
+        """
 
-        return self.__cache_dict['modified_date']
+        return self.id.startswith(PROVISIONAL_ID_PREFIX)
 
     @property
-    def modified_date_epoch(self):
-        # mktime() only works in terms of the local timezone, so compensate
-        # (this works with DST, too).
-        return mktime(self.modified_date.timetuple()) - time.timezone
+    def download_types(self):
+        return list(self.download_links.keys())
 
     @property
     def mtime_byme_date(self):
-        if 'modified_byme_date' not in self.__cache_dict:
-            self.__cache_dict['modified_byme_date'] = \
-                dateutil.parser.parse(self.__raw_data['modifiedByMeDate'])
+        if self.mtime_byme_date_epoch is None:
+            return None
 
-        return self.__cache_dict['modified_byme_date']
-
-    @property
-    def mtime_byme_date_epoch(self):
-        return mktime(self.mtime_byme_date.timetuple()) - time.timezone
+        return get_normal_dt_from_epoch(self.mtime_byme_date_epoch)
 
     @property
     def atime_byme_date(self):
-        if 'viewed_byme_date' not in self.__cache_dict:
-            self.__cache_dict['viewed_byme_date'] = \
-                dateutil.parser.parse(self.__raw_data['lastViewedByMeDate']) \
-                if 'lastViewedByMeDate' in self.__raw_data \
-                else None
-
-        return self.__cache_dict['viewed_byme_date']
-
-    @property
-    def atime_byme_date_epoch(self):
-        return mktime(self.atime_byme_date.timetuple()) - time.timezone \
-                if self.atime_byme_date \
-                else None
+        if self.atime_byme_date_epoch is None:
+            return None
+
+        return get_normal_dt_from_epoch(self.atime_byme_date_epoch)
+
+def get_entry_version(normalized_entry):
+    """Return a string that changes whenever the content of the entry does.
+    Exported documents don't have checksums.
+    """
+
+    md5_checksum = normalized_entry.md5_checksum
+    if md5_checksum is not None:
+        return md5_checksum
+
+    return normalized_entry.modified_date.isoformat()
+
+def build_provisional_entry(filename, parents, mime_type, is_hidden=False):
+    """Build an entry for a new, empty file that we'll create remotely once
+    we have its content.
+    """
+
+    now_phrase = get_flat_normal_fs_time_from_dt()
+
+    raw_data = {
+        'id': PROVISIONAL_ID_PREFIX + uuid.uuid4().hex,
+        'title': filename,
+        'mimeType': mime_type,
+        'labels': { 'hidden': is_hidden },
+        'parents': [dict(id=parent) for parent in parents],
+        'fileSize': '0',
+        'writersCanShare': True,
+        'ownerNames': [],
+        'editable': True,
+        'userPermission': {},
+        'modifiedDate': now_phrase,
+        'modifiedByMeDate': now_phrase,
+        'lastViewedByMeDate': now_phrase,
+
+        # There's nothing to download, but this lets it be opened in its own
+        # format.
+        'downloadUrl': '',
+    }
+
+    return NormalEntry('provisional', raw_data)
@@ -5,6 +5,10 @@ import os
 import tempfile
 import shutil
 import threading
+import time
+import functools
+import hashlib
+import mmap
 
 import fuse
 
@@ -18,9 +22,31 @@ from gdrivefs.volume import PathRelations, EntryCache, path_resolver, \
                                   CLAUSE_ID, CLAUSE_ENTRY
 from gdrivefs.drive import get_gdrive
 from gdrivefs.buffer_segments import BufferSegments
+from gdrivefs.content_cache import get_content_cache
+from gdrivefs.normal_entry import get_entry_version
+from gdrivefs.worker_pool import WorkerPool
+from gdrivefs.write_back import get_write_back
 
 _LOGGER = logging.getLogger(__name__)
 
+# How many consecutive, contiguous reads we need to see before we decide that
+# the file is being read sequentially.
+_READAHEAD_SEQUENTIAL_THRESHOLD = 2
+
+# How often the read-ahead counters of closed handles are logged.
+_READAHEAD_STATS_LOG_INTERVAL_S = 300
+
+_MD5_READ_SIZE_B = 1024 * 1024
+
+# How many times we'll try to copy a file into the write-back journal while
+# it's being written before we hold the writes off to do it.
+_JOURNAL_COPY_ATTEMPTS = 3
+
+# How long a file that was truncated by path (rather than through a handle)
+# waits for the open and the writes that usually follow before it's sent on
+# its own.
+_TRUNCATE_SETTLE_TIME_S = 2
+
 # TODO(dustin): LCM runs in a greenlet pool. When we open a file that needs the
 #               existing data for a file (read, append), a switch is done to an
 #               LCM worker. If the data is absent or faulted, download the
@@ -38,6 +64,10 @@ class _OpenedManager(object):
         self.__opened_byfile = {}
         self.__counter = 0
 
+        # Read-ahead counters accumulated from closed handles.
+        self.__readahead_stats = {}
+        self.__readahead_stats_logged_at = time.time()
+
         self.__temp_path = tempfile.mkdtemp()
         _LOGGER.debug("Opened-file working directory: [%s]", self.__temp_path)
 
@@ -120,9 +150,23 @@ class _OpenedManager(object):
         with cls.__opened_lock:
             _LOGGER.debug("Closing opened-file with handle (%d).", fh)
 
-            file_path = self.__opened[fh].file_path
+            opened_file = self.__opened[fh]
+            file_path = opened_file.file_path
             del self.__opened[fh]
 
+            stats = opened_file.readahead_stats
+            _LOGGER.debug("Read-ahead stats for handle (%d): %s", fh, stats)
+
+            for key, value in stats.items():
+                self.__readahead_stats[key] = \
+                    self.__readahead_stats.get(key, 0) + value
+
+            now = time.time()
+            if now - self.__readahead_stats_logged_at >= \
+                    _READAHEAD_STATS_LOG_INTERVAL_S:
+                self.log_readahead_stats()
+                self.__readahead_stats_logged_at = now
+
             try:
                 self.__opened_byfile[file_path].remove(fh)
             except ValueError:
@@ -177,27 +221,344 @@ class _OpenedManager(object):
     def temp_path(self):
         return self.__temp_path
 
-_OPENED_ENTRIES_LOCK = threading.Lock()
-_OPENED_ENTRIES = set()
+    @property
+    def readahead_stats(self):
+        """The read-ahead counters for all of the handles that have been
+        closed.
+        """
+
+        cls = self.__class__
+
+        with cls.__opened_lock:
+            return dict(self.__readahead_stats)
+
+    def log_readahead_stats(self):
+        """Log the read-ahead counters for all of the handles that have been
+        closed, to help tune the read-ahead options.
+        """
+
+        stats = self.readahead_stats
+
+        _LOGGER.info("Read-ahead: (%d) windows of (%d) bytes scheduled, (%d) "
+                     "reads served by read-ahead, (%d) reads downloaded on "
+                     "their own.",
+                     stats.get('readahead_windows', 0),
+                     stats.get('readahead_bytes', 0),
+                     stats.get('prefetch_hits', 0),
+                     stats.get('read_misses', 0))
+
+_READAHEAD_POOL_LOCK = threading.Lock()
+_READAHEAD_POOL = None
+def _get_readahead_pool():
+    global _READAHEAD_POOL
+
+    with _READAHEAD_POOL_LOCK:
+        if _READAHEAD_POOL is None:
+            num_workers = int(Conf.get('file_readahead_workers'))
+            _READAHEAD_POOL = WorkerPool('readahead', num_workers)
+
+    return _READAHEAD_POOL
+
+class _SharedFile(object):
+    """The local data for a single entry in a single format. This is shared by
+    all of the handles that have that entry open, so that they share one
+    download and one local copy, and see each other's changes.
+    """
+
+    def __init__(self, entry_id, mime_type, temp_filepath):
+        self.entry_id = entry_id
+        self.mime_type = mime_type
+
+        # The number of references to this, from handles and from background
+        # work (fills and pending uploads) alike.
+        self.refcount = 0
+
+        # The number of those references that are handles.
+        self.handle_count = 0
+
+        self.locker = threading.RLock()
+
+        # Serializes uploads, without blocking reads and writes while they're
+        # happening.
+        self.flush_locker = threading.Lock()
+
+        self.is_loaded = False
+        self.is_dirty = False
+
+        # Incremented on every write, so that a flush can tell whether there
+        # were any writes while it was uploading.
+        self.write_generation = 0
+
+        # The number of flushes whose content is waiting in the write-back
+        # journal. Each holds a reference to us so that new opens see the
+        # local content rather than the old remote version.
+        self.pending_upload_count = 0
+
+        # The MD5 of the content that has been written sequentially from the
+        # start of the file since the last flush. If the whole file gets
+        # rewritten that way (the usual way that a file is saved), we'll have
+        # its checksum without having to read it back.
+        self.md5 = hashlib.md5()
+        self.md5_offset = 0
+
+        # The cached content that we read from and write to. This is shared
+        # with any later opens of the same version of the entry.
+        self.content = None
+
+        # The version of the entry that the cached content came from. Whatever
+        # parts of it we don't have yet have to come from the same version.
+        self.entry = None
+
+        # If we're only retrieving the parts of the file that are actually
+        # read, this tracks which parts we have. It's None if we have the whole
+        # file.
+        self.block_map = None
+
+        # Stubs aren't cached. They're written here.
+        self.temp_filepath = temp_filepath
+
+        self.fh = None
+
+        # The size of the local data. This is tracked here so that we don't
+        # have to stat the file.
+        self.size = None
+
+        # A read-only map of the local data that reads are served from.
+        self.map = None
+
+    def __repr__(self):
+        return ("<SF [%s] MIME=[%s] REFS=(%d) LOADED=[%s] DIRTY=[%s]>" %
+                (self.entry_id, self.mime_type, self.refcount, self.is_loaded,
+                 self.is_dirty))
+
+    @property
+    def filepath(self):
+        """The local file that has our data. Cached content may move when
+        it's modified.
+        """
+
+        if self.content is not None:
+            return self.content.filepath
+
+        return self.temp_filepath
+
+    def get_map(self):
+        """Return a map of the whole of the local data, re-establishing it if
+        the size has changed since it was made. The locker must be held.
+        """
+
+        if self.map is not None and len(self.map) != self.size:
+            self.map.close()
+            self.map = None
+
+        # An empty file can't be mapped.
+        if self.map is None and self.size > 0:
+            self.map = mmap.mmap(
+                        self.fh.fileno(),
+                        self.size,
+                        access=mmap.ACCESS_READ)
+
+        return self.map
+
+_SHARED_FILES_LOCK = threading.Lock()
+_SHARED_FILES = {}
+
+def _acquire_shared_file(entry_id, mime_type):
+    """Return the shared data for the entry in the given format, creating it
+    if nobody else has it open, for a new handle. It has to be released,
+    later.
+    """
+
+    key = (entry_id, mime_type)
+
+    with _SHARED_FILES_LOCK:
+        try:
+            shared = _SHARED_FILES[key]
+        except KeyError:
+            # Use the monotonically incremented `opened_count` to produce a
+            # unique temporary filepath.
+            om = get_om()
+            temp_filepath = os.path.join(om.temp_path, str(om.opened_count))
+
+            shared = _SharedFile(entry_id, mime_type, temp_filepath)
+            _SHARED_FILES[key] = shared
+        else:
+            _LOGGER.debug("Sharing the open data for [%s] ([%s]): %s",
+                          entry_id, mime_type, shared)
+
+        shared.refcount += 1
+        shared.handle_count += 1
+
+    return shared
+
+def _rekey_shared_file(shared, entry_id):
+    """The entry that the shared data represents now has a different ID (it
+    was only provisional). The lock must be held.
+    """
+
+    del _SHARED_FILES[(shared.entry_id, shared.mime_type)]
+
+    shared.entry_id = entry_id
+    _SHARED_FILES[(entry_id, shared.mime_type)] = shared
+
+def _release_shared_file(shared, is_handle=False):
+    """A handle (or background work) is done with the shared data. The last
+    one out closes it.
+    """
+
+    key = (shared.entry_id, shared.mime_type)
+
+    with _SHARED_FILES_LOCK:
+        if is_handle is True:
+            shared.handle_count -= 1
+
+        shared.refcount -= 1
+        if shared.refcount > 0:
+            return
+
+        del _SHARED_FILES[key]
+
+    if shared.map is not None:
+        shared.map.close()
+
+    if shared.fh is not None:
+        shared.fh.close()
+
+    if shared.content is not None:
+        _LOGGER.debug("Releasing cached content [%s].", shared.content)
+
+        get_content_cache().release(shared.content)
+    elif os.path.exists(shared.temp_filepath) is True:
+        _LOGGER.debug("Removing temporary file [%s].", shared.temp_filepath)
+
+        os.unlink(shared.temp_filepath)
+
+def _fetch_claimed(shared, entry, claimed_ranges):
+    """Download ranges that we've claimed in the block-map, from the version
+    of the entry that the rest of the local data came from. Whatever we don't
+    get is given back.
+    """
+
+    block_map = shared.block_map
+
+    _LOGGER.debug("Fetching missing ranges of [%s]: %s",
+                  entry.id, claimed_ranges)
+
+    # The content may be renamed (detached) while we're downloading, so we
+    # write through the descriptor that we already have rather than by path.
+    try:
+        # Only the current version can be downloaded. If the entry has changed
+        # since we started, its data can't be mixed with what we already have.
+        current_entry = EntryCache.get_instance().cache.get(entry.id)
+        if get_entry_version(current_entry) != get_entry_version(entry):
+            _LOGGER.warning("Entry [%s] has changed remotely since it was "
+                            "opened. The rest of the opened version can't be "
+                            "retrieved.", entry.id)
+
+            raise fuse.FuseOSError(EIO)
+
+        get_gdrive().download_ranges(
+            shared.fh.fileno(),
+            entry,
+            shared.mime_type,
+            claimed_ranges,
+            range_done_cb=block_map.mark_present)
+    except:
+        # Only what's still pending is affected.
+        for (range_offset, range_length) in claimed_ranges:
+            block_map.abandon(range_offset, range_length)
+
+        raise
+
+    # The pieces don't necessarily end on block boundaries.
+    for (range_offset, range_length) in claimed_ranges:
+        block_map.mark_present(range_offset, range_length)
+
+def _fill_shared_file(shared, entry):
+    """Retrieve the rest of the content in the background, a window at a time,
+    so that reads of parts that we haven't gotten to, yet, can still claim and
+    retrieve them on their own. This holds its own reference to the shared
+    file.
+    """
+
+    try:
+        block_map = shared.block_map
+
+        window_b = \
+            int(Conf.get('file_download_range_size_kb')) * 1024 * \
+            int(Conf.get('file_download_parallelism'))
+
+        _LOGGER.debug("Filling [%s] in the background.", entry.id)
+
+        offset = 0
+        while offset < block_map.size:
+            claimed_ranges = block_map.claim_missing_ranges(offset, window_b)
+            if claimed_ranges:
+                _fetch_claimed(shared, entry, claimed_ranges)
+
+            offset += window_b
+
+        _LOGGER.debug("Background fill of [%s] is complete.", entry.id)
+    finally:
+        _release_shared_file(shared)
+
+def _prefetch_shared_file(shared, offset, length):
+    """Retrieve whatever part of the range nobody else has, yet. This runs on
+    a read-ahead worker, and holds its own reference to the shared file.
+    """
+
+    try:
+        block_map = shared.block_map
+
+        claimed_ranges = block_map.claim_missing_ranges(offset, length)
+        if claimed_ranges:
+            _fetch_claimed(shared, shared.entry, claimed_ranges)
+    finally:
+        _release_shared_file(shared)
+
+def _journaled_upload_finished(shared, write_generation, entry):
+    """The write-back journal is done with the content that was flushed at
+    the given write-generation. The entry is None if the upload was dropped.
+    """
+
+    with shared.locker:
+        shared.pending_upload_count -= 1
+
+        # If nothing was written since, what we have locally is now the
+        # current version. Future opens can use it.
+        if entry is not None and \
+           shared.content is not None and \
+           shared.is_dirty is False and \
+           shared.write_generation == write_generation:
+            get_content_cache().attach(shared.content, entry)
+
+    _release_shared_file(shared)
+
+def get_local_size(entry_id):
+    """Return the local size of the entry if it's open with changes that
+    haven't been uploaded yet, or None.
+    """
+
+    with _SHARED_FILES_LOCK:
+        for shared in _SHARED_FILES.values():
+            if shared.entry_id == entry_id and \
+               shared.content is not None and \
+               (shared.is_dirty is True or shared.pending_upload_count > 0):
+                return shared.size
+
+    return None
 
 
 class OpenedFile(object):
     """This class describes a single open file, and manages changes."""
 
-    def __init__(self, entry_id, path, filename, is_hidden, mime_type):
-# TODO(dustin): Until we can gracely orchestrate concurrent handles on the same
-#               entry, we can't allow it. This is referenced, just below.
-        with _OPENED_ENTRIES_LOCK:
-            assert entry_id not in _OPENED_ENTRIES, \
-                   "Access to the same file from multiple file-handles is "\
-                   "not currently supported."
-
-            _OPENED_ENTRIES.add(entry_id)
+    def __init__(self, entry_id, path, filename, is_hidden, mime_type,
+                 is_truncated=False, is_write_only=False):
+        self.__shared = None
 
         _LOGGER.info("Opened-file object created for entry-ID [%s] and path "
                      "(%s).", entry_id, path)
 
-        self.__entry_id = entry_id
         self.__path = path
         self.__filename = filename
         self.__is_hidden = is_hidden
@@ -205,50 +566,53 @@ class OpenedFile(object):
         self.__mime_type = mime_type
         self.__cache = EntryCache.get_instance().cache
 
-        self.__is_loaded = False
-        self.__is_dirty = False
-
-        # Use the monotonically incremented `opened_count` to produce a unique
-        # temporary filepath.
+        # Sequential-access detection and read-ahead state.
+        self.__readahead_locker = threading.Lock()
+        self.__last_read_end = None
+        self.__sequential_count = 0
+        self.__readahead_window = 0
+        self.__readahead_marker = 0
+        self.__readahead_end = 0
+        self.__readahead_stats = {
+            'readahead_windows': 0,
+            'readahead_bytes': 0,
+            'prefetch_hits': 0,
+            'read_misses': 0,
+        }
 
-        om = get_om()
-        self.__temp_filepath = \
-            os.path.join(om.temp_path, str(om.opened_count))
+        # Every handle on the same entry (and format) shares a single local
+        # copy. Only the first one has to establish it.
+        self.__shared = _acquire_shared_file(entry_id, mime_type)
 
-        self.__fh = None
+        try:
+            # A truncating open doesn't need the existing content at all, and
+            # a write-only one might be truncated before it needs it.
+            if is_truncated is True:
+                self.truncate(0)
+            elif is_write_only is False:
+                self.__ensure_loaded()
+        except:
+            shared = self.__shared
+            self.__shared = None
 
-        # We need to load this up-front. Since we can't do partial updates, we
-        # have to keep one whole, local copy, apply updates to it, and then
-        # post it on flush.
-# TODO(dustin): Until we finish working on the download-agent so that we can
-#               have a way to orchestrate concurrent handles on the same file,
-#               we'll just have to accept the fact that concurrent access will
-#               require multiple downloads of the same file to multiple
-#               temporary files (one for each).
-        self.__load_base_from_remote()
+            _release_shared_file(shared, is_handle=True)
+            raise
 
     def __del__(self):
         """This handle is being closed. Notice that we don't flush here because
         we expect that the VFS will.
         """
 
-        if self.__fh is not None:
-            _LOGGER.debug("Removing temporary file [%s] ([%s]).",
-                          self.__temp_filepath, self.file_path)
-
-            self.__fh.close()
-            os.unlink(self.__temp_filepath)
-
-        with _OPENED_ENTRIES_LOCK:
-            _OPENED_ENTRIES.remove(self.__entry_id)
+        if self.__shared is not None:
+            _release_shared_file(self.__shared, is_handle=True)
 
     def __repr__(self):
         replacements = {
-            'entry_id': self.__entry_id,
+            'entry_id': self.entry_id,
             'filename': self.__filename,
             'mime_type': self.__mime_type,
-            'is_loaded': self.__is_loaded,
-            'is_dirty': self.__is_dirty
+            'is_loaded': self.__shared.is_loaded,
+            'is_dirty': self.__shared.is_dirty
         }
 
         return ("<OF [%(entry_id)s] F=[%(filename)s] MIME=[%(mime_type)s] "
@@ -262,70 +626,241 @@ class OpenedFile(object):
 #       We should also make sure to remove temporary file-paths in the OM temp-
 #       path (if one exists) if we get a "delete" change.
 
+    def __ensure_loaded(self):
+        """Establish the local data if no handle has, yet."""
+
+        shared = self.__shared
+
+        with shared.locker:
+            if shared.is_loaded is True:
+                return
+
+            # Content for this entry that was journaled before we last went
+            # down has to be sent before we can use the entry.
+            write_back = get_write_back()
+            if write_back.has_pending(self.entry_id) is True:
+                write_back.sync(self.entry_id)
+
+            self.__load_base_from_remote()
+
+    def __load_empty(self, entry):
+        """Establish the local data as empty, without retrieving anything.
+        The existing content is being replaced. The locker must be held.
+        """
+
+        shared = self.__shared
+
+        _LOGGER.debug("Establishing empty content for [%s].", entry.id)
+
+        write_back = get_write_back()
+        if write_back.has_pending(entry.id) is True:
+            write_back.sync(entry.id)
+
+        content = get_content_cache().acquire(entry, self.mime_type)
+        get_content_cache().detach(content)
+
+        shared.content = content
+
+        shared.fh = open(content.filepath, 'r+b', 0)
+        shared.fh.truncate(0)
+        shared.size = 0
+        shared.is_loaded = True
+
+        # The empty file has to be sent even if nothing is written to it.
+        shared.is_dirty = True
+        shared.write_generation += 1
+
     def __load_base_from_remote(self):
         """Download the data for the entry that we represent. This is probably
         a file, but could also be a stub for -any- entry.
         """
 
-        # If it's loaded and not-changed, don't do anything.
-        if self.__is_loaded is True and self.__is_dirty is False:
-            _LOGGER.debug("Not syncing-down non-dirty file.")
+        entry = self.__cache.get(self.entry_id)
+
+        _LOGGER.info("Ensuring local availability of entry [%s] with "
+                     "mime-type [%s].", entry, self.mime_type)
+
+        if entry.requires_mimetype:
+            d = DisplacedFile(entry)
+            stub_data = d.deposit_stub(self.mime_type).encode('utf-8')
+
+            self.__shared.fh = open(self.__shared.temp_filepath, 'w+b', 0)
+            self.__shared.fh.write(stub_data)
+            self.__shared.size = len(stub_data)
+            self.__shared.is_loaded = True
+        else:
+            self.__load_cached_base(entry)
+
+        _LOGGER.debug("Established base file-data for [%s]: [%s]",
+                      entry, self.__shared.filepath)
+
+    def __load_cached_base(self, entry):
+        """Attach to the cached content for the current version of the entry.
+        If it's not cached, yet, establish an empty, sparse file of the right
+        size. Nothing is downloaded until it's actually read unless sparse
+        reads have been disabled.
+        """
+
+        content = get_content_cache().acquire(entry, self.mime_type)
+        self.__shared.content = content
+        self.__shared.entry = entry
+
+        if content.is_complete is False:
+            if content.block_map is None:
+                _LOGGER.debug("Establishing sparse file for [%s]: [%s] (%d)",
+                              entry.id, content.filepath, entry.file_size)
+
+                block_size_b = \
+                    int(Conf.get('file_sparse_block_size_kb')) * 1024
+
+                content.set_sparse(entry.file_size, block_size_b)
+
+            self.__shared.block_map = content.block_map
+
+        # The ranges are written straight to the descriptor underneath this,
+        # so we can't have a buffer that might hold stale data.
+        self.__shared.fh = open(content.filepath, 'r+b', 0)
+        self.__shared.size = content.size
+        self.__shared.is_loaded = True
+
+        if Conf.get('file_sparse_reads') is not True and \
+           self.__shared.block_map is not None:
+            if Conf.get('file_background_fill') is True:
+                self.__start_fill(entry)
+            else:
+                self.__ensure_all()
+
+    def __start_fill(self, entry):
+        """Retrieve the whole file without making the open wait for it. Reads
+        and writes only wait for the parts that they need.
+        """
+
+        shared = self.__shared
+
+        with _SHARED_FILES_LOCK:
+            shared.refcount += 1
+
+        _get_readahead_pool().submit(_fill_shared_file, shared, entry)
+
+    def __fetch_claimed(self, claimed_ranges):
+        _fetch_claimed(self.__shared, self.__shared.entry, claimed_ranges)
+
+    def __ensure_range(self, offset, length):
+        """Download whatever parts of the given range we don't have yet, or
+        wait for them if they're already being downloaded. Returns True if we
+        had to download anything ourselves.
+        """
+
+        block_map = self.__shared.block_map
+        if block_map is None:
+            return False
+
+        did_fetch = False
+        while 1:
+            claimed_ranges = block_map.claim_missing_ranges(offset, length)
+
+            if claimed_ranges:
+                try:
+                    self.__fetch_claimed(claimed_ranges)
+                except ExportFormatError:
+                    _LOGGER.exception("There was an export-format error.")
+                    raise fuse.FuseOSError(ENOENT)
+
+                did_fetch = True
+
+            # If someone else was retrieving part of it and failed, we'll try
+            # it ourselves.
+            if block_map.wait_for_range(offset, length) is True:
+                return did_fetch
+
+    def __check_readahead(self, offset, length):
+        """Watch for sequential access. Once we see it, keep a window of data
+        being prefetched ahead of the reader. Like the kernel, the next window
+        is scheduled once the reader reaches the start of the last one, and
+        each window is twice as large as the last (up to a limit).
+        """
+
+        if self.__shared.block_map is None:
             return
 
-        if self.__fh is not None:
-            self.__fh.close()
-            self.__fh = None
+        max_window_b = int(Conf.get('file_readahead_max_kb')) * 1024
+        if max_window_b == 0:
+            return
 
-        entry = self.__cache.get(self.__entry_id)
+        end = offset + length
 
-        _LOGGER.debug("Ensuring local availability of [%s]: [%s]",
-                      entry, self.__temp_filepath)
+        with self.__readahead_locker:
+            if offset == self.__last_read_end:
+                self.__sequential_count += 1
+            else:
+                self.__sequential_count = 0
+                self.__readahead_window = 0
 
-        # Get the current version of the write-cache file, or note that we
-        # don't have it.
+            self.__last_read_end = end
 
-        _LOGGER.info("Attempting local cache update of file [%s] for entry "
-                     "[%s] and mime-type [%s].",
-                     self.__temp_filepath, entry, self.mime_type)
+            if self.__sequential_count < _READAHEAD_SEQUENTIAL_THRESHOLD:
+                return
 
-        if entry.requires_mimetype:
-            length = DisplacedFile.file_size
+            if self.__readahead_window == 0:
+                min_window_b = int(Conf.get('file_readahead_min_kb')) * 1024
+                self.__readahead_window = min(min_window_b, max_window_b)
+                self.__readahead_end = end
+            elif end < self.__readahead_marker:
+                return
+            else:
+                self.__readahead_window = \
+                    min(self.__readahead_window * 2, max_window_b)
 
-            d = DisplacedFile(entry)
-            stub_data = d.deposit_file(self.mime_type).encode('utf-8')
+            window_offset = max(self.__readahead_end, end)
+            if window_offset >= self.__shared.block_map.size:
+                return
 
-            self.__fh = open(self.__temp_filepath, 'w+b')
-            self.__fh.write(stub_data)
-        else:
-            _LOGGER.debug("Executing the download: [%s] => [%s]",
-                          entry.id, self.__temp_filepath)
+            window_length = self.__readahead_window
 
-            try:
-# TODO(dustin): We need to inherit a file that we might've already cached by
-#               opening.
-# TODO(dustin): Any call to download_to_local should use a local, temporarily
-#               file is already established. We can't use it in the reverse
-#               order though: It's one thing to already have a cache from
-#               having opened it, and it's a another thing to maintain a cache
-#               of every file that is copied.
-                gd = get_gdrive()
-                result = gd.download_to_local(
-                            self.__temp_filepath,
-                            entry,
-                            self.mime_type)
-
-                (length, cache_fault) = result
-            except ExportFormatError:
-                _LOGGER.exception("There was an export-format error.")
-                raise fuse.FuseOSError(ENOENT)
-
-            self.__fh = open(self.__temp_filepath, 'r+b')
-
-            self.__is_dirty = False
-            self.__is_loaded = True
+            self.__readahead_marker = window_offset
+            self.__readahead_end = window_offset + window_length
 
-        _LOGGER.debug("Established base file-data for [%s]: [%s]",
-                      entry, self.__temp_filepath)
+            self.__readahead_stats['readahead_windows'] += 1
+            self.__readahead_stats['readahead_bytes'] += window_length
+
+        _LOGGER.debug("Scheduling read-ahead of (%d):(%d) for [%s].",
+                      window_offset, window_length, self.entry_id)
+
+        shared = self.__shared
+
+        # The handle may be closed before the window arrives.
+        with _SHARED_FILES_LOCK:
+            shared.refcount += 1
+
+        _get_readahead_pool().submit(
+            _prefetch_shared_file,
+            shared,
+            window_offset,
+            window_length)
+
+    def __ensure_all(self):
+        if self.__shared.block_map is None:
+            return
+
+        self.__ensure_range(0, self.__shared.block_map.size)
+
+    def __prepare_for_update(self, offset, length):
+        """Make sure that the blocks that will only be partially overwritten
+        are present. The blocks that will be completely overwritten don't have
+        to be downloaded at all.
+        """
+
+        if self.__shared.block_map is None:
+            return
+
+        block_size = self.__shared.block_map.block_size
+
+        if offset % block_size:
+            self.__ensure_range(offset, 1)
+
+        end = offset + length
+        if end % block_size and end < self.__shared.block_map.size:
+            self.__ensure_range(end - 1, 1)
 
     @dec_hint(['offset', 'data'], ['data'], 'OF')
     def add_update(self, offset, data):
@@ -334,47 +869,243 @@ class OpenedFile(object):
         _LOGGER.debug("Applying update for offset (%d) and length (%d).",
                       offset, len(data))
 
-        self.__is_dirty = True
-        self.__fh.seek(offset)
-        self.__fh.write(data)
-        self.__fh.flush()
+        self.__ensure_loaded()
+        self.__prepare_for_update(offset, len(data))
+
+        shared = self.__shared
+        with shared.locker:
+            if shared.md5 is not None:
+                if offset == shared.md5_offset:
+                    shared.md5.update(data)
+                    shared.md5_offset += len(data)
+                else:
+                    shared.md5 = None
+
+            # Rewriting what's already there doesn't change anything.
+            if self.__is_same_data(offset, data) is True:
+                _LOGGER.debug("Update at (%d) does not change the data.",
+                              offset)
+
+                return
+
+            # The content will no longer match the version that it was cached
+            # under.
+            if shared.is_dirty is False and shared.content is not None:
+                get_content_cache().detach(shared.content)
+
+            # Make sure that nothing still being downloaded lands on top of
+            # what we're writing.
+            if shared.block_map is not None:
+                shared.block_map.mark_written(offset, len(data))
+
+            shared.is_dirty = True
+            shared.write_generation += 1
+
+            shared.fh.seek(offset)
+            shared.fh.write(data)
+
+            shared.size = max(shared.size, offset + len(data))
+
+    @dec_hint(['length'], prefix='OF')
+    def truncate(self, length):
+        """Cut (or extend) the local copy. It's sent with the next flush."""
+
+        _LOGGER.debug("Truncating to (%d) bytes.", length)
+
+        shared = self.__shared
+        entry = self.__cache.get(self.entry_id)
+
+        with shared.locker:
+            if shared.is_loaded is False and length == 0 and \
+               entry.requires_mimetype is False:
+                self.__load_empty(entry)
+                return
+
+        self.__ensure_loaded()
+
+        with shared.locker:
+            if shared.size == length:
+                return
+
+            if shared.is_dirty is False and shared.content is not None:
+                get_content_cache().detach(shared.content)
+
+            # Whatever is past the cut no longer has to be retrieved.
+            if shared.block_map is not None:
+                shared.block_map.truncate(length)
+
+            if shared.md5 is not None and shared.md5_offset > length:
+                shared.md5 = None
+
+            # Nothing can be read past the cut through the old map.
+            if shared.map is not None and length < shared.size:
+                shared.map.close()
+                shared.map = None
+
+            shared.is_dirty = True
+            shared.write_generation += 1
+
+            shared.fh.truncate(length)
+            shared.size = length
+
+    def __is_same_data(self, offset, data):
+        """Return True if the data is identical to what we already have at
+        that position. The locker must be held.
+        """
+
+        shared = self.__shared
+        end = offset + len(data)
+
+        if end > shared.size or not data:
+            return False
+
+        if shared.block_map is not None and \
+           shared.block_map.is_present(offset, len(data)) is False:
+            return False
+
+        return shared.get_map()[offset:end] == data
+
+    def __reset_md5(self):
+        """What we have locally has been sent. Start tracking sequential
+        writes over. The locker must be held.
+        """
+
+        shared = self.__shared
+
+        shared.md5 = hashlib.md5()
+        shared.md5_offset = 0
+
+    def __get_md5(self):
+        """Return the MD5 of the local content. If the whole file was
+        written sequentially since the last flush, we already have it.
+        Otherwise, it's read back.
+        """
+
+        shared = self.__shared
+
+        with shared.locker:
+            if shared.md5 is not None and shared.md5_offset == shared.size:
+                return shared.md5.hexdigest()
+
+            filepath = shared.filepath
+            size = shared.size
+
+        # Any writes while we're doing this will bump the write-generation,
+        # and the caller will know that the checksum is stale.
+        md5 = hashlib.md5()
+        with open(filepath, 'rb') as f:
+            while size > 0:
+                data = f.read(min(size, _MD5_READ_SIZE_B))
+                if not data:
+                    break
+
+                md5.update(data)
+                size -= len(data)
+
+        return md5.hexdigest()
+
+    def __is_unchanged(self, entry):
+        """Return True if the local content is identical to the current
+        remote version (when we can tell).
+        """
+
+        if entry.md5_checksum is None or \
+           entry.file_size != self.__shared.size:
+            return False
+
+        return self.__get_md5() == entry.md5_checksum
 
     @dec_hint(prefix='OF')
     def flush(self):
-        """The OS wants to effect any changes made to the file."""
+        """The OS wants to effect any changes made to the file. The changes
+        made through any of the handles on this entry are sent together.
+        """
 
         _LOGGER.debug("Flushing opened-file.")
 
-        entry = self.__cache.get(self.__entry_id)
-
-        if self.__is_dirty is False:
-            _LOGGER.debug("Flush will be skipped for [%s] because there "
-                          "are no changes: [%s] IS_LOADED=[%s] "
-                          "IS_DIRTY=[%d]",
-                          entry.id, self.file_path, self.__is_loaded,
-                          self.__is_dirty)
-            return
-        else:
-            st = os.stat(self.__temp_filepath)
+        shared = self.__shared
+
+        # If another handle is already sending the changes, wait for it. There
+        # may be nothing left to do once it's done.
+        with shared.flush_locker:
+            entry = self.__cache.get(self.entry_id)
+
+            # New files only exist locally until their first flush, and then
+            # they're created with their content (if any).
+            if entry.is_provisional is True:
+                self.__ensure_loaded()
+                self.__materialize(entry)
+                return
+
+            if shared.is_dirty is False:
+                _LOGGER.debug("Flush will be skipped for [%s] because there "
+                              "are no changes: [%s] IS_LOADED=[%s] "
+                              "IS_DIRTY=[%d]",
+                              entry.id, self.file_path, shared.is_loaded,
+                              shared.is_dirty)
+                return
+
+            # We can only send the whole file.
+            self.__ensure_all()
+
+            with shared.locker:
+                write_generation = shared.write_generation
+                is_upload_pending = shared.pending_upload_count > 0
+
+            # If the content ended-up the same as what's already there (and
+            # there's nothing else queued to replace it), there's nothing to
+            # send.
+            is_unchanged = \
+                is_upload_pending is False and \
+                self.__is_unchanged(entry) is True
+
+            if Conf.get('file_write_back') is True:
+                if is_unchanged is True:
+                    self.__discard_unchanged(entry, write_generation)
+                else:
+                    self.__flush_to_journal()
+
+                return
+
+            filepath = shared.filepath
+
+            if is_unchanged is True:
+                _LOGGER.debug("Content for entry with ID [%s] is unchanged. "
+                              "Only the metadata will be updated.", entry.id)
+
+                data_filepath = None
+            else:
+                _LOGGER.debug("Pushing (%d) bytes for entry with ID from [%s] "
+                              "to GD for file-path [%s].",
+                              shared.size, entry.id, filepath)
 
-            _LOGGER.debug("Pushing (%d) bytes for entry with ID from [%s] to "
-                          "GD for file-path [%s].",
-                          st.st_size, entry.id, self.__temp_filepath)
+                data_filepath = filepath
 
 # TODO: Make sure we sync the mtime to remote.
             gd = get_gdrive()
             entry = gd.update_entry(
                         entry,
                         filename=entry.title,
-                        data_filepath=self.__temp_filepath,
+                        data_filepath=data_filepath,
                         mime_type=self.mime_type,
                         parents=entry.parents,
                         is_hidden=self.__is_hidden)
 
-            self.__is_dirty = False
-
-# TODO(dustin): For now, we don't cleanup the temporary file. We need to
-#               schedule this using LRU-semantics.
+            with shared.locker:
+                # If there were writes while we were uploading, what we have
+                # is still ahead of what was sent, and the next flush will
+                # send it.
+                if shared.write_generation == write_generation:
+                    shared.is_dirty = False
+                    self.__reset_md5()
+
+                    # What we have, locally, is now the current version.
+                    # Future opens can use it.
+                    if shared.content is not None:
+                        get_content_cache().attach(shared.content, entry)
+                else:
+                    _LOGGER.debug("Entry [%s] was written while it was being "
+                                  "uploaded. It remains dirty.", entry.id)
 
             # Immediately update our current cached entry.
 
@@ -385,23 +1116,195 @@ class OpenedFile(object):
 
             _LOGGER.info("Update complete on entry with ID [%s].", entry.id)
 
+    def __materialize(self, provisional_entry):
+        """Create the file remotely, with whatever content it has so far,
+        and then use the real entry in place of the provisional one.
+        """
+
+        shared = self.__shared
+
+        with shared.locker:
+            write_generation = shared.write_generation
+
+            if shared.size > 0:
+                data_filepath = shared.filepath
+            else:
+                data_filepath = None
+
+        _LOGGER.debug("Creating provisional entry [%s] remotely with (%d) "
+                      "bytes.", provisional_entry.id, shared.size)
+
+        gd = get_gdrive()
+        entry = gd.create_file(
+                    provisional_entry.title,
+                    provisional_entry.parents,
+                    self.mime_type,
+                    data_filepath=data_filepath,
+                    is_hidden=self.__is_hidden)
+
+        path_relations = PathRelations.get_instance()
+
+        with shared.locker:
+            # Anyone who looks for the entry, from here on, finds the real one.
+            # The provisional entry has to give up its name before the real
+            # one is registered, or the real one would be given a variation
+            # of it.
+            with _SHARED_FILES_LOCK, PathRelations.rlock:
+                path_relations.remove_entry_all(
+                    provisional_entry.id,
+                    is_update=True)
+
+                path_relations.register_entry(entry)
+                _rekey_shared_file(shared, entry.id)
+
+            # If there were writes while we were uploading, the next flush
+            # will send them as an update.
+            if shared.write_generation == write_generation:
+                shared.is_dirty = False
+                self.__reset_md5()
+
+                if shared.content is not None:
+                    get_content_cache().attach(shared.content, entry)
+
+        _LOGGER.info("Provisional entry [%s] was created as [%s].",
+                     provisional_entry.id, entry.id)
+
+    def __discard_unchanged(self, entry, write_generation):
+        """The local content is identical to the current version. Put it back
+        in the cache under that version instead of sending it.
+        """
+
+        shared = self.__shared
+
+        with shared.locker:
+            if shared.write_generation != write_generation:
+                # It was written while we were checking. The next flush will
+                # look again.
+                return
+
+            _LOGGER.debug("Content for entry with ID [%s] is unchanged. "
+                          "Nothing will be sent.", entry.id)
+
+            shared.is_dirty = False
+            self.__reset_md5()
+
+            if shared.content is not None:
+                get_content_cache().attach(shared.content, entry)
+
+    def __flush_to_journal(self):
+        """Record the changes for a background upload rather than uploading
+        them now.
+        """
+
+        shared = self.__shared
+        write_back = get_write_back()
+
+        # Copying the file can take a while, so reads and writes aren't held
+        # up while we do. If there were any writes while we were copying, the
+        # copy is thrown away and we try again.
+        for i in range(_JOURNAL_COPY_ATTEMPTS):
+            with shared.locker:
+                write_generation = shared.write_generation
+
+                # The file may be renamed while we're copying it.
+                f = open(shared.filepath, 'rb')
+
+            try:
+                pending = write_back.stage(
+                            self.entry_id,
+                            self.mime_type,
+                            self.__is_hidden,
+                            f)
+            finally:
+                f.close()
+
+            with shared.locker:
+                if shared.write_generation == write_generation:
+                    break
+
+            _LOGGER.debug("Entry [%s] was written while it was being "
+                          "journaled. Copying it again.", self.entry_id)
+
+            write_back.discard(pending)
+        else:
+            # It's being written too steadily. The writes have to wait.
+            with shared.locker:
+                write_generation = shared.write_generation
+
+                with open(shared.filepath, 'rb') as f:
+                    pending = write_back.stage(
+                                self.entry_id,
+                                self.mime_type,
+                                self.__is_hidden,
+                                f)
+
+        # The journal holds a reference until it's done with the content.
+        with shared.locker:
+            with _SHARED_FILES_LOCK:
+                shared.refcount += 1
+
+            shared.pending_upload_count += 1
+
+        listener = functools.partial(
+                    _journaled_upload_finished,
+                    shared,
+                    write_generation)
+
+        write_back.commit(pending, listener=listener)
+
+        with shared.locker:
+            # Anything written since the copy was made is still ahead of what
+            # was journaled, and the next flush will send it.
+            if shared.write_generation == write_generation:
+                shared.is_dirty = False
+                self.__reset_md5()
+
+        _LOGGER.info("Changes to entry with ID [%s] have been journaled.",
+                     self.entry_id)
+
+    @dec_hint(prefix='OF')
+    def fsync(self):
+        """Flush, and then make sure that the changes have actually been
+        uploaded.
+        """
+
+        self.flush()
+        get_write_back().sync(self.entry_id)
+
     @dec_hint(['offset', 'length'], prefix='OF')
     def read(self, offset, length):
 
         _LOGGER.debug("Reading (%d) bytes at offset (%d).", length, offset)
 
+        self.__ensure_loaded()
+
         # We don't care if the cache file is dirty (not on this system, at
         # least).
 
-        st = os.stat(self.__temp_filepath)
+        self.__check_readahead(offset, length)
+
+        did_fetch = self.__ensure_range(offset, length)
 
-        self.__fh.seek(offset)
-        data = self.__fh.read(length)
+        with self.__readahead_locker:
+            if did_fetch is True:
+                self.__readahead_stats['read_misses'] += 1
+            elif self.__readahead_window > 0:
+                self.__readahead_stats['prefetch_hits'] += 1
+
+        shared = self.__shared
+        with shared.locker:
+            size = shared.size
+            end = min(offset + length, size)
+
+            if offset < end:
+                data = shared.get_map()[offset:end]
+            else:
+                data = b''
 
         len_ = len(data)
 
         _LOGGER.debug("(%d) bytes retrieved from slice (%d):(%d)/(%d).",
-                      len_, offset, length, st.st_size)
+                      len_, offset, length, size)
 
         if len_ != length:
             _LOGGER.warning("Read request is only returning (%d) bytes when "
@@ -409,13 +1312,34 @@ class OpenedFile(object):
 
         return data
 
+    @property
+    def is_shared(self):
+        """Return True if other handles are using the same local data.
+        Background fills and pending uploads don't count.
+        """
+
+        with _SHARED_FILES_LOCK:
+            return self.__shared.handle_count > 1
+
+    @property
+    def readahead_stats(self):
+        """Counters to help tune read-ahead: how many windows were scheduled
+        (and how many bytes they covered), how many reads didn't have to wait
+        on a download of their own while read-ahead was active, and how many
+        reads had to download something.
+        """
+
+        with self.__readahead_locker:
+            return dict(self.__readahead_stats)
+
     @property
     def mime_type(self):
         return self.__mime_type
 
     @property
     def entry_id(self):
-        return self.__entry_id
+        # This changes if the entry is created remotely while we're open.
+        return self.__shared.entry_id
 
     @property
     def file_path(self):
@@ -423,10 +1347,11 @@ class OpenedFile(object):
 
         return build_filepath(self.__path, self.__filename)
 
-def create_for_existing_filepath(filepath):
+def create_for_existing_filepath(filepath, flags=0):
     """Process the file/path that was requested (potential export-type
     directive, dot-prefix, etc..), and build an opened-file object using
-    the information.
+    the information. The open() flags determine whether we need the existing
+    content up-front.
     """
 
     _LOGGER.debug("Creating OpenedFile for [%s].", filepath)
@@ -492,7 +1417,67 @@ def create_for_existing_filepath(filepath):
             path,
             filename,
             is_hidden,
-            final_mimetype)
+            final_mimetype,
+            is_truncated=(flags & os.O_TRUNC) != 0,
+            is_write_only=(flags & os.O_ACCMODE) == os.O_WRONLY)
+
+_TRUNCATED_LOCK = threading.Lock()
+_TRUNCATED = set()
+
+def truncate_by_filepath(filepath, length):
+    """Truncate the local copy of a file that might not be open. This usually
+    precedes an open and some writes, so we hold the change for a moment so
+    that it can be sent with them.
+    """
+
+    opened_file = create_for_existing_filepath(filepath, os.O_WRONLY)
+    opened_file.truncate(length)
+
+    with _TRUNCATED_LOCK:
+        _TRUNCATED.add(opened_file)
+
+    t = threading.Timer(
+            _TRUNCATE_SETTLE_TIME_S,
+            _flush_truncated,
+            (opened_file,))
+
+    t.daemon = True
+    t.start()
+
+def _flush_truncated(opened_file):
+    with _TRUNCATED_LOCK:
+        try:
+            _TRUNCATED.remove(opened_file)
+        except KeyError:
+            # It was already flushed at unmount.
+            return
+
+    # If it has been opened since, that handle will send it.
+    if opened_file.is_shared is True:
+        _LOGGER.debug("Truncated file is open elsewhere. It will be sent when "
+                      "that handle is flushed: %s", opened_file)
+        return
+
+    try:
+        opened_file.flush()
+    except:
+        _LOGGER.exception("Could not send truncated file: %s", opened_file)
+
+def flush_truncated_all():
+    """Send anything that was truncated by path but not sent, yet. This is
+    called at unmount.
+    """
+
+    with _TRUNCATED_LOCK:
+        truncated = list(_TRUNCATED)
+        _TRUNCATED.clear()
+
+    for opened_file in truncated:
+        try:
+            opened_file.flush()
+        except:
+            _LOGGER.exception("Could not send truncated file: %s",
+                              opened_file)
 
 _management_instance = None
 def get_om():
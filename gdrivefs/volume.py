@@ -1,7 +1,9 @@
 import logging
 import threading
+import time
 import collections
 
+import gdrivefs.conf
 import gdrivefs.utility
 import gdrivefs.drive
 import gdrivefs.account_info
@@ -12,12 +14,64 @@ import gdrivefs.errors
 
 CLAUSE_ENTRY            = 0 # Normalized entry.
 CLAUSE_PARENT           = 1 # List of parent clauses.
-CLAUSE_CHILDREN         = 2 # List of 2-tuples describing children: (filename, clause)
+CLAUSE_CHILDREN         = 2 # Children, by (unique) filename: {filename: clause}
 CLAUSE_ID               = 3 # Entry ID.
 CLAUSE_CHILDREN_LOADED  = 4 # All children loaded?
+CLAUSE_CHILDREN_BYID    = 5 # Child entry-ID to (filename, base, variation).
+CLAUSE_NEXT_VARIATION   = 6 # Base filename to the lowest duplicate-variation
+                            # that might be free.
+
+# The most " (n)" variations of a filename that we'll make among siblings.
+_MAX_FILENAME_VARIATIONS = 255
 
 _logger = logging.getLogger(__name__)
 
+def _build_clause(normalized_entry, entry_id):
+    return [normalized_entry, [ ], collections.OrderedDict(), entry_id, False,
+            { }, { }]
+
+class _NegativeLookups(object):
+    """Remembers, for a while, the names that were looked-up among the
+    children of a directory and that were found to not exist, so that probing
+    for them again (which shells, VCSs, and interpreters do constantly) doesn't
+    cost a query. Only the most-recently-missed are kept. The caller provides
+    the locking.
+    """
+
+    def __init__(self):
+        # (parent-ID, filename) => expiry
+        self.__misses = collections.OrderedDict()
+
+    def add(self, parent_id, filename):
+        max_count = int(gdrivefs.conf.Conf.get('negative_lookup_cache_size'))
+        if max_count <= 0:
+            return
+
+        key = (parent_id, filename)
+        self.__misses.pop(key, None)
+        self.__misses[key] = \
+            time.time() + int(gdrivefs.conf.Conf.get('negative_lookup_ttl_s'))
+
+        while len(self.__misses) > max_count:
+            self.__misses.popitem(last=False)
+
+    def is_missing(self, parent_id, filename):
+        key = (parent_id, filename)
+
+        try:
+            expires_at = self.__misses[key]
+        except KeyError:
+            return False
+
+        if time.time() >= expires_at:
+            del self.__misses[key]
+            return False
+
+        return True
+
+    def discard(self, parent_id, filename):
+        self.__misses.pop((parent_id, filename), None)
+
 def path_resolver(path):
     path_relations = PathRelations.get_instance()
 
@@ -37,8 +91,10 @@ class PathRelations(object):
     rlock = threading.RLock()
 
     entry_ll = { }
-    path_cache = { }
-    path_cache_byid = { }
+
+    # Incremented with every registration and removal.
+    generation = 0
+    negative_lookups = _NegativeLookups()
 
     @staticmethod
     def get_instance():
@@ -108,13 +164,6 @@ class PathRelations(object):
             # Ensure that the entry-ID is valid.
 
             entry_clause = self.entry_ll[entry_id]
-            
-            # Clip from path cache.
-
-            if entry_id in self.path_cache_byid:
-                path = self.path_cache_byid[entry_id]
-                del self.path_cache[path]
-                del self.path_cache_byid[entry_id]
 
             # Clip us from the list of children on each of our parents.
 
@@ -128,11 +177,9 @@ class PathRelations(object):
                     # A placeholder has an entry and parents field (fields 
                     # 0, 1) of None.
 
-                    (parent, parent_parents, parent_children, parent_id, \
-                        all_children_loaded) = parent_clause
-
-                    if all_children_loaded and not is_update:
-                        all_children_loaded = False
+                    parent = parent_clause[CLAUSE_ENTRY]
+                    parent_children = parent_clause[CLAUSE_CHILDREN]
+                    parent_id = parent_clause[CLAUSE_ID]
 
                     # Integrity-check that the parent we're referencing is 
                     # still in the list.
@@ -141,25 +188,26 @@ class PathRelations(object):
                                      "[%s] is not valid." % 
                                      (parent_id, entry_id))
                         continue
-            
-                    old_children_filenames = [ child_tuple[0] for child_tuple 
-                                                in parent_children ]
-
-                    updated_children = [ child_tuple for child_tuple 
-                                         in parent_children 
-                                         if child_tuple[1] != entry_clause ]
 
-                    if parent_children != updated_children:
-                        parent_children[:] = updated_children
-
-                    else:
+                    try:
+                        (filename, filename_base, variation) = \
+                            parent_clause[CLAUSE_CHILDREN_BYID].pop(entry_id)
+                    except KeyError:
                         _logger.error("Entry with ID [%s] referenced parent "
                                       "with ID [%s], but not vice-versa." % 
                                       (entry_id, parent_id))
+                    else:
+                        del parent_children[filename]
+
+                        # Unless it's about to be re-registered, we no longer
+                        # know about all of this parent's children.
+                        if is_update is False:
+                            parent_clause[CLAUSE_CHILDREN_LOADED] = False
 
-                    updated_children_filenames = [ child_tuple[0] 
-                                                    for child_tuple
-                                                    in parent_children ]
+                        # That variation of the name is free, again.
+                        next_variations = parent_clause[CLAUSE_NEXT_VARIATION]
+                        if variation < next_variations.get(filename_base, 0):
+                            next_variations[filename_base] = variation
 
                     # If the parent now has no children and is a placeholder, 
                     # advise that we remove it.
@@ -170,6 +218,8 @@ class PathRelations(object):
 
             set_placeholder = len(entry_children_tuples) > 0
 
+            PathRelations.generation += 1
+
             if set_placeholder:
                 # Just nullify the entry information, but leave the clause. We 
                 # had children that still need a parent.
@@ -179,8 +229,7 @@ class PathRelations(object):
             else:
                 del self.entry_ll[entry_id]
 
-        children_entry_clauses = [ child_tuple[1] for child_tuple 
-                                    in entry_children_tuples ]
+        children_entry_clauses = list(entry_children_tuples.values())
 
         return (parents_to_remove, children_entry_clauses)
 
@@ -246,10 +295,10 @@ class PathRelations(object):
 
             else:
                 for parent_clause in parents:
-                    matching_children = [filename for filename, child_clause 
-                                                  in parent_clause[2] 
-                                                  if child_clause == entry_clause]
-                    if not matching_children:
+                    children_byid = parent_clause[CLAUSE_CHILDREN_BYID]
+                    try:
+                        (filename, _, _) = children_byid[entry_clause[3]]
+                    except KeyError:
                         _logger.error("No matching entry-ID [%s] was not "
                                       "found among children of entry's "
                                       "parent with ID [%s] for proper-"
@@ -257,10 +306,131 @@ class PathRelations(object):
                                       (entry_clause[3], parent_clause[3]))
 
                     else:
-                        found[parent_clause[3]] = matching_children[0]
+                        found[parent_clause[3]] = filename
 
         return found
 
+    def load_children(self, parent_ids):
+        """List the children of all of the given directories at once,
+        register them, and mark the directories as having all of their
+        children known.
+        """
+
+        gd = gdrivefs.drive.get_gdrive()
+
+        with PathRelations.rlock:
+            children = gd.list_files(parent_ids=parent_ids)
+
+            # What we already have is kept current by the change feed, and
+            # reregistering a directory would drop everything under it.
+            self.register_entries([ child
+                                    for child
+                                    in children
+                                    if not self.is_cached(child.id) ])
+
+            # The directories themselves might only be placeholders, so far.
+            for parent_id in parent_ids:
+                parent_clause = self.entry_ll.get(parent_id)
+                if parent_clause is not None:
+                    parent_clause[CLAUSE_CHILDREN_LOADED] = True
+
+            PathRelations.generation += 1
+
+        return children
+
+    def load_all(self):
+        """Register every file in the account, rather than discovering
+        directories as they're visited, and then mark every directory as
+        having all of its children known. Changes that happen meanwhile are
+        still applied from the change feed.
+        """
+
+        gd = gdrivefs.drive.get_gdrive()
+        page_size = int(gdrivefs.conf.Conf.get('metadata_bootstrap_page_size'))
+
+        count = 0
+        for entries in gd.iterate_all_files(page_size):
+            # As with load_children(), what we already have is kept current by
+            # the change feed, and reregistering a directory would drop
+            # everything under it.
+            with PathRelations.rlock:
+                self.register_entries([ entry
+                                        for entry
+                                        in entries
+                                        if not self.is_cached(entry.id) ])
+
+            count += len(entries)
+
+        with PathRelations.rlock:
+            for entry_clause in self.entry_ll.values():
+                normalized_entry = entry_clause[CLAUSE_ENTRY]
+                if normalized_entry is not None and \
+                   normalized_entry.is_directory is True:
+                    entry_clause[CLAUSE_CHILDREN_LOADED] = True
+
+            PathRelations.generation += 1
+
+        _logger.info("All (%d) entries have been loaded.", count)
+
+    def start_load_all(self):
+        """Run load_all() in the background."""
+
+        def load_all():
+            try:
+                self.load_all()
+            except:
+                _logger.exception("Could not load all entries. They'll "
+                                  "still be loaded as they're visited.")
+
+        t = threading.Thread(target=load_all)
+        t.daemon = True
+        t.start()
+
+    def get_state(self):
+        """Return the generation, all of the entries that exist remotely,
+        and the IDs of the directories whose children are all known (so that
+        they can be persisted).
+        """
+
+        with PathRelations.rlock:
+            entries = [ ]
+            children_loaded_ids = [ ]
+            for entry_clause in self.entry_ll.values():
+                normalized_entry = entry_clause[CLAUSE_ENTRY]
+                if normalized_entry is None or \
+                   normalized_entry.is_provisional is True:
+                    continue
+
+                entries.append(normalized_entry)
+
+                if entry_clause[CLAUSE_CHILDREN_LOADED] is True:
+                    children_loaded_ids.append(entry_clause[CLAUSE_ID])
+
+            return (PathRelations.generation, entries, children_loaded_ids)
+
+    def restore_state(self, normalized_entries, children_loaded_ids):
+        """Register persisted entries, and mark the given directories as
+        having all of their children known.
+        """
+
+        with PathRelations.rlock:
+            self.register_entries(normalized_entries)
+
+            for entry_id in children_loaded_ids:
+                entry_clause = self.entry_ll.get(entry_id)
+                if entry_clause is not None and \
+                   entry_clause[CLAUSE_ENTRY] is not None:
+                    entry_clause[CLAUSE_CHILDREN_LOADED] = True
+
+    def register_entries(self, normalized_entries):
+        """Register a batch of entries (e.g. a page of a listing) while only
+        taking the lock once.
+        """
+
+        with PathRelations.rlock:
+            for normalized_entry in normalized_entries:
+                self.register_entry(normalized_entry)
+
     def register_entry(self, normalized_entry):
 
         with PathRelations.rlock:
@@ -277,6 +447,8 @@ class PathRelations(object):
 #            self.__log.debug("Registering entry with ID [%s] within path-"
 #                             "relations.", entry_id)
 
+            PathRelations.generation += 1
+
             if self.is_cached(entry_id, include_placeholders=False):
                 self.remove_entry_recursive(entry_id, True)
 
@@ -288,9 +460,11 @@ class PathRelations(object):
             # (
             #   normalized_entry, 
             #   [ parent clause, ... ], 
-            #   [ child clause, ... ], 
+            #   { filename: child clause, ... }, 
             #   entry-ID,
-            #   < boolean indicating that we know about all children >
+            #   < boolean indicating that we know about all children >,
+            #   { child entry-ID: (filename, base, variation), ... },
+            #   { base filename: lowest variation that might be free, ... }
             # )
 
             if self.is_cached(entry_id, include_placeholders=True):
@@ -298,7 +472,7 @@ class PathRelations(object):
                 entry_clause[CLAUSE_ENTRY] = normalized_entry
                 entry_clause[CLAUSE_PARENT] = [ ]
             else:
-                entry_clause = [normalized_entry, [ ], [ ], entry_id, False]
+                entry_clause = _build_clause(normalized_entry, entry_id)
                 self.entry_ll[entry_id] = entry_clause
 
             entry_parents = entry_clause[CLAUSE_PARENT]
@@ -313,34 +487,42 @@ class PathRelations(object):
                 if self.is_cached(parent_id, include_placeholders=True):
                     parent_clause = self.entry_ll[parent_id]
                 else:
-                    parent_clause = [None, None, [ ], parent_id, False]
+                    parent_clause = _build_clause(None, parent_id)
+                    parent_clause[CLAUSE_PARENT] = None
                     self.entry_ll[parent_id] = parent_clause
 
+                # We're already registered under this parent (it was listed
+                # twice).
+                if entry_id in parent_clause[CLAUSE_CHILDREN_BYID]:
+                    continue
+
                 if parent_clause not in entry_parents:
                     entry_parents.append(parent_clause)
 
                 parent_children = parent_clause[CLAUSE_CHILDREN]
+                next_variations = parent_clause[CLAUSE_NEXT_VARIATION]
                 filename_base = title_fs
 
                 # Register among the children of this parent, but make sure we 
-                # have a unique filename among siblings.
+                # have a unique filename among siblings. Every variation below
+                # the one that we start at is known to be taken.
 
-                i = 0
-                current_variation = filename_base
+                i = next_variations.get(filename_base, 0)
                 elected_variation = None
-                while i <= 255:
-                    if not [ child_name_tuple 
-                             for child_name_tuple 
-                             in parent_children 
-                             if child_name_tuple[0] == current_variation ]:
+                while i <= _MAX_FILENAME_VARIATIONS:
+                    if i == 0:
+                        current_variation = filename_base
+                    else:
+                        current_variation = \
+                            filename_base + \
+                            gdrivefs.utility.utility.translate_filename_charset(
+                            ' (%d)' % (i,))
+
+                    if current_variation not in parent_children:
                         elected_variation = current_variation
                         break
-                        
+
                     i += 1
-                    current_variation = \
-                        filename_base + \
-                        gdrivefs.utility.utility.translate_filename_charset(
-                        ' (%d)' % (i,))
 
                 if elected_variation == None:
                     _logger.error("Could not register entry with ID [%s]. "
@@ -348,9 +530,17 @@ class PathRelations(object):
                                   "that directory." % (entry_id))
                     return
 
-                # Register us in the list of children on this parents 
-                # child-tuple list.
-                parent_children.append((elected_variation, entry_clause))
+                next_variations[filename_base] = i + 1
+
+                # Register us among the children of this parent.
+                parent_children[elected_variation] = entry_clause
+                parent_clause[CLAUSE_CHILDREN_BYID][entry_id] = \
+                    (elected_variation, filename_base, i)
+
+                # Anything that previously looked for this name should now
+                # find it.
+                self.negative_lookups.discard(parent_id, filename_base)
+                self.negative_lookups.discard(parent_id, elected_variation)
 
         return entry_clause
 
@@ -362,14 +552,14 @@ class PathRelations(object):
         with PathRelations.rlock:
             children = gd.list_files(parent_id=parent_id)
 
-            child_ids = [ ]
             if children:
-                for child in children:
-                        self.register_entry(child)
-
-                parent_clause = self.__get_entry_clause_by_id(parent_id)
+                self.register_entries(children)
 
+            # Even if it's empty, we now know everything that's in it.
+            parent_clause = self.__get_entry_clause_by_id(parent_id)
+            if parent_clause is not None:
                 parent_clause[4] = True
+                PathRelations.generation += 1
 
         return children
 
@@ -402,7 +592,7 @@ class PathRelations(object):
 #            self.__log.debug("(%d) children found.",
 #                             len(entry_clause[CLAUSE_CHILDREN]))
 
-            return entry_clause[CLAUSE_CHILDREN]
+            return list(entry_clause[CLAUSE_CHILDREN].items())
 
     def get_children_entries_from_entry_id(self, entry_id):
 
@@ -483,13 +673,33 @@ class PathRelations(object):
 
                 # The child will be the first part that was not found.
                 child_name = result[1][num_results]
+                child_name_fs = \
+                    gdrivefs.utility.utility.translate_filename_charset(
+                        child_name)
+
+                # If we already know about all of the parent's children, or
+                # we've recently looked for this one, it just doesn't exist.
+
+                parent_clause = self.entry_ll.get(parent_id)
+                if parent_clause is not None and \
+                   parent_clause[CLAUSE_CHILDREN_LOADED] is True:
+                    return result
+
+                if self.negative_lookups.is_missing(
+                        parent_id, 
+                        child_name_fs) is True:
+                    return result
 
                 children = gd.list_files(
                                 parent_id=parent_id, 
                                 query_is_string=child_name)
                 
-                for child in children:
-                    self.register_entry(child)
+                self.register_entries(children)
+
+                parent_clause = self.entry_ll.get(parent_id)
+                if parent_clause is None or \
+                   child_name_fs not in parent_clause[CLAUSE_CHILDREN]:
+                    self.negative_lookups.add(parent_id, child_name_fs)
 
                 filenames_phrase = ', '.join([ candidate.id for candidate
                                                             in children ])
@@ -505,6 +715,10 @@ class PathRelations(object):
         comprise each component, or as many as can be found. As we've ensured 
         that all sibling filenames are unique, there can not be multiple 
         matches.
+
+        We don't cache whole paths. Every directory indexes its children by
+        name, so this is one lookup per component, and once an entry is
+        removed or renamed nothing beneath it can be reached by its old path.
         """
 
         if path[0] == '/':
@@ -513,9 +727,6 @@ class PathRelations(object):
         if len(path) and path[-1] == '/':
             path = path[:-1]
 
-        if path in self.path_cache:
-            return self.path_cache[path]
-
         with PathRelations.rlock:
 #            self.__log.debug("Locating entry information for path [%s].", path)
 
@@ -554,10 +765,8 @@ class PathRelations(object):
                 if path == "":
                     found = [ root_id ]
                 else:
-                    found = [ child_tuple[1][3] 
-                              for child_tuple 
-                              in children 
-                              if child_tuple[0] == child_filename_to_search_fs ]
+                    child_clause = children.get(child_filename_to_search_fs)
+                    found = [ child_clause[3] ] if child_clause else [ ]
 
                 if found:
                     results.append(found[0])
@@ -566,11 +775,7 @@ class PathRelations(object):
 
                 # Have we traveled far enough into the linked list?
                 if (i + 1) >= num_parts:
-                    self.path_cache[path] = (results, path_parts, True)
-                    final_entry_id = results[-1]
-                    self.path_cache_byid[final_entry_id] = path
-
-                    return self.path_cache[path]
+                    return (results, path_parts, True)
 
                 parent_id = entry_ptr
                 entry_ptr = found[0]
@@ -606,73 +811,39 @@ class EntryCache(gdrivefs.cacheclient_base.CacheClientBase):
 #        about = gdrivefs.account_info.AccountInfo.get_instance()
         self.__gd = gdrivefs.drive.get_gdrive()
 
-    def __get_entries_to_update(self, requested_entry_id):
-        # Get more entries than just what was requested, while we're at it.
-
-        parent_ids = self.__gd.get_parents_containing_id(requested_entry_id)
-
-        affected_entries = [requested_entry_id]
-        considered_entries = {}
-        max_readahead_entries = gdrivefs.conf.Conf.get('max_readahead_entries')
-        for parent_id in parent_ids:
-            child_ids = self.__gd.get_children_under_parent_id(parent_id)
-
-            for child_id in child_ids:
-                if child_id == requested_entry_id:
-                    continue
-
-                # We've already looked into this entry.
-
-                try:
-                    considered_entries[child_id]
-                    continue
-                except:
-                    pass
-
-                considered_entries[child_id] = True
-
-                # Is it already cached?
-
-                if self.cache.exists(child_id):
-                    continue
-
-                affected_entries.append(child_id)
-
-                if len(affected_entries) >= max_readahead_entries:
-                    break
-
-        return affected_entries
-
     def __do_update_for_missing_entry(self, requested_entry_id):
+        """Read the entry, and then, with a single listing, everything else
+        in the same directories (whatever wanted this one will probably want
+        its siblings, too). The directories are then completely known.
+        """
 
-        # Get the entries to update.
-
-        affected_entries = self.__get_entries_to_update(requested_entry_id)
-
-        # Read the entries, now.
-
-# TODO: We have to determine when this is called, and either remove it 
-# (if it's not), or find another way to not have to load them 
-# individually.
+        normalized_entry = self.__gd.get_entry(requested_entry_id)
 
-        retrieved = self.__gd.get_entries(affected_entries)
+        path_relations = PathRelations.get_instance()
+        path_relations.register_entry(normalized_entry)
 
-        # Update the cache.
+        parent_ids = normalized_entry.parents
+        if parent_ids:
+            # Directories that we only have placeholders for would each be
+            # faulted on their own as soon as a path through them is built.
+            # Read them together.
+            missing_parent_ids = [parent_id
+                                  for parent_id
+                                  in parent_ids
+                                  if not path_relations.is_cached(parent_id)]
 
-        path_relations = PathRelations.get_instance()
+            if missing_parent_ids:
+                retrieved = self.__gd.get_entries(missing_parent_ids)
+                path_relations.register_entries(list(retrieved.values()))
 
-        for entry_id, entry in list(retrieved.items()):
-            path_relations.register_entry(entry)
+            path_relations.load_children(parent_ids)
 
-        return retrieved
+        return normalized_entry
 
     def fault_handler(self, resource_name, requested_entry_id):
         """A requested entry wasn't stored."""
 
-        retrieved = self.__do_update_for_missing_entry(requested_entry_id)
-
-        # Return the requested entry.
-        return retrieved[requested_entry_id]
+        return self.__do_update_for_missing_entry(requested_entry_id)
 
     def cleanup_pretrigger(self, resource_name, entry_id, force):
         """The core entry cache has a clean-up process that will remove old "
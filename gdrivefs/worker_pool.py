@@ -0,0 +1,105 @@
+import logging
+import threading
+
+try:
+    # Python 3
+    import queue
+except ImportError:
+    # Python 2.
+    import Queue as queue
+
+import gdrivefs.state
+
+_QUEUE_POLL_INTERVAL_S = 1
+
+_logger = logging.getLogger(__name__)
+
+
+class Job(object):
+    """A unit of work that was submitted to a pool. The caller may wait for
+    it and collect the result (or have its exception reraised).
+    """
+
+    def __init__(self, f, args, kwargs):
+        self.__f = f
+        self.__args = args
+        self.__kwargs = kwargs
+        self.__done_ev = threading.Event()
+        self.__result = None
+        self.__exception = None
+
+    def run(self):
+        try:
+            self.__result = self.__f(*self.__args, **self.__kwargs)
+        except Exception as e:
+            _logger.exception("Job [%s] failed.", self.__f.__name__)
+            self.__exception = e
+        finally:
+            self.__done_ev.set()
+
+    def wait(self):
+        """Wait for the job to finish, and return its result."""
+
+        self.__done_ev.wait()
+
+        if self.__exception is not None:
+            raise self.__exception
+
+        return self.__result
+
+    @property
+    def is_done(self):
+        return self.__done_ev.is_set()
+
+
+class WorkerPool(object):
+    """A fixed set of daemon threads that run submitted jobs in the order that
+    they were submitted. Since each thread gets its own GD client, this is
+    also how we get concurrent connections.
+    """
+
+    def __init__(self, name, num_workers):
+        self.__name = name
+        self.__q = queue.Queue()
+        self.__threads = []
+
+        for i in range(num_workers):
+            t = threading.Thread(
+                    target=self.__work,
+                    name=('%s-%d' % (name, i)))
+
+            t.daemon = True
+            t.start()
+
+            self.__threads.append(t)
+
+        _logger.debug("Pool [%s] started with (%d) workers.",
+                      name, num_workers)
+
+    def __work(self):
+        while gdrivefs.state.GLOBAL_EXIT_EVENT.is_set() is False:
+            try:
+                job = self.__q.get(timeout=_QUEUE_POLL_INTERVAL_S)
+            except queue.Empty:
+                continue
+
+            job.run()
+
+        _logger.debug("Pool worker terminating: [%s]",
+                      threading.current_thread().name)
+
+    def submit(self, f, *args, **kwargs):
+        """Queue the given callable, and return a Job."""
+
+        job = Job(f, args, kwargs)
+        self.__q.put(job)
+
+        return job
+
+    @property
+    def name(self):
+        return self.__name
+
+    @property
+    def num_workers(self):
+        return len(self.__threads)
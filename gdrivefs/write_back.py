@@ -0,0 +1,504 @@
+"""Write-back of changed file content. A flushed file is copied into an on-disk
+journal, and is uploaded from there by a background thread. Whatever is still
+in the journal when we go down (or crash) is uploaded after the next mount.
+"""
+
+import logging
+import threading
+import shutil
+import json
+import time
+import os
+import os.path
+
+import apiclient.errors
+
+import gdrivefs.config
+import gdrivefs.conf
+import gdrivefs.state
+
+from gdrivefs.drive import get_gdrive, get_upload_session_filepath
+from gdrivefs.volume import PathRelations, EntryCache
+
+_logger = logging.getLogger(__name__)
+
+_RECORD_SUFFIX = '.json'
+_DATA_SUFFIX = '.data'
+
+# How long a file has to go without being flushed again before we'll upload it
+# (unless it has been waiting for longer than the maximum staleness).
+_SETTLE_TIME_S = 2
+
+_MAX_RETRY_DELAY_S = 300
+
+
+def _fsync_path(path):
+    fd = os.open(path, os.O_RDONLY)
+
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class _PendingUpload(object):
+    """The most recently flushed content of a single entry, waiting to be
+    uploaded.
+    """
+
+    def __init__(self, entry_id, mime_type, is_hidden, sequence,
+                 first_queued_at):
+        self.entry_id = entry_id
+        self.mime_type = mime_type
+        self.is_hidden = is_hidden
+        self.sequence = sequence
+        self.first_queued_at = first_queued_at
+        self.last_queued_at = first_queued_at
+
+        self.attempts = 0
+        self.next_attempt_at = 0
+        self.is_uploading = False
+
+        # Called with the updated entry once this content has been uploaded
+        # (or with None if it was superseded or abandoned). Pending uploads
+        # recovered from the journal don't have one.
+        self.listener = None
+
+    def __repr__(self):
+        return ("<PU ENTRY=[%s] MIME=[%s] SEQ=(%d) ATTEMPTS=(%d)>" %
+                (self.entry_id, self.mime_type, self.sequence, self.attempts))
+
+    def get_state(self):
+        return {
+            'entry_id': self.entry_id,
+            'mime_type': self.mime_type,
+            'is_hidden': self.is_hidden,
+            'sequence': self.sequence,
+            'first_queued_at': self.first_queued_at,
+        }
+
+
+class _WriteBack(object):
+    """Manages the journal and the uploader."""
+
+    def __init__(self, path):
+        self.__path = path
+        self.__cv = threading.Condition()
+
+        # Keyed by entry-ID.
+        self.__pending = {}
+        self.__sequence = 0
+
+        self.__t = None
+        self.__t_quit_ev = threading.Event()
+
+        if os.path.exists(self.__path) is False:
+            os.makedirs(self.__path, 0o700)
+
+        self.__load()
+
+        _logger.debug("Write-back journal established at [%s] with (%d) "
+                      "pending uploads.", self.__path, len(self.__pending))
+
+    def __get_record_filepath(self, entry_id):
+        return os.path.join(self.__path, entry_id + _RECORD_SUFFIX)
+
+    def __get_data_filepath(self, pending):
+        filename = '%s.%d%s' % (pending.entry_id, pending.sequence,
+                                _DATA_SUFFIX)
+
+        return os.path.join(self.__path, filename)
+
+    def __load(self):
+        """Recover whatever was pending when we last went down. Data without a
+        record never finished being journaled, and is discarded.
+        """
+
+        filenames = set(os.listdir(self.__path))
+
+        for filename in filenames:
+            if filename.endswith(_RECORD_SUFFIX) is False:
+                continue
+
+            filepath = os.path.join(self.__path, filename)
+
+            try:
+                with open(filepath) as f:
+                    state = json.load(f)
+
+                pending = _PendingUpload(
+                            state['entry_id'],
+                            state['mime_type'],
+                            state['is_hidden'],
+                            state['sequence'],
+                            state['first_queued_at'])
+            except (IOError, OSError, ValueError, KeyError):
+                _logger.warning("Discarding unusable journal record: [%s]",
+                                filepath)
+
+                os.unlink(filepath)
+                continue
+
+            data_filename = \
+                os.path.basename(self.__get_data_filepath(pending))
+
+            if data_filename not in filenames:
+                _logger.warning("Discarding journal record without data: "
+                                "[%s]", filepath)
+
+                os.unlink(filepath)
+                continue
+
+            _logger.info("Recovered pending upload: %s", pending)
+
+            self.__pending[pending.entry_id] = pending
+            self.__sequence = max(self.__sequence, pending.sequence)
+
+        expected = set()
+        for pending in self.__pending.values():
+            expected.add(os.path.basename(self.__get_record_filepath(
+                            pending.entry_id)))
+
+            data_filepath = self.__get_data_filepath(pending)
+            expected.add(os.path.basename(data_filepath))
+
+            # An upload that was interrupted continues where it left off.
+            expected.add(os.path.basename(
+                            get_upload_session_filepath(data_filepath)))
+
+        for filename in filenames - expected:
+            filepath = os.path.join(self.__path, filename)
+
+            if os.path.exists(filepath) is True:
+                _logger.debug("Removing stale journal file: [%s]", filepath)
+                os.unlink(filepath)
+
+    def __write_record(self, pending):
+        record_filepath = self.__get_record_filepath(pending.entry_id)
+        temp_filepath = record_filepath + '.new'
+
+        with open(temp_filepath, 'w') as f:
+            json.dump(pending.get_state(), f)
+            f.flush()
+            os.fsync(f.fileno())
+
+        os.rename(temp_filepath, record_filepath)
+        _fsync_path(self.__path)
+
+    def __remove(self, pending):
+        """Forget the pending upload. The lock must be held."""
+
+        del self.__pending[pending.entry_id]
+
+        try:
+            os.unlink(self.__get_record_filepath(pending.entry_id))
+        except OSError:
+            pass
+
+        self.__remove_data(pending)
+
+    def __remove_data(self, pending):
+        data_filepath = self.__get_data_filepath(pending)
+
+        for filepath in (data_filepath,
+                         get_upload_session_filepath(data_filepath)):
+            try:
+                os.unlink(filepath)
+            except OSError:
+                pass
+
+    def __notify(self, pending, entry):
+        """Tell whoever journaled the content that we're done with it. The
+        lock must not be held.
+        """
+
+        if pending.listener is not None:
+            pending.listener(entry)
+
+    def stage(self, entry_id, mime_type, is_hidden, source_f):
+        """Copy the content from the given file into the journal. It isn't
+        uploaded until it's committed. The copy can take a while, so it's made
+        without holding up the uploader (or anyone else's flush). Until
+        there's a record for it, the data is ignored.
+        """
+
+        with self.__cv:
+            self.__sequence += 1
+            sequence = self.__sequence
+
+        pending = _PendingUpload(
+                    entry_id,
+                    mime_type,
+                    is_hidden,
+                    sequence,
+                    time.time())
+
+        data_filepath = self.__get_data_filepath(pending)
+
+        with open(data_filepath, 'wb') as f:
+            shutil.copyfileobj(source_f, f)
+
+        _fsync_path(data_filepath)
+
+        return pending
+
+    def discard(self, pending):
+        """Drop content that was staged but won't be committed."""
+
+        self.__remove_data(pending)
+
+    def commit(self, pending, listener=None):
+        """Queue the staged content for upload. This replaces anything that
+        was still waiting to be uploaded for the same entry. The listener is
+        called with the updated entry once the content has been uploaded, or
+        with None if it's superseded or abandoned.
+        """
+
+        pending.listener = listener
+        superseded = None
+
+        with self.__cv:
+            replaced = self.__pending.get(pending.entry_id)
+
+            # Something staged after us was committed first.
+            if replaced is not None and replaced.sequence > pending.sequence:
+                self.__remove_data(pending)
+                superseded = pending
+            else:
+                if replaced is not None:
+                    pending.first_queued_at = replaced.first_queued_at
+
+                # Once the new record is in place, the new data is what will
+                # be uploaded.
+                self.__write_record(pending)
+                self.__pending[pending.entry_id] = pending
+
+                # If the data that it replaced is being uploaded right now,
+                # it'll be dropped when that's done.
+                if replaced is not None and replaced.is_uploading is False:
+                    self.__remove_data(replaced)
+                    superseded = replaced
+
+                self.__cv.notify_all()
+
+        if superseded is not None:
+            _logger.debug("Dropped superseded upload: %s", superseded)
+            self.__notify(superseded, None)
+
+        if superseded is not pending:
+            _logger.debug("Queued for upload: %s", pending)
+
+    def enqueue(self, entry_id, mime_type, is_hidden, source_filepath,
+                listener=None):
+        """Journal the current content of the file for upload. The caller has
+        to make sure that the file doesn't change while we copy it.
+        """
+
+        with open(source_filepath, 'rb') as f:
+            pending = self.stage(entry_id, mime_type, is_hidden, f)
+
+        self.commit(pending, listener=listener)
+
+    def has_pending(self, entry_id):
+        with self.__cv:
+            return entry_id in self.__pending
+
+    def __get_due(self):
+        """Claim the uploads that are ready to go. The lock must be held."""
+
+        max_staleness_s = \
+            int(gdrivefs.conf.Conf.get('file_write_back_max_staleness_s'))
+
+        settle_time_s = min(_SETTLE_TIME_S, max_staleness_s)
+
+        now = time.time()
+        due = []
+        for pending in self.__pending.values():
+            if pending.is_uploading is True or \
+               pending.next_attempt_at > now:
+                continue
+
+            if now - pending.last_queued_at >= settle_time_s or \
+               now - pending.first_queued_at >= max_staleness_s:
+                pending.is_uploading = True
+                due.append(pending)
+
+        return due
+
+    def __upload(self, pending):
+        """Upload the journaled content. The pending upload has to have been
+        claimed.
+        """
+
+        _logger.info("Uploading journaled content: %s", pending)
+
+        data_filepath = self.__get_data_filepath(pending)
+
+        try:
+            entry = EntryCache.get_instance().cache.get(pending.entry_id)
+
+            gd = get_gdrive()
+            entry = gd.update_entry(
+                        entry,
+                        filename=entry.title,
+                        data_filepath=data_filepath,
+                        mime_type=pending.mime_type,
+                        parents=entry.parents,
+                        is_hidden=pending.is_hidden)
+        except apiclient.errors.HttpError as e:
+            if e.resp.status != 404:
+                self.__fail(pending)
+                raise
+
+            # The entry is gone. There's nothing to update.
+            _logger.warning("Entry for journaled content no longer exists. "
+                            "Dropping: %s", pending)
+
+            entry = None
+        except:
+            self.__fail(pending)
+            raise
+
+        if entry is not None:
+            PathRelations.get_instance().register_entry(entry)
+
+        with self.__cv:
+            pending.is_uploading = False
+
+            if self.__pending.get(pending.entry_id) is pending:
+                self.__remove(pending)
+            else:
+                # It was flushed again while we were uploading. The newer
+                # content will follow.
+                self.__remove_data(pending)
+                entry = None
+
+            self.__cv.notify_all()
+
+        self.__notify(pending, entry)
+
+        _logger.info("Journaled content uploaded for entry [%s].",
+                     pending.entry_id)
+
+    def __fail(self, pending):
+        with self.__cv:
+            pending.is_uploading = False
+
+            # If it was flushed again while we were uploading, we'll just
+            # upload the newer content.
+            is_superseded = self.__pending.get(pending.entry_id) is not pending
+
+            if is_superseded is True:
+                self.__remove_data(pending)
+            else:
+                pending.attempts += 1
+
+                delay_s = min(2 ** pending.attempts, _MAX_RETRY_DELAY_S)
+                pending.next_attempt_at = time.time() + delay_s
+
+                _logger.warning("Upload failed (%d) times. Retrying in (%d) "
+                                "seconds: %s", pending.attempts, delay_s,
+                                pending)
+
+            self.__cv.notify_all()
+
+        if is_superseded is True:
+            self.__notify(pending, None)
+
+    def sync(self, entry_id):
+        """Upload whatever is pending for the entry right now (or wait for the
+        upload that's already happening). Raises if the upload fails.
+        """
+
+        while 1:
+            with self.__cv:
+                pending = self.__pending.get(entry_id)
+                if pending is None:
+                    return
+
+                if pending.is_uploading is True:
+                    self.__cv.wait()
+                    continue
+
+                pending.is_uploading = True
+
+            self.__upload(pending)
+
+    def sync_all(self):
+        """Try to upload everything that's pending. Failures are left in the
+        journal.
+        """
+
+        with self.__cv:
+            entry_ids = list(self.__pending.keys())
+
+        for entry_id in entry_ids:
+            try:
+                self.sync(entry_id)
+            except:
+                _logger.exception("Could not upload journaled content for "
+                                  "entry [%s]. It remains journaled.",
+                                  entry_id)
+
+    def __process_uploads(self):
+        _logger.debug("Uploader thread running.")
+
+        while self.__t_quit_ev.is_set() is False and \
+                gdrivefs.state.GLOBAL_EXIT_EVENT.is_set() is False:
+            with self.__cv:
+                due = self.__get_due()
+                if not due:
+                    self.__cv.wait(_SETTLE_TIME_S)
+                    continue
+
+            for pending in due:
+                try:
+                    self.__upload(pending)
+                except:
+                    _logger.exception("Squelching an exception that occurred "
+                                      "while uploading journaled content.")
+
+        _logger.debug("Uploader thread terminating.")
+
+    def mount_init(self):
+        """Called when the filesystem is first mounted."""
+
+        _logger.debug("Starting uploader thread.")
+
+        self.__t = threading.Thread(target=self.__process_uploads)
+        self.__t.daemon = True
+        self.__t.start()
+
+    def mount_destroy(self):
+        """Called when the filesystem is unmounted."""
+
+        _logger.debug("Stopping uploader thread.")
+
+        self.__t_quit_ev.set()
+
+        with self.__cv:
+            self.__cv.notify_all()
+
+        if self.__t is not None:
+            self.__t.join()
+
+        self.sync_all()
+
+    @property
+    def path(self):
+        return self.__path
+
+_instance = None
+_instance_lock = threading.Lock()
+def get_write_back():
+    global _instance
+
+    with _instance_lock:
+        if _instance is None:
+            path = gdrivefs.conf.Conf.get('file_write_back_journal_path')
+            if path is None:
+                path = gdrivefs.config.DEFAULT_WRITE_BACK_JOURNAL_PATH
+
+            _instance = _WriteBack(path)
+
+    return _instance
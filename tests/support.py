@@ -0,0 +1,159 @@
+"""Fakes for the parts of Drive that the tests need, and helpers to install
+them.
+"""
+
+try:
+    # Python 3
+    from unittest import mock
+except ImportError:
+    # Python 2.
+    import mock
+
+import gdrivefs.account_info
+import gdrivefs.drive
+import gdrivefs.normal_entry
+import gdrivefs.volume
+
+from gdrivefs.conf import Conf
+
+ROOT_ID = 'root'
+
+
+def build_entry(entry_id, title, parents, is_directory=False, **extra):
+    """Build an entry the way that Drive would describe it."""
+
+    if is_directory is True:
+        mime_type = Conf.get('directory_mimetype')
+    else:
+        mime_type = 'text/plain'
+
+    raw_data = {
+        'id': entry_id,
+        'title': title,
+        'mimeType': mime_type,
+        'labels': {},
+        'parents': [dict(id=parent_id) for parent_id in parents],
+        'writersCanShare': True,
+        'ownerNames': ['Owner'],
+        'editable': True,
+        'userPermission': {},
+        'modifiedDate': '2020-01-01T00:00:00.000Z',
+        'md5Checksum': entry_id + '-md5',
+    }
+
+    if is_directory is False:
+        raw_data['fileSize'] = '0'
+        raw_data['downloadUrl'] = 'https://example.com/' + entry_id
+
+    raw_data.update(extra)
+
+    return gdrivefs.normal_entry.NormalEntry('test', raw_data)
+
+
+class FakeGdrive(object):
+    """Serves listings from a dictionary of entries, and counts the
+    queries.
+    """
+
+    def __init__(self, entries=()):
+        self.entries = dict((entry.id, entry) for entry in entries)
+        self.queries = []
+        self.batches = []
+
+    def add(self, entry):
+        self.entries[entry.id] = entry
+
+    def list_files(self, parent_id=None, query_is_string=None,
+                   parent_ids=None, **kwargs):
+        self.queries.append((parent_id, query_is_string, parent_ids))
+
+        if parent_ids is None:
+            parent_ids = [parent_id]
+
+        return [entry
+                for entry
+                in self.entries.values()
+                if set(entry.parents) & set(parent_ids) and
+                   (query_is_string is None or
+                    entry.title == query_is_string)]
+
+    def iterate_all_files(self, page_size):
+        yield list(self.entries.values())
+
+    def get_entry(self, entry_id):
+        return self.entries[entry_id]
+
+    def get_entries(self, entry_ids):
+        self.batches.append(list(entry_ids))
+
+        return dict((entry_id, self.entries[entry_id])
+                    for entry_id
+                    in entry_ids)
+
+
+class _FakeCache(object):
+    def __init__(self, gd):
+        self.__gd = gd
+        self.__entries = {}
+
+    def set(self, entry_id, normalized_entry):
+        self.__entries[entry_id] = normalized_entry
+
+    def get(self, entry_id):
+        try:
+            return self.__entries[entry_id]
+        except KeyError:
+            return self.__gd.get_entry(entry_id)
+
+    def exists(self, entry_id):
+        return entry_id in self.__entries
+
+    def remove(self, entry_id):
+        del self.__entries[entry_id]
+
+
+def install_fake_drive(test_case, gd):
+    """Have the path-relations (which are global) start empty and be served
+    by the given fake for the rest of the test.
+    """
+
+    entry_cache = mock.Mock()
+    entry_cache.get_instance.return_value.cache = _FakeCache(gd)
+
+    account_info = mock.Mock()
+    account_info.root_id = ROOT_ID
+
+    patches = [
+        mock.patch.object(
+            gdrivefs.drive,
+            'get_gdrive',
+            return_value=gd),
+        mock.patch.object(
+            gdrivefs.volume,
+            'EntryCache',
+            entry_cache),
+        mock.patch.object(
+            gdrivefs.account_info.AccountInfo,
+            'get_instance',
+            return_value=account_info),
+        mock.patch.object(
+            gdrivefs.volume.PathRelations,
+            'entry_ll',
+            {}),
+        mock.patch.object(
+            gdrivefs.volume.PathRelations,
+            'negative_lookups',
+            gdrivefs.volume._NegativeLookups()),
+    ]
+
+    for patch in patches:
+        patch.start()
+        test_case.addCleanup(patch.stop)
+
+
+def set_conf(test_case, key, value):
+    """Set an option for the rest of the test."""
+
+    original = Conf.get(key)
+    Conf.set(key, value)
+    test_case.addCleanup(Conf.set, key, original)
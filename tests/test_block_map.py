@@ -0,0 +1,129 @@
+import threading
+import unittest
+
+import gdrivefs.block_map
+
+
+class TestBlockMap(unittest.TestCase):
+    def test_missing_ranges_are_aligned_and_clipped(self):
+        bm = gdrivefs.block_map.BlockMap(10000, 4096)
+
+        self.assertEqual(
+            bm.get_missing_ranges(5000, 10),
+            [(4096, 4096)])
+
+        self.assertEqual(
+            bm.get_missing_ranges(0, 20000),
+            [(0, 10000)])
+
+        # Past the end is never missing.
+        self.assertEqual(bm.get_missing_ranges(10000, 100), [])
+
+    def test_claim_and_mark_present(self):
+        bm = gdrivefs.block_map.BlockMap(10000, 4096)
+
+        claimed = bm.claim_missing_ranges(0, 5000)
+        self.assertEqual(claimed, [(0, 8192)])
+
+        # Claimed blocks aren't offered to anyone else.
+        self.assertEqual(bm.claim_missing_ranges(0, 10000), [(8192, 1808)])
+
+        self.assertFalse(bm.is_present(0, 1))
+
+        bm.mark_present(0, 8192)
+        self.assertTrue(bm.is_present(0, 8192))
+        self.assertFalse(bm.is_complete)
+
+        # The last block is completed by the end of the file.
+        bm.mark_present(8192, 1808)
+        self.assertTrue(bm.is_complete)
+
+    def test_mark_present_only_covers_whole_blocks(self):
+        bm = gdrivefs.block_map.BlockMap(10000, 4096)
+
+        bm.mark_present(100, 5000)
+        self.assertEqual(
+            bm.get_missing_ranges(0, 10000),
+            [(0, 10000)])
+
+        bm.mark_present(0, 4096)
+        self.assertEqual(
+            bm.get_missing_ranges(0, 10000),
+            [(4096, 5904)])
+
+    def test_abandon(self):
+        bm = gdrivefs.block_map.BlockMap(10000, 4096)
+
+        bm.claim_missing_ranges(0, 4096)
+        bm.abandon(0, 4096)
+
+        self.assertEqual(bm.claim_missing_ranges(0, 4096), [(0, 4096)])
+
+    def __wait_in_background(self, bm, offset, length):
+        results = []
+        def wait():
+            results.append(bm.wait_for_range(offset, length))
+
+        t = threading.Thread(target=wait)
+        t.start()
+
+        return (t, results)
+
+    def test_wait_for_range(self):
+        bm = gdrivefs.block_map.BlockMap(10000, 4096)
+        bm.claim_missing_ranges(0, 4096)
+
+        (t, results) = self.__wait_in_background(bm, 0, 4096)
+
+        bm.mark_present(0, 4096)
+        t.join()
+
+        self.assertEqual(results, [True])
+
+    def test_wait_for_abandoned_range(self):
+        bm = gdrivefs.block_map.BlockMap(10000, 4096)
+        bm.claim_missing_ranges(0, 4096)
+
+        (t, results) = self.__wait_in_background(bm, 0, 4096)
+
+        bm.abandon(0, 4096)
+        t.join()
+
+        self.assertEqual(results, [False])
+
+    def test_mark_written(self):
+        bm = gdrivefs.block_map.BlockMap(10000, 4096)
+
+        bm.mark_written(0, 4100)
+        self.assertTrue(bm.is_present(0, 4096))
+        self.assertFalse(bm.is_present(4096, 1))
+
+    def test_truncate(self):
+        bm = gdrivefs.block_map.BlockMap(10000, 4096)
+        bm.mark_present(0, 4096)
+
+        bm.truncate(5000)
+        self.assertEqual(bm.size, 5000)
+        self.assertEqual(bm.get_missing_ranges(0, 10000), [(4096, 904)])
+
+        # Growing isn't a truncation.
+        bm.truncate(20000)
+        self.assertEqual(bm.size, 5000)
+
+    def test_present_round_trip(self):
+        bm = gdrivefs.block_map.BlockMap(10000, 4096)
+        bm.mark_present(4096, 4096)
+
+        # Pending blocks aren't persisted as present.
+        bm.claim_missing_ranges(0, 4096)
+
+        restored = \
+            gdrivefs.block_map.BlockMap(10000, 4096, present=bm.present)
+
+        self.assertEqual(
+            restored.get_missing_ranges(0, 10000),
+            [(0, 4096), (8192, 1808)])
+
+    def test_present_must_match_size(self):
+        with self.assertRaises(AssertionError):
+            gdrivefs.block_map.BlockMap(10000, 4096, present=b'\x00')
@@ -0,0 +1,183 @@
+import os
+import os.path
+import shutil
+import tempfile
+import unittest
+
+import gdrivefs.content_cache
+
+_MIME_TYPE = 'text/plain'
+
+
+class _Entry(object):
+    def __init__(self, entry_id, md5_checksum):
+        self.id = entry_id
+        self.md5_checksum = md5_checksum
+
+
+def _write(content, data):
+    with open(content.filepath, 'wb') as f:
+        f.write(data)
+
+
+def _read(content):
+    with open(content.filepath, 'rb') as f:
+        return f.read()
+
+
+class TestContentCache(unittest.TestCase):
+    def setUp(self):
+        self.__path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.__path)
+
+    def __get_cache(self, max_size_b=1024 * 1024):
+        return gdrivefs.content_cache._ContentCache(self.__path, max_size_b)
+
+    def test_acquire_miss_then_hit(self):
+        cc = self.__get_cache()
+
+        content = cc.acquire(_Entry('E1', 'v1'), _MIME_TYPE)
+        self.assertFalse(content.is_complete)
+        self.assertEqual(_read(content), b'')
+
+        _write(content, b'abc')
+        content.set_complete(3)
+        cc.release(content)
+
+        again = cc.acquire(_Entry('E1', 'v1'), _MIME_TYPE)
+        self.assertIs(again, content)
+        self.assertTrue(again.is_complete)
+
+        # Another version is another record.
+        other = cc.acquire(_Entry('E1', 'v2'), _MIME_TYPE)
+        self.assertIsNot(other, content)
+
+    def test_reload(self):
+        cc = self.__get_cache()
+
+        content = cc.acquire(_Entry('E1', 'v1'), _MIME_TYPE)
+        _write(content, b'abc')
+        content.set_sparse(8192, 4096)
+        content.block_map.mark_present(0, 4096)
+        cc.release(content)
+
+        cc = self.__get_cache()
+        content = cc.acquire(_Entry('E1', 'v1'), _MIME_TYPE)
+
+        self.assertFalse(content.is_complete)
+        self.assertEqual(content.size, 8192)
+        self.assertEqual(
+            content.block_map.get_missing_ranges(0, 8192),
+            [(4096, 4096)])
+
+    def test_reload_discards_data_without_metadata(self):
+        cc = self.__get_cache()
+
+        content = cc.acquire(_Entry('E1', 'v1'), _MIME_TYPE)
+        cc.detach(content)
+
+        self.__get_cache()
+        self.assertEqual(os.listdir(self.__path), [])
+
+    def test_detach(self):
+        cc = self.__get_cache()
+
+        content = cc.acquire(_Entry('E1', 'v1'), _MIME_TYPE)
+        original_filepath = content.filepath
+        _write(content, b'abc')
+
+        cc.detach(content)
+        self.assertTrue(content.is_detached)
+        self.assertNotEqual(content.filepath, original_filepath)
+        self.assertEqual(_read(content), b'abc')
+
+        # Whoever wants the original version gets a new copy.
+        fresh = cc.acquire(_Entry('E1', 'v1'), _MIME_TYPE)
+        self.assertIsNot(fresh, content)
+        self.assertEqual(_read(fresh), b'')
+
+        # Detached content is discarded once it's released.
+        filepath = content.filepath
+        cc.release(content)
+        self.assertFalse(os.path.exists(filepath))
+
+    def test_invalidate(self):
+        cc = self.__get_cache()
+
+        unused = cc.acquire(_Entry('E1', 'v1'), _MIME_TYPE)
+        cc.release(unused)
+
+        in_use = cc.acquire(_Entry('E1', 'v2'), _MIME_TYPE)
+        current = cc.acquire(_Entry('E1', 'v3'), _MIME_TYPE)
+
+        cc.invalidate('E1', current_version='v3')
+
+        self.assertFalse(os.path.exists(unused.filepath))
+        self.assertTrue(in_use.is_detached)
+        self.assertFalse(current.is_detached)
+
+    def test_trim_evicts_unused_oldest_first(self):
+        cc = self.__get_cache(max_size_b=12 * 1024)
+
+        contents = []
+        for version in ('v1', 'v2', 'v3'):
+            content = cc.acquire(_Entry('E1', version), _MIME_TYPE)
+            _write(content, b'x' * 8192)
+            content.set_complete(8192)
+            contents.append(content)
+
+        # Only the most recently used fits within the budget.
+        cc.release(contents[0])
+        cc.release(contents[1])
+        cc.release(contents[2])
+
+        self.assertFalse(os.path.exists(contents[0].filepath))
+        self.assertFalse(os.path.exists(contents[1].filepath))
+        self.assertTrue(os.path.exists(contents[2].filepath))
+
+    def test_attach(self):
+        cc = self.__get_cache()
+
+        content = cc.acquire(_Entry('E1', 'v1'), _MIME_TYPE)
+        cc.detach(content)
+        _write(content, b'new')
+
+        cc.attach(content, _Entry('E1', 'v2'))
+        self.assertFalse(content.is_detached)
+        self.assertTrue(content.is_complete)
+        self.assertEqual(content.size, 3)
+
+        cc.release(content)
+
+        again = cc.acquire(_Entry('E1', 'v2'), _MIME_TYPE)
+        self.assertIs(again, content)
+        self.assertEqual(_read(again), b'new')
+
+    def test_attach_replacing_content_in_use(self):
+        cc = self.__get_cache()
+
+        reader = cc.acquire(_Entry('E1', 'v2'), _MIME_TYPE)
+        _write(reader, b'old')
+
+        writer = cc.acquire(_Entry('E1', 'v1'), _MIME_TYPE)
+        cc.detach(writer)
+        _write(writer, b'new')
+
+        cc.attach(writer, _Entry('E1', 'v2'))
+
+        # The reader still sees what it had, and releasing it doesn't take
+        # the attached content with it.
+        self.assertNotEqual(reader.filepath, writer.filepath)
+        self.assertEqual(_read(reader), b'old')
+
+        cc.release(reader)
+
+        self.assertEqual(_read(writer), b'new')
+        self.assertTrue(os.path.exists(writer.meta_filepath))
+
+        cc.release(writer)
+
+        again = cc.acquire(_Entry('E1', 'v2'), _MIME_TYPE)
+        self.assertIs(again, writer)
@@ -0,0 +1,21 @@
+import json
+import unittest
+
+import gdrivefs.displaced_file
+
+from tests.support import build_entry
+
+
+class TestDisplacedFile(unittest.TestCase):
+    def test_stub_without_size(self):
+        entry = build_entry('F1', 'a', ['D1'], fileSize='123')
+        d = gdrivefs.displaced_file.DisplacedFile(entry)
+
+        stub = d.get_stub('text/plain', file_path='/cache/F1')
+
+        # The stub is padded to a fixed size.
+        self.assertEqual(len(stub), d.file_size)
+
+        stub_data = json.loads(stub)
+        self.assertEqual(stub_data['Length'], 123)
+        self.assertEqual(stub_data['FilePath'], '/cache/F1')
@@ -0,0 +1,273 @@
+import os.path
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+try:
+    # Python 3
+    from unittest import mock
+except ImportError:
+    # Python 2.
+    import mock
+
+import gdrivefs.drive
+
+import tests.support
+
+from tests.support import build_entry
+
+
+class TestSplitRanges(unittest.TestCase):
+    def test_small_ranges_are_kept(self):
+        self.assertEqual(
+            gdrivefs.drive._split_ranges([(0, 10), (100, 5)], 10),
+            [(0, 10), (100, 5)])
+
+    def test_large_ranges_are_split(self):
+        self.assertEqual(
+            gdrivefs.drive._split_ranges([(5, 25)], 10),
+            [(5, 10), (15, 10), (25, 5)])
+
+    def test_empty(self):
+        self.assertEqual(gdrivefs.drive._split_ranges([], 10), [])
+        self.assertEqual(gdrivefs.drive._split_ranges([(5, 0)], 10), [])
+
+
+class TestDownloadResume(unittest.TestCase):
+    def setUp(self):
+        tests.support.set_conf(self, 'file_download_range_size_kb', 1)
+        tests.support.set_conf(self, 'file_download_parallelism', 4)
+
+        self.__data = b''.join(
+                        (chr(ord('a') + i) * 1024).encode('ascii')
+                        for i in range(4))
+
+        self.__entry = build_entry('F1', 'f1', ['D1'], fileSize='4096')
+
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path)
+
+        self.__output_filepath = os.path.join(path, 'F1')
+
+        self.__downloaded = []
+
+        cls = gdrivefs.drive._GdriveManager
+        self.__gd = cls.__new__(cls)
+        self.__gd.download_ranges = self.__download_ranges
+
+    def __download_ranges(self, output_fd, normalized_entry, mime_type,
+                          ranges, range_done_cb=None):
+        for (offset, length) in ranges:
+            self.__downloaded.append((offset, length))
+
+            f = gdrivefs.drive._PositionalWriter(output_fd, offset)
+            f.write(self.__data[offset:offset + length])
+
+            range_done_cb(offset, length)
+
+    def __get_progress(self, normalized_entry=None):
+        return gdrivefs.drive._DownloadProgress(
+                self.__output_filepath,
+                normalized_entry or self.__entry,
+                'text/plain')
+
+    def __interrupt(self):
+        """Leave the first and third blocks of an attempt behind."""
+
+        with open(self.__output_filepath, 'wb') as f:
+            f.write(self.__data[:1024])
+            f.write(b'\0' * 1024)
+            f.write(self.__data[2048:3072])
+
+        progress = self.__get_progress()
+        progress.record(0, 1024)
+        progress.record(2048, 1024)
+
+    def __download(self):
+        self.__gd.download_to_local(
+            self.__output_filepath,
+            self.__entry,
+            mime_type='text/plain',
+            allow_cache=False)
+
+        with open(self.__output_filepath, 'rb') as f:
+            self.assertEqual(f.read(), self.__data)
+
+    def test_only_missing_ranges_are_retrieved(self):
+        self.__interrupt()
+        self.assertEqual(
+            self.__get_progress().load(),
+            [(0, 1024), (2048, 1024)])
+
+        self.__download()
+
+        self.assertEqual(self.__downloaded, [(1024, 1024), (3072, 1024)])
+
+        # The record is gone, now that it's complete.
+        self.assertEqual(self.__get_progress().load(), [])
+        self.assertFalse(
+            os.path.exists(
+                gdrivefs.drive.get_download_progress_filepath(
+                    self.__output_filepath)))
+
+    def test_changed_entry_starts_over(self):
+        self.__interrupt()
+
+        self.__entry = build_entry('F1', 'f1', ['D1'], fileSize='4096',
+                                   md5Checksum='changed')
+
+        self.assertEqual(self.__get_progress().load(), [])
+
+        self.__download()
+
+        self.assertEqual(self.__downloaded, [(0, 4096)])
+
+    def test_ranges_past_the_end_are_ignored(self):
+        self.__interrupt()
+
+        # The output file lost its tail.
+        with open(self.__output_filepath, 'r+b') as f:
+            f.truncate(2048)
+
+        self.assertEqual(self.__get_progress().load(), [(0, 1024)])
+
+
+class TestUploadChunkSizer(unittest.TestCase):
+    def setUp(self):
+        self.__sizer = gdrivefs.drive._UploadChunkSizer()
+
+    def __record(self, elapsed_s):
+        self.__sizer.record_chunk(self.__sizer.chunk_size_b, elapsed_s)
+
+    def test_grows_while_fast(self):
+        initial_b = self.__sizer.chunk_size_b
+
+        self.__record(0.1)
+        self.assertEqual(self.__sizer.chunk_size_b, initial_b * 2)
+
+        for i in range(20):
+            self.__record(0.1)
+
+        self.assertEqual(
+            self.__sizer.chunk_size_b,
+            gdrivefs.drive._MAX_UPLOAD_CHUNK_SIZE_B)
+
+    def test_shrinks_while_slow(self):
+        initial_b = self.__sizer.chunk_size_b
+
+        self.__record(gdrivefs.drive._UPLOAD_CHUNK_TARGET_S * 3)
+        self.assertEqual(self.__sizer.chunk_size_b, initial_b // 2)
+
+        for i in range(20):
+            self.__record(gdrivefs.drive._UPLOAD_CHUNK_TARGET_S * 3)
+
+        self.assertEqual(
+            self.__sizer.chunk_size_b,
+            gdrivefs.drive._MIN_UPLOAD_CHUNK_SIZE_B)
+
+    def test_steady_on_target(self):
+        initial_b = self.__sizer.chunk_size_b
+
+        self.__record(gdrivefs.drive._UPLOAD_CHUNK_TARGET_S)
+        self.assertEqual(self.__sizer.chunk_size_b, initial_b)
+
+    def test_short_chunk_is_ignored(self):
+        initial_b = self.__sizer.chunk_size_b
+
+        self.__sizer.record_chunk(initial_b - 1, 0.1)
+        self.assertEqual(self.__sizer.chunk_size_b, initial_b)
+
+    def test_shrinks_on_failure(self):
+        initial_b = self.__sizer.chunk_size_b
+
+        self.__sizer.record_failure()
+        self.assertEqual(self.__sizer.chunk_size_b, initial_b // 2)
+
+
+class TestSingleFlight(unittest.TestCase):
+    def setUp(self):
+        self.__sf = gdrivefs.drive._SingleFlight('test')
+
+        self.__started_ev = threading.Event()
+        self.__release_ev = threading.Event()
+        self.__calls = []
+        self.__events = []
+
+    def __get(self, value):
+        self.__calls.append(value)
+        self.__started_ev.set()
+        self.__release_ev.wait()
+
+        return value
+
+    def __lead(self, results):
+        results.append(self.__sf.do('key', self.__get, ('first',)))
+        self.__events.append('leader returned')
+
+    def __follow(self, result):
+        self.__events.append('followed')
+        return result + ' (followed)'
+
+    def __share(self, results):
+        result = self.__sf.do(
+                    'key',
+                    self.__get,
+                    ('second',),
+                    follow=self.__follow)
+
+        results.append(result)
+
+    def test_concurrent_callers_share(self):
+        leader_results = []
+        leader = threading.Thread(target=self.__lead, args=(leader_results,))
+        leader.start()
+
+        self.__started_ev.wait()
+
+        follower_results = []
+        follower = threading.Thread(
+                    target=self.__share,
+                    args=(follower_results,))
+
+        follower.start()
+
+        # Wait for the follower to join.
+        while 1:
+            flight = self.__sf._SingleFlight__in_flight['key']
+            if flight.follower_count > 0:
+                break
+
+            time.sleep(.01)
+
+        self.__release_ev.set()
+
+        leader.join()
+        follower.join()
+
+        self.assertEqual(self.__calls, ['first'])
+        self.assertEqual(leader_results, ['first'])
+        self.assertEqual(follower_results, ['first (followed)'])
+
+        # The result was followed before the leader was done with it.
+        self.assertEqual(self.__events, ['followed', 'leader returned'])
+
+    def test_later_callers_dont_share(self):
+        self.__release_ev.set()
+
+        self.assertEqual(self.__sf.do('key', self.__get, ('first',)), 'first')
+        self.assertEqual(
+            self.__sf.do('key', self.__get, ('second',)),
+            'second')
+
+    def test_error_is_raised(self):
+        def fail():
+            raise ValueError("Download failed.")
+
+        with self.assertRaises(ValueError):
+            self.__sf.do('key', fail, ())
+
+        # It's not stuck in-flight.
+        self.__release_ev.set()
+        self.assertEqual(self.__sf.do('key', self.__get, ('first',)), 'first')
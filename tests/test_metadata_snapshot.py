@@ -0,0 +1,163 @@
+import os
+import os.path
+import shutil
+import tempfile
+import unittest
+
+try:
+    # Python 3
+    from unittest import mock
+except ImportError:
+    # Python 2.
+    import mock
+
+import gdrivefs.account_info
+import gdrivefs.metadata_snapshot
+import gdrivefs.volume
+
+import tests.support
+
+from tests.support import ROOT_ID, build_entry
+
+
+class _FakeChangeManager(object):
+    def __init__(self, at_change_id):
+        self.at_change_id = at_change_id
+        self.error = None
+
+    def process_updates(self):
+        if self.error is not None:
+            raise self.error
+
+        # Caught-up.
+        return True
+
+
+class TestMetadataSnapshot(unittest.TestCase):
+    def setUp(self):
+        # Cleaned-up last, after anything mounted has been unmounted.
+        self.__path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.__path)
+
+        self.__filepath = os.path.join(self.__path, 'snapshot', 'meta.gz')
+
+        self.gd = tests.support.FakeGdrive([
+            build_entry(ROOT_ID, 'My Drive', [], is_directory=True),
+            build_entry('D1', 'dir', [ROOT_ID], is_directory=True),
+            build_entry('F1', 'a', ['D1']),
+        ])
+
+        tests.support.install_fake_drive(self, self.gd)
+        tests.support.set_conf(self, 'metadata_snapshot_interval_s', '3600')
+
+        self.cm = _FakeChangeManager(100)
+
+        patches = [
+            mock.patch.object(
+                gdrivefs.metadata_snapshot,
+                'get_change_manager',
+                return_value=self.cm),
+            mock.patch.object(
+                gdrivefs.volume.PathRelations,
+                'get_instance',
+                side_effect=gdrivefs.volume.PathRelations),
+        ]
+
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def __get_snapshot(self):
+        return gdrivefs.metadata_snapshot._MetadataSnapshot(self.__filepath)
+
+    def __populate(self):
+        pr = gdrivefs.volume.PathRelations()
+        pr.register_entry(self.gd.entries[ROOT_ID])
+        pr.get_children_from_entry_id(ROOT_ID)
+        pr.get_children_from_entry_id('D1')
+
+    def __forget_everything(self):
+        gdrivefs.volume.PathRelations.entry_ll.clear()
+
+    def __mount(self):
+        ms = self.__get_snapshot()
+
+        ms.mount_init()
+        self.addCleanup(ms.mount_destroy)
+
+        return ms
+
+    def test_round_trip(self):
+        self.__populate()
+        self.__get_snapshot().save()
+
+        self.__forget_everything()
+        self.cm.at_change_id = None
+
+        ms = self.__mount()
+        self.assertTrue(ms.is_loaded)
+
+        # Changes are replayed from where the snapshot left off.
+        self.assertEqual(self.cm.at_change_id, 100)
+
+        pr = gdrivefs.volume.PathRelations()
+        clause = pr.get_clause_from_path('/dir/a')
+        self.assertEqual(clause[gdrivefs.volume.CLAUSE_ID], 'F1')
+        self.assertEqual(clause[gdrivefs.volume.CLAUSE_ENTRY].title, 'a')
+
+        # What was completely listed doesn't have to be listed again.
+        queries_before = len(self.gd.queries)
+        pr.get_children_from_entry_id('D1')
+        self.assertEqual(len(self.gd.queries), queries_before)
+
+    def test_unchanged_isnt_saved_again(self):
+        self.__populate()
+
+        ms = self.__get_snapshot()
+        ms.save()
+
+        os.unlink(self.__filepath)
+        ms.save()
+        self.assertFalse(os.path.exists(self.__filepath))
+
+        self.cm.at_change_id += 1
+        ms.save()
+        self.assertTrue(os.path.exists(self.__filepath))
+
+    def test_other_account_is_ignored(self):
+        self.__populate()
+        self.__get_snapshot().save()
+
+        self.__forget_everything()
+
+        account_info = gdrivefs.account_info.AccountInfo.get_instance()
+        account_info.root_id = 'other-root'
+
+        ms = self.__mount()
+        self.assertFalse(ms.is_loaded)
+        self.assertEqual(gdrivefs.volume.PathRelations.entry_ll, {})
+
+    def test_unreadable_is_ignored(self):
+        os.makedirs(os.path.dirname(self.__filepath))
+        with open(self.__filepath, 'wb') as f:
+            f.write(b'not a snapshot')
+
+        ms = self.__mount()
+        self.assertFalse(ms.is_loaded)
+
+    def test_failed_catch_up_discards(self):
+        self.__populate()
+        self.__get_snapshot().save()
+
+        self.__forget_everything()
+        self.cm.error = ValueError("Changes could not be read.")
+
+        account_info = gdrivefs.account_info.AccountInfo.get_instance()
+        account_info.largest_change_id = 200
+
+        ms = self.__mount()
+        self.assertFalse(ms.is_loaded)
+        self.assertFalse(gdrivefs.volume.PathRelations().is_cached('F1'))
+
+        # Changes are monitored from now on.
+        self.assertEqual(self.cm.at_change_id, 200)
@@ -0,0 +1,146 @@
+import unittest
+
+try:
+    # Python 3
+    from unittest import mock
+except ImportError:
+    # Python 2.
+    import mock
+
+import gdrivefs.drive
+import gdrivefs.normal_entry
+
+from tests.support import build_entry
+
+_COMPARED_FIELDS = [
+    'id',
+    'title',
+    'title_fs',
+    'mime_type',
+    'labels',
+    'parents',
+    'requires_mimetype',
+    'last_modifying_user_name',
+    'writers_can_share',
+    'owner_names',
+    'editable',
+    'user_permission',
+    'link',
+    'file_size',
+    'file_extension',
+    'md5_checksum',
+    'image_media_metadata',
+    'download_links',
+    'is_visible',
+    'modified_date',
+    'modified_date_epoch',
+    'mtime_byme_date_epoch',
+    'atime_byme_date_epoch',
+]
+
+
+class TestNormalEntry(unittest.TestCase):
+    def __assert_round_trip(self, entry):
+        restored = gdrivefs.normal_entry.NormalEntry(
+                    'test',
+                    entry.get_resource())
+
+        for field in _COMPARED_FIELDS:
+            self.assertEqual(
+                getattr(restored, field),
+                getattr(entry, field),
+                field)
+
+    def test_round_trip_file(self):
+        entry = build_entry(
+                    'F1',
+                    'a.txt',
+                    ['D1', 'D2'],
+                    lastModifyingUserName='Someone',
+                    embedLink='https://example.com/embed',
+                    fileExtension='txt',
+                    imageMediaMetadata={ 'width': 10 },
+                    modifiedByMeDate='2020-01-02T03:04:05.000Z',
+                    lastViewedByMeDate='2020-01-03T03:04:05.000Z',
+                    labels={ 'starred': True })
+
+        self.__assert_round_trip(entry)
+
+    def test_round_trip_document(self):
+        # Documents can only be exported, and have no size until they are.
+        raw_data = build_entry('F1', 'doc', ['D1']).get_resource()
+
+        del raw_data['fileSize']
+        del raw_data['downloadUrl']
+
+        raw_data['mimeType'] = 'application/vnd.google-apps.document'
+        raw_data['exportLinks'] = {
+            'text/plain': 'https://example.com/plain',
+            'application/pdf': 'https://example.com/pdf',
+        }
+
+        entry = gdrivefs.normal_entry.NormalEntry('test', raw_data)
+        self.assertTrue(entry.requires_mimetype)
+
+        self.__assert_round_trip(entry)
+
+    def test_round_trip_directory(self):
+        entry = build_entry('D1', 'dir', ['root'], is_directory=True)
+        self.assertTrue(entry.is_directory)
+
+        self.__assert_round_trip(entry)
+
+    def test_common_values_are_shared(self):
+        entry1 = build_entry('F1', 'a', ['D1'])
+        entry2 = build_entry('F2', 'b', ['D1'])
+
+        self.assertIs(entry1.labels, entry2.labels)
+        self.assertIs(entry1.owner_names, entry2.owner_names)
+        self.assertIs(entry1.mime_type, entry2.mime_type)
+
+    def test_hidden(self):
+        entry = build_entry('F1', 'a', ['D1'], labels={ 'trashed': True })
+        self.assertFalse(entry.is_visible)
+
+    def test_raw_data_is_reread(self):
+        entry = build_entry('F1', 'a', ['D1'])
+
+        gd = mock.Mock()
+        gd.get_entry_resource.return_value = { 'id': 'F1', 'extra': True }
+
+        with mock.patch.object(
+                gdrivefs.drive,
+                'get_gdrive',
+                return_value=gd):
+            self.assertEqual(entry.raw_data, { 'id': 'F1', 'extra': True })
+
+        gd.get_entry_resource.assert_called_once_with('F1')
+
+    def test_provisional_raw_data_is_kept(self):
+        entry = gdrivefs.normal_entry.build_provisional_entry(
+                    'new.txt',
+                    ['D1'],
+                    'text/plain')
+
+        self.assertTrue(entry.is_provisional)
+
+        with mock.patch.object(gdrivefs.drive, 'get_gdrive') as get_gdrive:
+            self.assertEqual(entry.raw_data['title'], 'new.txt')
+
+        self.assertFalse(get_gdrive.called)
+
+    def test_xattrs_without_drive(self):
+        entry = build_entry('F1', 'a', ['D1'])
+
+        gd = mock.Mock()
+        gd.get_entry_resource.side_effect = ValueError("Offline.")
+
+        with mock.patch.object(
+                gdrivefs.drive,
+                'get_gdrive',
+                return_value=gd):
+            xattrs = entry.xattr_data
+
+        # What we keep is still presented.
+        self.assertEqual(xattrs['user.original.title'], 'a')
+        self.assertEqual(xattrs['user.extra.parents'], 'LI(D1)')
@@ -0,0 +1,398 @@
+import hashlib
+import shutil
+import tempfile
+import threading
+import unittest
+import weakref
+
+try:
+    # Python 3
+    from unittest import mock
+except ImportError:
+    # Python 2.
+    import mock
+
+import gdrivefs.content_cache
+import gdrivefs.drive
+import gdrivefs.normal_entry
+import gdrivefs.opened_file
+import gdrivefs.volume
+import gdrivefs.write_back
+
+import tests.support
+
+from tests.support import ROOT_ID, build_entry
+
+
+class _FakeGdrive(tests.support.FakeGdrive):
+    """Also keeps content, and takes uploads."""
+
+    def __init__(self, entries=()):
+        super(_FakeGdrive, self).__init__(entries)
+
+        self.content = {}
+        self.created_count = 0
+        self.downloaded = []
+
+    def __store(self, entry_id, title, parents, data_filepath):
+        if data_filepath is None:
+            data = b''
+        else:
+            with open(data_filepath, 'rb') as f:
+                data = f.read()
+
+        self.content[entry_id] = data
+
+        entry = build_entry(
+                    entry_id,
+                    title,
+                    parents,
+                    fileSize=str(len(data)),
+                    md5Checksum='%s-%d' % (entry_id, len(self.content)))
+
+        self.add(entry)
+        return entry
+
+    def create_file(self, filename, parents, mime_type, data_filepath=None,
+                    **kwargs):
+        self.created_count += 1
+        entry_id = 'CREATED%d' % (self.created_count,)
+
+        return self.__store(entry_id, filename, parents, data_filepath)
+
+    def update_entry(self, normalized_entry, filename=None,
+                     data_filepath=None, parents=None, **kwargs):
+        return self.__store(
+                normalized_entry.id,
+                filename,
+                parents,
+                data_filepath)
+
+    def download_ranges(self, output_fd, normalized_entry, mime_type, ranges,
+                        range_done_cb=None):
+        data = self.content[normalized_entry.id]
+        self.downloaded += ranges
+
+        for (offset, length) in ranges:
+            f = gdrivefs.drive._PositionalWriter(output_fd, offset)
+            f.write(data[offset:offset + length])
+
+
+class _FakePool(object):
+    """Keeps the jobs until they're run explicitly."""
+
+    def __init__(self):
+        self.jobs = []
+
+    def submit(self, f, *args):
+        self.jobs.append((f, args))
+
+    def run_all(self):
+        jobs = self.jobs
+        self.jobs = []
+
+        for (f, args) in jobs:
+            f(*args)
+
+
+class TestOpenedFile(unittest.TestCase):
+    def setUp(self):
+        self.gd = _FakeGdrive([
+            build_entry(ROOT_ID, 'My Drive', [], is_directory=True),
+            build_entry('D1', 'dir', [ROOT_ID], is_directory=True),
+        ])
+
+        tests.support.install_fake_drive(self, self.gd)
+
+        cache_path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_path)
+
+        journal_path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, journal_path)
+
+        entry_cache = gdrivefs.volume.EntryCache
+        self.pool = _FakePool()
+
+        patches = [
+            mock.patch.object(
+                gdrivefs.volume.PathRelations,
+                'get_instance',
+                side_effect=gdrivefs.volume.PathRelations),
+            mock.patch.object(
+                gdrivefs.content_cache,
+                '_instance',
+                gdrivefs.content_cache._ContentCache(
+                    cache_path,
+                    1024 * 1024)),
+            mock.patch.object(
+                gdrivefs.write_back,
+                '_instance',
+                gdrivefs.write_back._WriteBack(journal_path)),
+            mock.patch.object(gdrivefs.opened_file, '_SHARED_FILES', {}),
+            mock.patch.object(
+                gdrivefs.opened_file,
+                '_get_readahead_pool',
+                return_value=self.pool),
+        ]
+
+        for module in (gdrivefs.opened_file, gdrivefs.write_back):
+            patches += [
+                mock.patch.object(module, 'EntryCache', entry_cache),
+                mock.patch.object(module, 'get_gdrive', return_value=self.gd),
+            ]
+
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+        tests.support.set_conf(self, 'file_sparse_reads', True)
+
+        self.pr = gdrivefs.volume.PathRelations()
+        self.pr.register_entry(self.gd.entries[ROOT_ID])
+        self.pr.get_children_from_entry_id(ROOT_ID)
+        self.pr.get_children_from_entry_id('D1')
+
+    def __open(self, entry, **kwargs):
+        return gdrivefs.opened_file.OpenedFile(
+                entry.id,
+                '/dir',
+                entry.title,
+                False,
+                entry.mime_type,
+                **kwargs)
+
+    def test_materialize_keeps_name(self):
+        entry = gdrivefs.normal_entry.build_provisional_entry(
+                    'new.txt',
+                    ['D1'],
+                    'text/plain')
+
+        self.pr.register_entry(entry)
+
+        opened_file = self.__open(entry)
+        opened_file.add_update(0, b'hello')
+        opened_file.flush()
+
+        self.assertEqual(opened_file.entry_id, 'CREATED1')
+
+        # It has the name that it was created with, without having to list
+        # the directory again.
+        clause = self.pr.entry_ll['CREATED1']
+        self.assertEqual(
+            self.pr.get_proper_filenames(clause),
+            { 'D1': 'new.txt' })
+
+        self.assertFalse(self.pr.is_cached(entry.id))
+        self.assertEqual(self.gd.content['CREATED1'], b'hello')
+
+    def test_truncate_after_journaled_flush(self):
+        tests.support.set_conf(self, 'file_write_back', True)
+
+        self.gd.content['F1'] = b'x' * 100
+        entry = build_entry('F1', 'f1', ['D1'], fileSize='100')
+        self.gd.add(entry)
+        self.pr.register_entry(entry)
+
+        opened_file = self.__open(entry)
+        opened_file.add_update(0, b'y' * 100)
+        opened_file.flush()
+        del opened_file
+
+        # The upload is still pending (and holding onto the local copy) when
+        # the file is truncated by path.
+        with mock.patch.object(
+                gdrivefs.opened_file.threading,
+                'Timer') as timer:
+            gdrivefs.opened_file.truncate_by_filepath('/dir/f1', 10)
+
+        (_, flush_truncated, args) = timer.call_args[0]
+        flush_truncated(*args)
+
+        # Close it while the cache is still there.
+        timer.reset_mock()
+        del args
+
+        gdrivefs.write_back.get_write_back().sync_all()
+
+        self.assertEqual(self.gd.content['F1'], b'y' * 10)
+
+    def __open_unchanged(self):
+        """Open a file, and write back exactly what it already has."""
+
+        self.gd.content['F1'] = b'hello'
+        entry = build_entry('F1', 'f1', ['D1'], fileSize='5',
+                            md5Checksum=hashlib.md5(b'hello').hexdigest())
+
+        self.gd.add(entry)
+        self.pr.register_entry(entry)
+
+        opened_file = self.__open(entry)
+        opened_file.add_update(0, b'hello')
+
+        return opened_file
+
+    def test_unchanged_isnt_uploaded(self):
+        opened_file = self.__open_unchanged()
+
+        with mock.patch.object(
+                self.gd,
+                'update_entry',
+                wraps=self.gd.update_entry) as update_entry:
+            opened_file.flush()
+
+        # Only the metadata was sent.
+        self.assertIsNone(update_entry.call_args[1]['data_filepath'])
+
+        # It's no longer dirty.
+        with mock.patch.object(self.gd, 'update_entry') as update_entry:
+            opened_file.flush()
+
+        self.assertFalse(update_entry.called)
+
+    def test_unchanged_isnt_journaled(self):
+        tests.support.set_conf(self, 'file_write_back', True)
+
+        opened_file = self.__open_unchanged()
+        write_back = gdrivefs.write_back.get_write_back()
+
+        with mock.patch.object(write_back, 'stage') as stage:
+            opened_file.flush()
+
+        self.assertFalse(stage.called)
+
+    def test_changed_is_uploaded(self):
+        opened_file = self.__open_unchanged()
+        opened_file.add_update(0, b'j')
+        opened_file.flush()
+
+        self.assertEqual(self.gd.content['F1'], b'jello')
+
+    def test_changed_entry_isnt_mixed_in(self):
+        tests.support.set_conf(self, 'file_sparse_block_size_kb', 1)
+        tests.support.set_conf(self, 'file_readahead_max_kb', 0)
+
+        self.gd.content['F1'] = b'a' * 2048
+        entry = build_entry('F1', 'f1', ['D1'], fileSize='2048',
+                            md5Checksum='v1')
+
+        self.gd.add(entry)
+        self.pr.register_entry(entry)
+
+        opened_file = self.__open(entry)
+        self.assertEqual(opened_file.read(0, 4), b'aaaa')
+
+        # The entry changes remotely while it's open.
+        self.gd.content['F1'] = b'b' * 2048
+
+        changed_entry = build_entry('F1', 'f1', ['D1'], fileSize='2048',
+                                    md5Checksum='v2')
+
+        self.gd.add(changed_entry)
+        self.pr.register_entry(changed_entry)
+
+        with self.assertRaises(gdrivefs.opened_file.fuse.FuseOSError):
+            opened_file.read(1024, 4)
+
+        # What we already had is still there.
+        self.assertEqual(opened_file.read(0, 4), b'aaaa')
+
+    def __open_sequential(self):
+        """Open a file in 1K blocks, and read it sequentially until a
+        read-ahead window has been scheduled.
+        """
+
+        tests.support.set_conf(self, 'file_sparse_block_size_kb', 1)
+        tests.support.set_conf(self, 'file_readahead_min_kb', 2)
+
+        self.gd.content['F1'] = b'a' * 16384
+        entry = build_entry('F1', 'f1', ['D1'], fileSize='16384')
+
+        self.gd.add(entry)
+        self.pr.register_entry(entry)
+
+        opened_file = self.__open(entry)
+
+        for offset in (0, 512, 1024):
+            opened_file.read(offset, 512)
+
+        self.assertEqual(len(self.pool.jobs), 1)
+
+        return opened_file
+
+    def test_readahead(self):
+        opened_file = self.__open_sequential()
+
+        self.pool.run_all()
+        self.assertEqual(self.gd.downloaded[-1], (2048, 2048))
+
+        # The reader doesn't have to download what was read ahead.
+        downloaded_count = len(self.gd.downloaded)
+        self.assertEqual(opened_file.read(1536, 512), b'a' * 512)
+        self.assertEqual(opened_file.read(2048, 1024), b'a' * 1024)
+        self.assertEqual(len(self.gd.downloaded), downloaded_count)
+
+        stats = opened_file.readahead_stats
+        self.assertEqual(stats['readahead_windows'], 2)
+        self.assertEqual(stats['prefetch_hits'], 2)
+
+    def test_readahead_outlives_handle(self):
+        opened_file = self.__open_sequential()
+
+        # The handle is closed before the window is retrieved.
+        opened_file_ref = weakref.ref(opened_file)
+        del opened_file
+
+        self.assertIsNone(opened_file_ref())
+        self.assertEqual(len(gdrivefs.opened_file._SHARED_FILES), 1)
+
+        self.pool.run_all()
+        self.assertEqual(self.gd.downloaded[-1], (2048, 2048))
+
+        # The window was the last one out.
+        self.assertEqual(gdrivefs.opened_file._SHARED_FILES, {})
+
+    def test_written_while_journaling(self):
+        tests.support.set_conf(self, 'file_write_back', True)
+
+        self.gd.content['F1'] = b'x' * 100
+        entry = build_entry('F1', 'f1', ['D1'], fileSize='100')
+        self.gd.add(entry)
+        self.pr.register_entry(entry)
+
+        opened_file = self.__open(entry)
+        opened_file.add_update(0, b'y' * 100)
+
+        write_back = gdrivefs.write_back.get_write_back()
+        stage = write_back.stage
+
+        # Another handle writes while the first copy is being made. It doesn't
+        # have to wait for the copy.
+        def stage_and_write(*args):
+            pending = stage(*args)
+
+            if not written:
+                other = self.__open(entry)
+                t = threading.Thread(
+                        target=other.add_update,
+                        args=(0, b'z' * 10))
+
+                t.start()
+                t.join(5)
+
+                written.append(t.is_alive() is False)
+
+            return pending
+
+        written = []
+
+        with mock.patch.object(
+                write_back,
+                'stage',
+                side_effect=stage_and_write):
+            opened_file.flush()
+
+        self.assertEqual(written, [True])
+
+        write_back.sync_all()
+
+        self.assertEqual(self.gd.content['F1'], b'z' * 10 + b'y' * 90)
@@ -0,0 +1,271 @@
+import unittest
+
+import gdrivefs.volume
+
+import tests.support
+
+from tests.support import ROOT_ID, build_entry
+
+# The module's is replaced while the tests run.
+_ENTRY_CACHE_CLS = gdrivefs.volume.EntryCache
+
+
+def _build_entry_cache(gd):
+    """Build an entry-cache without the cache-agent (and its thread) that it
+    would normally set up.
+    """
+
+    entry_cache = _ENTRY_CACHE_CLS.__new__(_ENTRY_CACHE_CLS)
+    entry_cache._EntryCache__gd = gd
+    entry_cache._CacheClientBase__cache = None
+
+    return entry_cache
+
+
+class _PathRelationsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.gd = tests.support.FakeGdrive([
+            build_entry(ROOT_ID, 'My Drive', [], is_directory=True),
+            build_entry('D1', 'dir', [ROOT_ID], is_directory=True),
+        ])
+
+        tests.support.install_fake_drive(self, self.gd)
+
+        self.pr = gdrivefs.volume.PathRelations()
+        self.pr.register_entry(self.gd.entries[ROOT_ID])
+        self.pr.register_entry(self.gd.entries['D1'])
+
+        # It's empty, so far, and we know it.
+        self.pr.get_children_from_entry_id('D1')
+
+    def register(self, entry_id, title, parent_id='D1'):
+        entry = build_entry(entry_id, title, [parent_id])
+        self.gd.add(entry)
+        self.pr.register_entry(entry)
+
+        return entry
+
+    def remove(self, entry_id):
+        del self.gd.entries[entry_id]
+        self.pr.remove_entry_all(entry_id)
+
+    def get_children(self, entry_id='D1'):
+        return dict((filename, clause[gdrivefs.volume.CLAUSE_ID])
+                    for (filename, clause)
+                    in self.pr.get_children_from_entry_id(entry_id))
+
+
+class TestFilenameVariations(_PathRelationsTestCase):
+    def test_duplicates_get_variations(self):
+        self.register('F1', 'a')
+        self.register('F2', 'a')
+        self.register('F3', 'a')
+        self.register('F4', 'b')
+
+        self.assertEqual(
+            self.get_children(),
+            { 'a': 'F1', 'a (1)': 'F2', 'a (2)': 'F3', 'b': 'F4' })
+
+        clause = self.pr.get_clause_from_path('/dir/a (1)')
+        self.assertEqual(clause[gdrivefs.volume.CLAUSE_ID], 'F2')
+
+        self.assertEqual(
+            self.pr.get_proper_filenames(clause),
+            { 'D1': 'a (1)' })
+
+    def test_freed_variation_is_reused(self):
+        self.register('F1', 'a')
+        self.register('F2', 'a')
+        self.register('F3', 'a')
+
+        self.remove('F2')
+        self.register('F4', 'a')
+
+        self.assertEqual(
+            self.get_children(),
+            { 'a': 'F1', 'a (1)': 'F4', 'a (2)': 'F3' })
+
+        self.remove('F1')
+        self.register('F5', 'a')
+
+        self.assertEqual(self.get_children()['a'], 'F5')
+
+    def test_update_keeps_name(self):
+        self.register('F1', 'a')
+        self.register('F2', 'a')
+
+        self.register('F1', 'a')
+
+        self.assertEqual(self.get_children(), { 'a': 'F1', 'a (1)': 'F2' })
+
+    def test_rename(self):
+        self.register('F1', 'a')
+        self.register('F2', 'a')
+
+        self.register('F1', 'b')
+
+        self.assertEqual(self.get_children(), { 'a (1)': 'F2', 'b': 'F1' })
+        self.assertIsNone(self.pr.get_clause_from_path('/dir/a'))
+
+    def test_listed_twice_under_the_same_parent(self):
+        entry = build_entry('F1', 'a', ['D1', 'D1'])
+        self.gd.add(entry)
+        self.pr.register_entry(entry)
+
+        self.assertEqual(self.get_children(), { 'a': 'F1' })
+
+    def test_multiple_parents(self):
+        self.gd.add(build_entry('D2', 'other', [ROOT_ID], is_directory=True))
+        self.register('F1', 'a', parent_id='D2')
+
+        entry = build_entry('F2', 'a', ['D1', 'D2'])
+        self.gd.add(entry)
+        self.pr.register_entry(entry)
+
+        self.assertEqual(self.get_children('D1'), { 'a': 'F2' })
+        self.assertEqual(
+            self.get_children('D2'),
+            { 'a': 'F1', 'a (1)': 'F2' })
+
+
+class TestNegativeLookups(_PathRelationsTestCase):
+    def setUp(self):
+        super(TestNegativeLookups, self).setUp()
+
+        # The directory hasn't been listed, so names have to be looked-up.
+        self.gd.add(build_entry('D2', 'unlisted', [ROOT_ID],
+                                is_directory=True))
+
+        self.pr.register_entry(self.gd.entries['D2'])
+
+    def __count_queries(self, child_name):
+        return len([query
+                    for query
+                    in self.gd.queries
+                    if query[1] == child_name])
+
+    def test_miss_is_remembered(self):
+        self.assertIsNone(self.pr.get_clause_from_path('/unlisted/x'))
+        self.assertIsNone(self.pr.get_clause_from_path('/unlisted/x'))
+
+        self.assertEqual(self.__count_queries('x'), 1)
+
+    def test_registration_forgets_miss(self):
+        self.assertIsNone(self.pr.get_clause_from_path('/unlisted/x'))
+
+        self.register('F1', 'x', parent_id='D2')
+
+        clause = self.pr.get_clause_from_path('/unlisted/x')
+        self.assertEqual(clause[gdrivefs.volume.CLAUSE_ID], 'F1')
+
+    def test_listed_directory_isnt_queried(self):
+        self.assertIsNone(self.pr.get_clause_from_path('/dir/x'))
+
+        self.assertEqual(self.__count_queries('x'), 0)
+
+    def test_miss_expires(self):
+        # Options given at mount are strings.
+        tests.support.set_conf(self, 'negative_lookup_ttl_s', '0')
+
+        self.assertIsNone(self.pr.get_clause_from_path('/unlisted/x'))
+        self.assertIsNone(self.pr.get_clause_from_path('/unlisted/x'))
+
+        self.assertEqual(self.__count_queries('x'), 2)
+
+    def test_only_most_recent_misses_are_kept(self):
+        tests.support.set_conf(self, 'negative_lookup_cache_size', '2')
+
+        for child_name in ('x', 'y', 'z', 'x'):
+            self.assertIsNone(
+                self.pr.get_clause_from_path('/unlisted/' + child_name))
+
+        self.assertEqual(self.__count_queries('x'), 2)
+
+    def test_removal_forgets_listing(self):
+        self.register('F1', 'a')
+        self.remove('F1')
+
+        # The directory is listed again rather than trusted.
+        self.assertEqual(self.get_children(), {})
+        self.assertEqual(
+            [query for query in self.gd.queries if query[0] == 'D1'],
+            [('D1', None, None), ('D1', None, None)])
+
+    def test_update_keeps_listing(self):
+        self.register('F1', 'a')
+        self.pr.remove_entry_all('F1', is_update=True)
+
+        self.get_children()
+        self.assertEqual(
+            [query for query in self.gd.queries if query[0] == 'D1'],
+            [('D1', None, None)])
+
+
+class TestFaultHandler(unittest.TestCase):
+    def setUp(self):
+        self.gd = tests.support.FakeGdrive([
+            build_entry(ROOT_ID, 'My Drive', [], is_directory=True),
+            build_entry('D1', 'dir', [ROOT_ID], is_directory=True),
+            build_entry('D2', 'other', [ROOT_ID], is_directory=True),
+            build_entry('F1', 'a', ['D1', 'D2']),
+            build_entry('F2', 'b', ['D1']),
+        ])
+
+        tests.support.install_fake_drive(self, self.gd)
+
+        self.pr = gdrivefs.volume.PathRelations.get_instance()
+        self.pr.register_entry(self.gd.entries[ROOT_ID])
+
+    def test_miss_loads_directories(self):
+        entry = _build_entry_cache(self.gd).fault_handler('entry', 'F1')
+        self.assertEqual(entry.id, 'F1')
+
+        # The directories were read together, and listed together.
+        self.assertEqual(self.gd.batches, [['D1', 'D2']])
+        self.assertEqual(self.gd.queries, [(None, None, ('D1', 'D2'))])
+
+        clause = self.pr.get_clause_from_path('/dir/b')
+        self.assertEqual(clause[gdrivefs.volume.CLAUSE_ID], 'F2')
+
+        clause = self.pr.get_clause_from_path('/other/a')
+        self.assertEqual(clause[gdrivefs.volume.CLAUSE_ID], 'F1')
+
+        self.assertEqual(len(self.gd.queries), 1)
+
+    def test_known_directories_arent_read(self):
+        self.pr.register_entry(self.gd.entries['D1'])
+        self.pr.register_entry(self.gd.entries['D2'])
+
+        _build_entry_cache(self.gd).fault_handler('entry', 'F1')
+
+        self.assertEqual(self.gd.batches, [])
+
+    def test_placeholder_sibling_is_filled_in(self):
+        self.gd.add(build_entry('D3', 'sub', ['D1'], is_directory=True))
+        self.gd.add(build_entry('F3', 'c', ['D3']))
+
+        # We only know of the subdirectory through its child, so far.
+        self.pr.register_entry(self.gd.entries['F3'])
+        self.assertFalse(self.pr.is_cached('D3'))
+
+        _build_entry_cache(self.gd).fault_handler('entry', 'F2')
+
+        self.assertTrue(self.pr.is_cached('D3'))
+
+        clause = self.pr.get_clause_from_path('/dir/sub/c')
+        self.assertEqual(clause[gdrivefs.volume.CLAUSE_ID], 'F3')
+
+
+class TestLoadAll(_PathRelationsTestCase):
+    def test_placeholder_is_filled_in(self):
+        self.gd.add(build_entry('D2', 'sub', ['D1'], is_directory=True))
+        self.register('F1', 'a', parent_id='D2')
+
+        # We only know of the subdirectory through its child, so far.
+        self.assertFalse(self.pr.is_cached('D2'))
+
+        self.pr.load_all()
+
+        self.assertTrue(self.pr.is_cached('D2'))
+        self.assertEqual(self.get_children(), { 'sub': 'D2' })
+        self.assertEqual(self.get_children('D2'), { 'a': 'F1' })
@@ -0,0 +1,277 @@
+import os
+import os.path
+import shutil
+import tempfile
+import unittest
+
+try:
+    # Python 3
+    from unittest import mock
+except ImportError:
+    # Python 2.
+    import mock
+
+import httplib2
+import apiclient.errors
+
+import gdrivefs.write_back
+
+_MIME_TYPE = 'text/plain'
+
+
+class _Entry(object):
+    def __init__(self, entry_id):
+        self.id = entry_id
+        self.title = entry_id
+        self.parents = []
+
+
+class _FakeGdrive(object):
+    def __init__(self):
+        self.uploaded = []
+        self.error = None
+
+    def update_entry(self, normalized_entry, data_filepath=None, **kwargs):
+        if self.error is not None:
+            raise self.error
+
+        with open(data_filepath, 'rb') as f:
+            self.uploaded.append((normalized_entry.id, f.read()))
+
+        return normalized_entry
+
+
+class _FakeCache(object):
+    def get(self, entry_id):
+        return _Entry(entry_id)
+
+
+class TestWriteBack(unittest.TestCase):
+    def setUp(self):
+        self.__path = tempfile.mkdtemp()
+        self.__source_filepath = os.path.join(tempfile.mkdtemp(), 'source')
+
+        self.__gd = _FakeGdrive()
+
+        entry_cache = mock.Mock()
+        entry_cache.get_instance.return_value.cache = _FakeCache()
+
+        patches = [
+            mock.patch.object(
+                gdrivefs.write_back,
+                'get_gdrive',
+                return_value=self.__gd),
+            mock.patch.object(gdrivefs.write_back, 'EntryCache', entry_cache),
+            mock.patch.object(gdrivefs.write_back, 'PathRelations'),
+        ]
+
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def tearDown(self):
+        shutil.rmtree(self.__path)
+        shutil.rmtree(os.path.dirname(self.__source_filepath))
+
+    def __get_write_back(self):
+        return gdrivefs.write_back._WriteBack(self.__path)
+
+    def __set_source(self, data):
+        with open(self.__source_filepath, 'wb') as f:
+            f.write(data)
+
+    def __enqueue(self, wb, entry_id, data, listener=None):
+        self.__set_source(data)
+        wb.enqueue(entry_id, _MIME_TYPE, False, self.__source_filepath,
+                   listener=listener)
+
+    def test_enqueue_and_sync(self):
+        wb = self.__get_write_back()
+
+        uploaded_entries = []
+        self.__enqueue(wb, 'E1', b'abc', listener=uploaded_entries.append)
+
+        # What's journaled is a copy.
+        self.__set_source(b'changed')
+
+        self.assertTrue(wb.has_pending('E1'))
+
+        wb.sync('E1')
+
+        self.assertEqual(self.__gd.uploaded, [('E1', b'abc')])
+        self.assertEqual([e.id for e in uploaded_entries], ['E1'])
+        self.assertFalse(wb.has_pending('E1'))
+        self.assertEqual(os.listdir(self.__path), [])
+
+    def test_enqueue_replaces(self):
+        wb = self.__get_write_back()
+
+        self.__enqueue(wb, 'E1', b'first')
+        self.__enqueue(wb, 'E1', b'second')
+
+        # Only the newest data and its record are kept.
+        self.assertEqual(len(os.listdir(self.__path)), 2)
+
+        wb.sync_all()
+
+        self.assertEqual(self.__gd.uploaded, [('E1', b'second')])
+
+    def test_enqueue_superseded_while_copying(self):
+        wb = self.__get_write_back()
+
+        # Another flush of the same entry is journaled while we're still
+        # copying ours.
+        copyfileobj = shutil.copyfileobj
+        def copy_and_race(source_f, data_f):
+            copyfileobj(source_f, data_f)
+
+            if not race_done:
+                race_done.append(True)
+
+                newer_filepath = self.__source_filepath + '.newer'
+                with open(newer_filepath, 'wb') as f:
+                    f.write(b'newer')
+
+                wb.enqueue('E1', _MIME_TYPE, False, newer_filepath)
+
+        uploaded_entries = []
+        race_done = []
+
+        with mock.patch.object(
+                gdrivefs.write_back.shutil,
+                'copyfileobj',
+                side_effect=copy_and_race):
+            self.__enqueue(wb, 'E1', b'older',
+                           listener=uploaded_entries.append)
+
+        # Ours was dropped rather than replacing the newer content.
+        self.assertEqual(uploaded_entries, [None])
+
+        wb.sync_all()
+
+        self.assertEqual(self.__gd.uploaded, [('E1', b'newer')])
+
+    def test_replaced_listener_is_told(self):
+        wb = self.__get_write_back()
+
+        first_entries = []
+        self.__enqueue(wb, 'E1', b'first', listener=first_entries.append)
+
+        second_entries = []
+        self.__enqueue(wb, 'E1', b'second', listener=second_entries.append)
+
+        self.assertEqual(first_entries, [None])
+
+        wb.sync_all()
+
+        self.assertEqual([e.id for e in second_entries], ['E1'])
+
+    def test_replaced_while_uploading_listener_is_told(self):
+        wb = self.__get_write_back()
+
+        first_entries = []
+        self.__enqueue(wb, 'E1', b'first', listener=first_entries.append)
+
+        second_entries = []
+        def upload_and_replace(normalized_entry, data_filepath=None,
+                               **kwargs):
+            self.__gd.update_entry = update_entry
+
+            self.__enqueue(
+                wb,
+                'E1',
+                b'second',
+                listener=second_entries.append)
+
+            return update_entry(
+                    normalized_entry,
+                    data_filepath=data_filepath,
+                    **kwargs)
+
+        update_entry = self.__gd.update_entry
+        self.__gd.update_entry = upload_and_replace
+
+        wb.sync('E1')
+
+        # The first one was sent, but it isn't the current content.
+        self.assertEqual(first_entries, [None])
+        self.assertEqual([e.id for e in second_entries], ['E1'])
+
+        self.assertEqual(
+            self.__gd.uploaded,
+            [('E1', b'first'), ('E1', b'second')])
+
+    def test_stage_and_discard(self):
+        wb = self.__get_write_back()
+
+        with open(self.__source_filepath, 'wb') as f:
+            f.write(b'abc')
+
+        with open(self.__source_filepath, 'rb') as f:
+            pending = wb.stage('E1', _MIME_TYPE, False, f)
+
+        # Nothing is pending until it's committed.
+        self.assertFalse(wb.has_pending('E1'))
+
+        wb.discard(pending)
+        self.assertEqual(os.listdir(self.__path), [])
+
+    def test_destroy_without_init(self):
+        wb = self.__get_write_back()
+        self.__enqueue(wb, 'E1', b'abc')
+
+        wb.mount_destroy()
+
+        self.assertEqual(self.__gd.uploaded, [('E1', b'abc')])
+
+    def test_recovery(self):
+        wb = self.__get_write_back()
+        self.__enqueue(wb, 'E1', b'abc')
+
+        # Data that never got a record is left-over from a crash.
+        with open(os.path.join(self.__path, 'E2.99.data'), 'wb') as f:
+            f.write(b'partial')
+
+        wb = self.__get_write_back()
+
+        self.assertTrue(wb.has_pending('E1'))
+        self.assertFalse(wb.has_pending('E2'))
+        self.assertFalse(
+            os.path.exists(os.path.join(self.__path, 'E2.99.data')))
+
+        wb.sync_all()
+
+        self.assertEqual(self.__gd.uploaded, [('E1', b'abc')])
+
+    def test_failure_is_retried(self):
+        wb = self.__get_write_back()
+        self.__enqueue(wb, 'E1', b'abc')
+
+        self.__gd.error = ValueError("Upload failed.")
+
+        with self.assertRaises(ValueError):
+            wb.sync('E1')
+
+        # It stays journaled.
+        self.assertTrue(wb.has_pending('E1'))
+
+        self.__gd.error = None
+        wb.sync('E1')
+
+        self.assertEqual(self.__gd.uploaded, [('E1', b'abc')])
+
+    def test_entry_gone(self):
+        wb = self.__get_write_back()
+
+        uploaded_entries = []
+        self.__enqueue(wb, 'E1', b'abc', listener=uploaded_entries.append)
+
+        self.__gd.error = apiclient.errors.HttpError(
+                            httplib2.Response({ 'status': 404 }),
+                            b'')
+
+        wb.sync('E1')
+
+        self.assertEqual(uploaded_entries, [None])
+        self.assertFalse(wb.has_pending('E1'))
+        self.assertEqual(os.listdir(self.__path), [])